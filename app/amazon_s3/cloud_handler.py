@@ -1,37 +1,97 @@
 import boto3
 import aws_encryption_sdk
+from aws_encryption_sdk import CommitmentPolicy
+from aws_encryption_sdk.identifiers import Algorithm
+from aws_encryption_sdk.caches.local import LocalCryptoMaterialsCache
+from aws_encryption_sdk.materials_managers.caching import CachingCryptoMaterialsManager
 from botocore.configloader import load_config
+from botocore.exceptions import ClientError
 import os
 
+from app.amazon_s3.key_provider import DEFAULT_KEY_ID
+from core.tools.progress import ProgressReader
+
+# Non-signing suite with 256 bits data keys (wrapped by the HSM), safe to cache
+ALGORITHM = Algorithm.AES_256_GCM_HKDF_SHA512_COMMIT_KEY
+FRAME_LENGTH = 1024 * 1024  # Plaintext bytes per authenticated frame of a message
+
 
 class AmazonS3CloudHandler:
     """
     Class to handle requests to the cloud.
     To keep compatibility, implement the public methods.
+
+    Objects are encrypted with the AWS Encryption SDK (framed messages, streamed from and to the files).
+    Their data keys are wrapped by the HSM (see S3KEKProvider).
+
+    Data key caching: a data key is reused for max_messages_encrypted objects or max_age seconds,
+    whichever comes first, so that uploading many objects does not query the HSM for each object.
+    The unwrapped keys of the downloaded objects are cached the same way.
+
+    Transfers can report their progress through a callback progress(done, total), called in the
+    transferring threads: bytes of the file encrypted (upload) or of the object read (download).
+    It can raise (e.g. TransferCancelled) to abort the transfer.
     """
-    def __init__(self, credentials_path = None):
+    def __init__(self, key_provider, credentials_path = None, endpoint_url = None, key_id = DEFAULT_KEY_ID,
+                 max_age = 300.0, max_messages_encrypted = 1000, cache_capacity = 100):
+        """
+        Args:
+            key_provider (S3KEKProvider): Master key provider backed by the keystores.
+            credentials_path (str): Directory of the "credentials" and "config" files, None to use the
+                default AWS configuration.
+            endpoint_url (str): S3 endpoint, e.g. a local S3 stand-in (moto server: "http://127.0.0.1:5000").
+            key_id (str): Master key, "<keystore>/<key slot>".
+            max_age (float): Seconds a data key is cached.
+            max_messages_encrypted (int): Objects encrypted with a cached data key.
+            cache_capacity (int): Data keys kept in the cache.
+        """
         self.__service_name = "AmazonS3"
 
-        self.boto3_resource = None
+        self.s3_client = None
         self.connected = False
-        #self.key_provider = key_provider
+        self.key_provider = key_provider
+        self.key_provider.add_master_key(key_id)
         self.credentials_path = credentials_path
+        self.endpoint_url = endpoint_url
+        self.region = None
+
+        self.encryption_client = aws_encryption_sdk.EncryptionSDKClient(
+            commitment_policy=CommitmentPolicy.REQUIRE_ENCRYPT_REQUIRE_DECRYPT
+        )
+        self.materials_manager = CachingCryptoMaterialsManager(
+            master_key_provider=self.key_provider,
+            cache=LocalCryptoMaterialsCache(cache_capacity),
+            max_age=max_age,
+            max_messages_encrypted=max_messages_encrypted,
+        )
 
     def get_list_containers(self) -> list[str]:
         """
         Returns:
             list[string]: the list of the names of containers (or buckets).
         """
-        return list(self.boto3_resource.buckets.all())
+        return [bucket["Name"] for bucket in self.s3_client.list_buckets()["Buckets"]]
 
     def get_list_files(self, container_name: str) -> list[str]:
         """
         Returns:
             list[string]: the list of the names of files (or blobs) inside a container.
         """
-        container = self.boto3_resource.Bucket(container_name)
-        #TODO
-        return []
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        return [
+            item["Key"]
+            for page in paginator.paginate(Bucket=container_name)
+            for item in page.get("Contents", [])
+        ]
+
+    def iter_pages_files(self, container_name: str, page_size: int = 1000):
+        """
+        Yields:
+            list[string]: the names of the files of a container, one page (one listing request) at a time.
+        """
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=container_name, PaginationConfig={"PageSize": page_size}):
+            yield [item["Key"] for item in page.get("Contents", [])]
 
     def connect_hsm(self):
         """
@@ -43,49 +103,31 @@ class AmazonS3CloudHandler:
         """
         Connects to the cloud (if needed).
         """
-
-        #TODO error handling
-        creds_data = load_config(os.path.join(self.credentials_path, "credentials"))
-        creds_default_profile = creds_data["profiles"]["default"]
-
-        aws_access_key_id = creds_default_profile.get("aws_access_key_id")
-        aws_secret_access_key = creds_default_profile.get("aws_secret_access_key")
-
-        config_data = load_config(os.path.join(self.credentials_path, "config"))
-        config_default_profile = config_data.get("default", {})
-
-        region = config_default_profile.get("region")
-
-        self.boto3_resource = boto3.resource(
-            's3',
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            region_name=region
+        credentials = {}
+        if self.credentials_path is not None:
+            try:
+                creds_data = load_config(os.path.join(self.credentials_path, "credentials"))
+                creds_default_profile = creds_data["profiles"].get("default", {})
+                credentials["aws_access_key_id"] = creds_default_profile.get("aws_access_key_id")
+                credentials["aws_secret_access_key"] = creds_default_profile.get("aws_secret_access_key")
+
+                config_data = load_config(os.path.join(self.credentials_path, "config"))
+                self.region = config_data["profiles"].get("default", {}).get("region")
+            except Exception as e:
+                print("Could not read Amazon S3 credentials, using the default AWS configuration:", e)
+                credentials = {}
+
+        self.s3_client = boto3.client(
+            "s3",
+            region_name=self.region,
+            endpoint_url=self.endpoint_url,
+            **credentials,
         )
-
-        # try:
-        #     print(self.boto3_client.list_buckets())
-        # except Exception as e:
-        #     print("Error connecting to Amazon S3")
-        #     print(e)
-        #     return
-
-
-        # try:
-        #     config = load_config(self.credentials_path)
-        #
-        # except Exception:
-        #     print("Could not read Azure credentials. Using Azurite credentials.")
-        #     connection_string = ("DefaultEndpointsProtocol=http;"
-        #     "AccountName=devstoreaccount1;"
-        #     "AccountKey=Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw==;"
-        #     "BlobEndpoint=http://127.0.0.1:10000/devstoreaccount1;"
-        #     "QueueEndpoint=http://127.0.0.1:10001/devstoreaccount1;"
-        #     "TableEndpoint=http://127.0.0.1:10002/devstoreaccount1;")
+        self.region = self.s3_client.meta.region_name
         self.connected = True
         print("Connected to", self.__service_name)
 
-    def upload(self, path: str, container_name: str, filename: str):
+    def upload(self, path: str, container_name: str, filename: str, progress = None):
         """
         Encrypt then upload a file on the cloud.
 
@@ -93,12 +135,29 @@ class AmazonS3CloudHandler:
             path (str): the path of the file to upload.
             container_name (str): the name of the container to upload it to.
             filename (str): the name of the file on the cloud.
+            progress (callable): progress(bytes encrypted, size of the file), see the class.
         """
-        blob_client = self.__init_encryption_blob(container_name, filename)
         with open(path, "rb") as stream:
-            blob_client.upload_blob(stream, overwrite=True)
-
-    def download(self, path: str, container_name: str, filename: str):
+            # The plaintext length is needed to use (and account for) a cached data key
+            size = os.fstat(stream.fileno()).st_size
+            if progress is not None:
+                stream = ProgressReader(stream, progress, size)
+            with self.encryption_client.stream(
+                mode="e",
+                source=stream,
+                materials_manager=self.materials_manager,
+                algorithm=ALGORITHM,
+                frame_length=FRAME_LENGTH,
+                source_length=size,
+            ) as encryptor:
+                self.s3_client.upload_fileobj(
+                    encryptor,
+                    container_name,
+                    filename,
+                    ExtraArgs={"Metadata": {"encryption": "aws-encryption-sdk-hsm"}},
+                )
+
+    def download(self, path: str, container_name: str, filename: str, progress = None):
         """
         Decrypt then download a file from the cloud.
 
@@ -106,29 +165,42 @@ class AmazonS3CloudHandler:
             path (str): the path of the file on the computer.
             container_name (str): the name of the container to download it from.
             filename (str): the name of the file in the container.
+            progress (callable): progress(bytes of the object read, size of the object), see the class.
         """
-        blob_client = self.__init_encryption_blob(container_name, filename)
-        with open(path, "wb") as file:
-            data = blob_client.download_blob()
-            file.write(data.readall())
+        response = self.s3_client.get_object(Bucket=container_name, Key=filename)
+        body = response["Body"]
+        if progress is not None:
+            body = ProgressReader(body, progress, response.get("ContentLength"))
+        # Frames are authenticated one by one: the file only replaces path once fully decrypted
+        part_path = path + ".part"
+        try:
+            with body, self.encryption_client.stream(
+                mode="d",
+                source=body,
+                materials_manager=self.materials_manager,
+            ) as decryptor, open(part_path, "wb") as file:
+                for chunk in decryptor:
+                    file.write(chunk)
+            os.replace(part_path, path)
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
 
     def create_container(self, container_name: str):
         """
         Argument:
             container_name (str): the name of the container (or bucket) to create.
         """
+        arguments = {"Bucket": container_name}
+        if self.region and self.region != "us-east-1":
+            arguments["CreateBucketConfiguration"] = {"LocationConstraint": self.region}
         try:
-            self.blob_service_client.create_container(name=container_name)
-        except ResourceExistsError:
+            self.s3_client.create_bucket(**arguments)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("BucketAlreadyOwnedByYou", "BucketAlreadyExists"):
+                raise
             print('A container with this name already exists.')
 
     def get_service_name(self):
         return self.__service_name
-
-
-    def __init_encryption_blob(self, container_name, filename):
-        blob_client = self.blob_service_client.get_container_client(container_name).get_blob_client(filename)
-        blob_client.require_encryption = True
-        blob_client.key_encryption_key = self.key_provider
-        blob_client.encryption_version = '2.0'
-        return blob_client
@@ -1,13 +1,17 @@
+import os
+
 from app.graphics.tinker import AppWindow
 from app.amazon_s3.cloud_handler import AmazonS3CloudHandler
+from app.amazon_s3.key_provider import S3KEKProvider
 
 
 def main():
 
     path = "config/amazon_s3"
+    key_provider = S3KEKProvider()
 
-
-    cloud = AmazonS3CloudHandler(path)
+    # e.g. S3_ENDPOINT_URL=http://127.0.0.1:5000 for a local moto server
+    cloud = AmazonS3CloudHandler(key_provider, path, endpoint_url=os.environ.get("S3_ENDPOINT_URL"))
 
     win = AppWindow(cloud)
     win.run()
@@ -0,0 +1,101 @@
+import os
+
+from aws_encryption_sdk.key_providers.base import MasterKey, MasterKeyConfig, MasterKeyProvider, MasterKeyProviderConfig
+from aws_encryption_sdk.structures import DataKey, EncryptedDataKey
+from aws_encryption_sdk.exceptions import IncorrectMasterKeyError
+
+from core.tools.read_config import readconfig
+from core.tls.hsm_connection import ConnectionWorker
+from core.request.local import LocalRequest
+
+# Master key used by default: key slot 1 of key17.com
+DEFAULT_KEY_ID = "key17.com/1"
+PROVIDER_ID = "keystore-tls-hsm"
+
+
+class HSMMasterKeyConfig(MasterKeyConfig):
+    provider_id = PROVIDER_ID
+
+
+class HSMMasterKey(MasterKey):
+    """
+    Master key of the AWS Encryption SDK held by a keystore: data keys are wrapped and unwrapped
+    by the HSM (wrap_cek / unwrap_cek), through the ConnectionWorker of the keystore.
+
+    The key ID is "<keystore>/<key slot>", e.g. "key17.com/1".
+    Only algorithm suites with 256 bits data keys can be used (e.g. AES_256_GCM_HKDF_SHA512_COMMIT_KEY).
+    """
+
+    provider_id = PROVIDER_ID
+    _config_class = HSMMasterKeyConfig
+
+    def __init__(self, **kwargs):
+        key_id = self.config.key_id
+        if isinstance(key_id, bytes):
+            key_id = key_id.decode("utf-8")
+        keystore, _, slot = key_id.rpartition("/")
+        if not keystore or not slot.isdigit():
+            raise ValueError(f"Invalid key ID (expected <keystore>/<key slot>): {key_id}")
+        self.__keystore = keystore
+        self.__slot = int(slot)
+
+    def __request(self, method):
+        request = LocalRequest(self.__keystore, method)
+        ConnectionWorker.dispatch_request(request)
+        return request.get_response()
+
+    @staticmethod
+    def __check_algorithm(algorithm):
+        if algorithm.kdf_input_len != 32:
+            raise IncorrectMasterKeyError("The HSM only wraps 256 bits data keys.")
+
+    def _generate_data_key(self, algorithm, encryption_context):
+        HSMMasterKey.__check_algorithm(algorithm)
+        data_key = os.urandom(algorithm.kdf_input_len)
+        return DataKey(
+            key_provider=self.key_provider,
+            data_key=data_key,
+            encrypted_data_key=self.__request(("wrap_cek", self.__slot, data_key)),
+        )
+
+    def _encrypt_data_key(self, data_key, algorithm, encryption_context):
+        HSMMasterKey.__check_algorithm(algorithm)
+        return EncryptedDataKey(
+            key_provider=self.key_provider,
+            encrypted_data_key=self.__request(("wrap_cek", self.__slot, data_key.data_key)),
+        )
+
+    def _decrypt_data_key(self, encrypted_data_key, algorithm, encryption_context):
+        HSMMasterKey.__check_algorithm(algorithm)
+        return DataKey(
+            key_provider=self.key_provider,
+            data_key=self.__request(("unwrap_cek", self.__slot, encrypted_data_key.encrypted_data_key)),
+            encrypted_data_key=encrypted_data_key.encrypted_data_key,
+        )
+
+
+class S3KEKProvider(MasterKeyProvider):
+    """
+    Master key provider of the AWS Encryption SDK backed by the keystores (see HSMMasterKey).
+
+    Example:
+        key_provider = S3KEKProvider()
+        key_provider.add_master_key("key17.com/1")
+    """
+
+    provider_id = PROVIDER_ID
+    _config_class = MasterKeyProviderConfig
+
+    def __init__(self, **kwargs):
+        pass
+
+    def _new_master_key(self, key_id):
+        return HSMMasterKey(key_id=key_id)
+
+    @staticmethod
+    def connect():
+        keystores = readconfig("config.yaml")
+        for *keystore_infos, options in keystores:
+            ConnectionWorker(*keystore_infos, **options)
+
+        ConnectionWorker.start_all()
@@ -1,19 +1,38 @@
 from azure.storage.blob import BlobServiceClient, ContainerClient
 from azure.core.exceptions import ResourceExistsError, HttpResponseError
+import os
+
+MAX_BLOCK_SIZE = 8 * 1024 * 1024  # Block of a parallel upload
+MAX_SINGLE_PUT_SIZE = 16 * 1024 * 1024  # Largest file uploaded in one request
+MAX_CHUNK_GET_SIZE = 8 * 1024 * 1024  # Range of a parallel download
+MAX_CONCURRENCY = 8
 
 
 class AzureCloudHandler:
     """
     Class to handle requests to the cloud.
     To keep compatibility, implement the public methods.
+
+    Large files are uploaded in blocks of max_block_size bytes and downloaded in ranges of
+    max_chunk_get_size bytes, max_concurrency at a time (client-side encryption v2 encrypts
+    each 4 MiB region separately, so blocks can be encrypted and sent in parallel).
+
+    Transfers can report their progress through a callback progress(done, total), called by the SDK
+    (progress_hook) in the transferring threads. It can raise (e.g. TransferCancelled) to abort the transfer.
     """
-    def __init__(self, key_provider, credentials_path = None):
+    def __init__(self, key_provider, credentials_path = None, max_concurrency = MAX_CONCURRENCY,
+                 max_block_size = MAX_BLOCK_SIZE, max_single_put_size = MAX_SINGLE_PUT_SIZE,
+                 max_chunk_get_size = MAX_CHUNK_GET_SIZE):
         self.__service_name = "Azure"
 
         self.blob_service_client = None
         self.connected = False
         self.key_provider = key_provider
         self.credentials_path = credentials_path
+        self.max_concurrency = max_concurrency
+        self.max_block_size = max_block_size
+        self.max_single_put_size = max_single_put_size
+        self.max_chunk_get_size = max_chunk_get_size
 
     def get_list_containers(self) -> list[str]:
         """
@@ -31,6 +50,15 @@ class AzureCloudHandler:
         container = self.blob_service_client.get_container_client(container_name)
         return [file.name for file in container.list_blobs()]
 
+    def iter_pages_files(self, container_name: str, page_size: int = 1000):
+        """
+        Yields:
+            list[string]: the names of the files of a container, one page (one listing request) at a time.
+        """
+        container = self.blob_service_client.get_container_client(container_name)
+        for page in container.list_blobs(results_per_page=page_size).by_page():
+            yield [file.name for file in page]
+
     def connect_hsm(self):
         """
         Connects to the HSM.
@@ -53,11 +81,17 @@ class AzureCloudHandler:
             "QueueEndpoint=http://127.0.0.1:10001/devstoreaccount1;"
             "TableEndpoint=http://127.0.0.1:10002/devstoreaccount1;")
 
-        self.blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+        self.blob_service_client = BlobServiceClient.from_connection_string(
+            connection_string,
+            max_block_size=self.max_block_size,
+            max_single_put_size=self.max_single_put_size,
+            max_chunk_get_size=self.max_chunk_get_size,
+            max_single_get_size=self.max_chunk_get_size,
+        )
         self.connected = True
         print("Connected to the cloud.")
 
-    def upload(self, path: str, container_name: str, filename: str):
+    def upload(self, path: str, container_name: str, filename: str, progress = None):
         """
         Encrypt then upload a file on the cloud.
 
@@ -65,12 +99,14 @@ class AzureCloudHandler:
             path (str): the path of the file to upload.
             container_name (str): the name of the container to upload it to.
             filename (str): the name of the file on the cloud.
+            progress (callable): progress(bytes uploaded, total), see the class.
         """
         blob_client = self.__init_encryption_blob(container_name, filename)
         with open(path, "rb") as stream:
-            blob_client.upload_blob(stream, overwrite=True)
+            blob_client.upload_blob(stream, overwrite=True, max_concurrency=self.max_concurrency,
+                                    progress_hook=progress)
 
-    def download(self, path: str, container_name: str, filename: str):
+    def download(self, path: str, container_name: str, filename: str, progress = None):
         """
         Decrypt then download a file from the cloud.
 
@@ -78,11 +114,20 @@ class AzureCloudHandler:
             path (str): the path of the file on the computer.
             container_name (str): the name of the container to download it from.
             filename (str): the name of the file in the container.
+            progress (callable): progress(bytes downloaded, total), see the class.
         """
         blob_client = self.__init_encryption_blob(container_name, filename)
-        with open(path, "wb") as file:
-            data = blob_client.download_blob()
-            file.write(data.readall())
+        # The file only replaces path once fully downloaded
+        part_path = path + ".part"
+        try:
+            with open(part_path, "wb") as file:
+                data = blob_client.download_blob(max_concurrency=self.max_concurrency, progress_hook=progress)
+                data.readinto(file)
+            os.replace(part_path, path)
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
 
     def create_container(self, container_name: str):
         """
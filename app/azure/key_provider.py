@@ -1,8 +1,12 @@
-from core.tools.read_config import readconfig
+from core.tools.read_config import readconfig, read_unwrap_cache_config
+from core.tools.key_cache import UnwrappedKeyCache
 from core.tls.hsm_connection import ConnectionWorker
 from core.request.local import LocalRequest
 
 class AzureKEKProvider:
+    # Cache of the unwrapped keys, disabled unless enable_unwrap_cache() is called (connect() does it
+    # with an "unwrap_cache" section in config.yaml)
+    unwrap_cache = None
 
     @staticmethod
     def wrap_key(key):
@@ -13,13 +17,31 @@ class AzureKEKProvider:
         wrapped = request17.get_response()
         return wrapped
 
+    @classmethod
+    def unwrap_key(cls, wrapped, algorithm):
+        if cls.unwrap_cache is not None:
+            stripped_key = cls.unwrap_cache.get_or_unwrap(wrapped, cls.__unwrap_key, "key9.com/1")
+        else:
+            stripped_key = cls.__unwrap_key(wrapped)
+        full_key = b"2.0\00\00\00\00\00" + stripped_key
+        return full_key
+
     @staticmethod
-    def unwrap_key(wrapped, algorithm):
+    def __unwrap_key(wrapped):
         request17 = LocalRequest("key9.com", ("unwrap_cek", 1, wrapped))
         ConnectionWorker.dispatch_request(request17)
-        stripped_key = request17.get_response()
-        full_key = b"2.0\00\00\00\00\00" + stripped_key
-        return full_key
+        return request17.get_response()
+
+    @classmethod
+    def enable_unwrap_cache(cls, max_entries=1024, ttl=300):
+        """
+        Keep the unwrapped keys in memory, so that downloading a blob again does not query the HSM.
+
+        Args:
+            max_entries (int): Maximum number of keys kept.
+            ttl (float): Seconds a key is kept.
+        """
+        cls.unwrap_cache = UnwrappedKeyCache(max_entries, ttl)
 
     @staticmethod
     def get_key_wrap_algorithm():
@@ -27,10 +49,14 @@ class AzureKEKProvider:
     @staticmethod
     def get_kid():
         return 1
-    @staticmethod
-    def connect():
+    @classmethod
+    def connect(cls):
         keystores = readconfig("config.yaml")
-        for keystore_infos in keystores:
-            ConnectionWorker(*keystore_infos)
+        for *keystore_infos, options in keystores:
+            ConnectionWorker(*keystore_infos, **options)
+
+        unwrap_cache = read_unwrap_cache_config("config.yaml")
+        if unwrap_cache is not None:
+            cls.enable_unwrap_cache(**unwrap_cache)
 
         ConnectionWorker.start_all()
@@ -0,0 +1,242 @@
+import argparse
+import os
+import queue
+import tempfile
+import threading
+import time
+
+
+class StageStats:
+    """
+    Throughput of a stage of the pipeline.
+
+    Attributes:
+        name (str): Name of the stage.
+        items (int): Files processed.
+        bytes (int): Bytes processed.
+        errors (int): Files that failed in the stage.
+        busy (float): Seconds spent processing, summed over the threads of the stage.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.bytes = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.__lock = threading.Lock()
+
+    def add(self, items, size, busy, errors = 0):
+        with self.__lock:
+            self.items += items
+            self.bytes += size
+            self.busy += busy
+            self.errors += errors
+
+    def report(self, elapsed):
+        """
+        Args:
+            elapsed (float): Duration of the whole pipeline.
+
+        Returns:
+            str: Files/s and MB/s of the stage over the pipeline, and per busy thread.
+        """
+        per_thread = self.items / self.busy if self.busy else 0
+        return (
+            f"{self.name:>8}: {self.items} files, {self.errors} errors, "
+            f"{self.items / elapsed:.1f} files/s, {self.bytes / elapsed / 1e6:.1f} MB/s "
+            f"({per_thread:.1f} files/s per busy thread)"
+        )
+
+
+class BulkUploader:
+    """
+    Upload many files to a bucket, overlapping the three stages of an upload:
+    - wrap: keys are drawn and wrapped by the HSM in batches (wrap_keys of the key provider,
+      8 keys per HSM command, the commands being pipelined by the ConnectionWorker),
+    - encrypt: encrypt_workers threads encrypt the files to temporary files (streaming envelope),
+    - upload: upload_workers threads upload the encrypted files.
+
+    The stages are linked by bounded queues: a slow stage holds the previous ones back,
+    so that at most queue_size encrypted files wait on disk for their upload.
+    A file that fails is reported and does not stop the others.
+    """
+
+    def __init__(self, handler, wrap_batch = 64, encrypt_workers = None, upload_workers = 16, queue_size = 64):
+        """
+        Args:
+            handler (GoogleCloudHandler): Connected handler (cloud and HSM).
+            wrap_batch (int): Keys wrapped at once.
+            encrypt_workers (int): Encryption threads, by default one per CPU.
+            upload_workers (int): Uploads in flight.
+            queue_size (int): Files waiting between two stages.
+        """
+        self.handler = handler
+        self.wrap_batch = wrap_batch
+        self.encrypt_workers = encrypt_workers or os.cpu_count() or 1
+        self.upload_workers = upload_workers
+        self.queue_size = queue_size
+        self.stats = {}
+        self.failures = []  # (path, stage name, exception)
+        self.__lock = threading.Lock()
+
+    def __fail(self, path, stage, error):
+        with self.__lock:
+            self.failures.append((path, stage, error))
+        print(f"[Error] {stage} of {path} failed: {error}")
+
+    @staticmethod
+    def list_directory(directory, prefix = ""):
+        """
+        Yields:
+            tuple: (path, blob name) of every file of a directory tree, the blob name being the
+            relative path (with "/" separators) after the prefix.
+        """
+        for root, _, files in os.walk(directory):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                yield path, prefix + os.path.relpath(path, directory).replace(os.sep, "/")
+
+    def upload_directory(self, directory, container_name, prefix = ""):
+        """
+        Upload a directory tree. See upload_files.
+        """
+        return self.upload_files(BulkUploader.list_directory(directory, prefix), container_name)
+
+    def upload_files(self, files, container_name):
+        """
+        Upload files to a bucket.
+
+        Args:
+            files (iterable): (path, blob name) of the files.
+            container_name (str): The name of the bucket.
+
+        Returns:
+            list[tuple]: The failures (path, stage name, exception), empty if every file was uploaded.
+        """
+        self.stats = {name: StageStats(name) for name in ("wrap", "encrypt", "upload")}
+        self.failures = []
+        encrypt_queue = queue.Queue(self.queue_size)  # (path, blob name, key, ck)
+        upload_queue = queue.Queue(self.queue_size)  # (path, blob name, ciphertext path, size, ck)
+
+        started = time.monotonic()
+        with tempfile.TemporaryDirectory() as directory:
+            encrypters = [
+                threading.Thread(target=self.__encrypt, args=(encrypt_queue, upload_queue, directory), daemon=True)
+                for _ in range(self.encrypt_workers)
+            ]
+            uploaders = [
+                threading.Thread(target=self.__upload, args=(upload_queue, container_name), daemon=True)
+                for _ in range(self.upload_workers)
+            ]
+            for thread in encrypters + uploaders:
+                thread.start()
+
+            try:
+                self.__wrap(files, encrypt_queue)
+            finally:
+                # Stop each stage once the previous one is done
+                for _ in encrypters:
+                    encrypt_queue.put(None)
+                for thread in encrypters:
+                    thread.join()
+                for _ in uploaders:
+                    upload_queue.put(None)
+                for thread in uploaders:
+                    thread.join()
+
+        elapsed = time.monotonic() - started
+        print(f"Uploaded {self.stats['upload'].items} files in {elapsed:.1f}s")
+        for stats in self.stats.values():
+            print(stats.report(elapsed))
+        return self.failures
+
+    def __wrap(self, files, encrypt_queue):
+        """Wrap stage (calling thread): draw and wrap the keys of the files, a batch at a time."""
+        batch = []
+        for path, filename in files:
+            batch.append((path, filename))
+            if len(batch) == self.wrap_batch:
+                self.__wrap_batch(batch, encrypt_queue)
+                batch = []
+        if batch:
+            self.__wrap_batch(batch, encrypt_queue)
+
+    def __wrap_batch(self, batch, encrypt_queue):
+        key_provider = self.handler.key_provider
+        keys = [os.urandom(32) for _ in batch]
+        start = time.monotonic()
+        try:
+            if hasattr(key_provider, "wrap_keys"):
+                cks = key_provider.wrap_keys(keys)
+            else:
+                cks = [key_provider.wrap_key(key) for key in keys]
+        except Exception as e:
+            self.stats["wrap"].add(0, 0, time.monotonic() - start, len(batch))
+            for path, _ in batch:
+                self.__fail(path, "wrap", e)
+            return
+        self.stats["wrap"].add(len(batch), 0, time.monotonic() - start)
+
+        for (path, filename), key, ck in zip(batch, keys, cks):
+            encrypt_queue.put((path, filename, key, ck))  # Blocks while the encryption is behind
+
+    def __encrypt(self, encrypt_queue, upload_queue, directory):
+        """Encrypt stage (thread)."""
+        while (item := encrypt_queue.get()) is not None:
+            path, filename, key, ck = item
+            ciphertext_path = os.path.join(directory, f"{threading.get_ident()}-{time.monotonic_ns()}")
+            start = time.monotonic()
+            try:
+                size = os.path.getsize(path)
+                self.handler.encrypt_file(path, key, ciphertext_path)
+            except Exception as e:
+                self.stats["encrypt"].add(0, 0, time.monotonic() - start, 1)
+                self.__fail(path, "encrypt", e)
+                if os.path.exists(ciphertext_path):
+                    os.remove(ciphertext_path)
+                continue
+            self.stats["encrypt"].add(1, size, time.monotonic() - start)
+            upload_queue.put((path, filename, ciphertext_path, size, ck))  # Blocks while the uploads are behind
+
+    def __upload(self, upload_queue, container_name):
+        """Upload stage (thread)."""
+        while (item := upload_queue.get()) is not None:
+            path, filename, ciphertext_path, size, ck = item
+            start = time.monotonic()
+            try:
+                self.handler.upload_encrypted_file(ciphertext_path, container_name, filename, ck)
+            except Exception as e:
+                self.stats["upload"].add(0, 0, time.monotonic() - start, 1)
+                self.__fail(path, "upload", e)
+            else:
+                self.stats["upload"].add(1, size, time.monotonic() - start)
+            finally:
+                os.remove(ciphertext_path)
+
+
+def main():
+    from app.google.cloud_handler import GoogleCloudHandler
+    from app.google.key_provider import KEKProvider
+
+    parser = argparse.ArgumentParser(description="Encrypt and upload a directory tree to a bucket.")
+    parser.add_argument("directory")
+    parser.add_argument("bucket")
+    parser.add_argument("--prefix", default="", help="Prefix of the blob names")
+    parser.add_argument("--fake-gcs", action="store_true", help="Use the fake GCS server")
+    parser.add_argument("--wrap-batch", type=int, default=64)
+    parser.add_argument("--encrypt-workers", type=int, default=None)
+    parser.add_argument("--upload-workers", type=int, default=16)
+    parser.add_argument("--queue-size", type=int, default=64)
+    args = parser.parse_args()
+
+    handler = GoogleCloudHandler(KEKProvider(), fake_GCS=args.fake_gcs)
+    handler.connect_hsm()
+    handler.connect_cloud()
+    uploader = BulkUploader(handler, args.wrap_batch, args.encrypt_workers, args.upload_workers, args.queue_size)
+    failures = uploader.upload_directory(args.directory, args.bucket, args.prefix)
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
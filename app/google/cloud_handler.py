@@ -1,20 +1,60 @@
 from google.cloud import storage
+from google.cloud.storage import transfer_manager
 from google.auth.credentials import AnonymousCredentials
 from google.api_core.exceptions import Conflict
 import tink
-from tink import aead, cleartext_keyset_handle
-from tink.proto import aes_gcm_pb2, tink_pb2, common_pb2
+from tink import aead, streaming_aead, cleartext_keyset_handle
+from tink.proto import aes_gcm_pb2, aes_gcm_hkdf_streaming_pb2, tink_pb2, common_pb2
 import os
+import tempfile
+
+from core.tools.progress import ProgressReader
 
 GCSENDPOINT = "http://localhost:4443"
 
+# Values of the "encryption" metadata of the blobs
+ENCRYPTION_AEAD = "tink-aes-gcm-256-hsm"
+ENCRYPTION_STREAMING = "tink-aes-gcm-hkdf-streaming-256-hsm"
+
+STREAM_SEGMENT_SIZE = 1024 * 1024  # Ciphertext segment of the streaming AEAD
+STREAM_CHUNK_SIZE = 4 * 1024 * 1024  # Resumable upload / ranged download chunk (multiple of 256 KiB)
+PARALLEL_CHUNK_SIZE = 32 * 1024 * 1024  # Part of a parallel transfer
+PARALLEL_THRESHOLD = 64 * 1024 * 1024  # Smallest file transferred in parallel
+
 
 class GoogleCloudHandler:
-    def __init__(self, key_provider, fake_GCS: bool = False):
+    """
+    Google Cloud Storage with envelope encryption: each blob is encrypted with its own key,
+    wrapped by the HSM and stored in the "ck" metadata of the blob.
+
+    With streaming (default), files are encrypted with Tink streaming AEAD (AES-GCM-HKDF, 1 MiB segments)
+    and transferred through resumable uploads and chunked downloads: the memory used does not depend
+    on the size of the file. Otherwise, the whole file is encrypted in memory with Tink AEAD (AES-GCM).
+    Both formats can be downloaded.
+
+    Transfers can report their progress through a callback progress(done, total), called in the
+    transferring thread: bytes of the file read (upload) or of the blob read (download). A parallel
+    transfer reports the encryption (or decryption) of its temporary file, not the transfer of its parts.
+    The callback can raise (e.g. TransferCancelled) to abort the transfer: nothing is committed.
+
+    Parallel transfers (streaming only): files of parallel_threshold bytes or more are encrypted to a temporary
+    file, then uploaded in parts of parallel_chunk_size bytes by parallel_workers threads (XML multipart upload).
+    They are downloaded the same way (ranged reads) before being decrypted. By default 8 workers on
+    Google Storage, none on fake GCS (no XML multipart upload).
+    """
+
+    def __init__(self, key_provider, fake_GCS: bool = False, streaming: bool = True,
+                 parallel_workers: int | None = None, parallel_chunk_size: int = PARALLEL_CHUNK_SIZE,
+                 parallel_threshold: int = PARALLEL_THRESHOLD):
         aead.register()
+        streaming_aead.register()
         self.client = None
         self.connected = False
         self.fake_GCS = fake_GCS
+        self.streaming = streaming
+        self.parallel_workers = (1 if fake_GCS else 8) if parallel_workers is None else parallel_workers
+        self.parallel_chunk_size = parallel_chunk_size
+        self.parallel_threshold = parallel_threshold
         self.key_provider = key_provider
         self.__service_name = ""
 
@@ -51,6 +91,14 @@ class GoogleCloudHandler:
         bucket = self.client.bucket(container_name)
         return [file.name for file in bucket.list_blobs()]
 
+    def iter_pages_files(self, container_name: str, page_size: int = 1000):
+        """
+        Yields:
+            list[str]: the names of the files of a container, one page (one listing request) at a time.
+        """
+        for page in self.client.list_blobs(container_name, page_size=page_size).pages:
+            yield [file.name for file in page]
+
     def connect_hsm(self):
         self.key_provider.connect()
 
@@ -63,8 +111,11 @@ class GoogleCloudHandler:
         except Exception as e:
             raise Exception(f"[Error] Failed to create the bucket :\n {e}")
 
-    def upload(self, path, container_name, filename):
-        with open(path, "rb") as f:
+    def upload(self, path, container_name, filename, progress=None):
+        if self.streaming:
+            self.__upload_streaming(path, container_name, filename, progress)
+            return
+        with GoogleCloudHandler.__open(path, progress) as f:
             plaintext_data = f.read()
         key_bytes = os.urandom(32)
         cipher = self.__get_tink_primitive(key_bytes)
@@ -73,15 +124,105 @@ class GoogleCloudHandler:
         bucket = self.client.bucket(container_name)
         blob = bucket.blob(filename)
         blob.metadata = {
-            "encryption": "tink-aes-gcm-256-hsm",
+            "encryption": ENCRYPTION_AEAD,
             "ck": ck.hex(),
         }
         blob.upload_from_string(ciphertext)
 
-    def download(self, path, container_name, filename):
+    def __upload_streaming(self, path, container_name, filename, progress):
+        key_bytes = os.urandom(32)
+        ck = self.key_provider.wrap_key(key_bytes)
+        if self.__is_parallel(os.path.getsize(path)):
+            with tempfile.TemporaryDirectory() as directory:
+                ciphertext_path = os.path.join(directory, "ciphertext")
+                self.encrypt_file(path, key_bytes, ciphertext_path, progress)
+                self.upload_encrypted_file(ciphertext_path, container_name, filename, ck)
+            return
+
+        cipher = self.__get_tink_streaming_primitive(key_bytes)
+        blob = self.__new_streaming_blob(container_name, filename, ck)
+        with GoogleCloudHandler.__open(path, progress) as f:
+            self.__encrypt_stream(cipher, f, blob.open("wb", chunk_size=STREAM_CHUNK_SIZE))
+
+    def encrypt_file(self, path, key_bytes, ciphertext_path, progress=None):
+        """
+        Encrypt a file with the streaming envelope, to be uploaded by upload_encrypted_file().
+
+        Arguments:
+            path (str): the path of the file to encrypt.
+            key_bytes (bytes): the key of the file (32 bytes).
+            ciphertext_path (str): the path of the encrypted file to write.
+            progress (callable): progress(bytes read, size of the file), see the class.
+        """
+        cipher = self.__get_tink_streaming_primitive(key_bytes)
+        # Closed on errors too, without its last segment: an unfinished file is never a valid ciphertext
+        with GoogleCloudHandler.__open(path, progress) as f, open(ciphertext_path, "wb") as ciphertext:
+            self.__encrypt_stream(cipher, f, ciphertext)
+
+    def upload_encrypted_file(self, ciphertext_path, container_name, filename, ck):
+        """
+        Upload a file encrypted by encrypt_file(), in parallel if it is large enough.
+
+        Arguments:
+            ciphertext_path (str): the path of the encrypted file.
+            container_name (str): the name of the bucket.
+            filename (str): the name of the blob.
+            ck (bytes): the key of the file, wrapped by the HSM.
+        """
+        blob = self.__new_streaming_blob(container_name, filename, ck)
+        if self.__is_parallel(os.path.getsize(ciphertext_path)):
+            transfer_manager.upload_chunks_concurrently(
+                ciphertext_path,
+                blob,
+                chunk_size=self.parallel_chunk_size,
+                worker_type=transfer_manager.THREAD,
+                max_workers=self.parallel_workers,
+            )
+        else:
+            blob.upload_from_filename(ciphertext_path)
+
+    def __new_streaming_blob(self, container_name, filename, ck):
+        blob = self.client.bucket(container_name).blob(filename)
+        blob.metadata = {
+            "encryption": ENCRYPTION_STREAMING,
+            "ck": ck.hex(),
+        }
+        return blob
+
+    @staticmethod
+    def __open(path, progress):
+        """Open a file to read, reporting the bytes read if progress is given."""
+        f = open(path, "rb")
+        if progress is None:
+            return f
+        return ProgressReader(f, progress, os.fstat(f.fileno()).st_size)
+
+    def __is_parallel(self, size):
+        return self.parallel_workers > 1 and size is not None and size >= self.parallel_threshold
+
+    @staticmethod
+    def __encrypt_stream(cipher, source, destination):
+        """
+        Encrypt a file into a writable stream, then close the stream.
+        """
+        buffer = bytearray(STREAM_SEGMENT_SIZE)
+        view = memoryview(buffer)
+        encrypting_stream = cipher.new_encrypting_stream(destination, b"")
+        while n := source.readinto(buffer):
+            encrypting_stream.write(view[:n])
+        # Writes the last segment and closes the destination (completes the upload). Not reached on
+        # errors, so that a truncated (but valid) ciphertext is never committed.
+        encrypting_stream.close()
+
+    def download(self, path, container_name, filename, progress=None):
         bucket = self.client.bucket(container_name)
         blob = bucket.get_blob(filename)
+        if blob.metadata.get("encryption") == ENCRYPTION_STREAMING:
+            self.__download_streaming(path, blob, progress)
+            return
         encrypted_content = blob.download_as_bytes()
+        if progress is not None:
+            progress(len(encrypted_content), blob.size)
         ck = bytes.fromhex(blob.metadata["ck"])
         key = self.key_provider.unwrap_key(ck)
         cipher = self.__get_tink_primitive(key)
@@ -89,6 +230,42 @@ class GoogleCloudHandler:
         with open(path, "wb") as f:
             f.write(plaintext)
 
+    def __download_streaming(self, path, blob, progress):
+        ck = bytes.fromhex(blob.metadata["ck"])
+        key = self.key_provider.unwrap_key(ck)
+        cipher = self.__get_tink_streaming_primitive(key)
+        # Segments are authenticated one by one: the file only replaces path once fully decrypted
+        part_path = path + ".part"
+        try:
+            if self.__is_parallel(blob.size):
+                with tempfile.TemporaryDirectory() as directory:
+                    ciphertext_path = os.path.join(directory, "ciphertext")
+                    transfer_manager.download_chunks_concurrently(
+                        blob,
+                        ciphertext_path,
+                        chunk_size=self.parallel_chunk_size,
+                        worker_type=transfer_manager.THREAD,
+                        max_workers=self.parallel_workers,
+                    )
+                    with GoogleCloudHandler.__open(ciphertext_path, progress) as reader:
+                        self.__decrypt_stream(cipher, reader, part_path)
+            else:
+                with blob.open("rb", chunk_size=STREAM_CHUNK_SIZE) as reader:
+                    if progress is not None:
+                        reader = ProgressReader(reader, progress, blob.size)
+                    self.__decrypt_stream(cipher, reader, part_path)
+            os.replace(part_path, path)
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+
+    @staticmethod
+    def __decrypt_stream(cipher, source, path):
+        with cipher.new_decrypting_stream(source, b"") as decrypting_stream, open(path, "wb") as f:
+            while chunk := decrypting_stream.read(STREAM_SEGMENT_SIZE):
+                f.write(chunk)
+
     def __get_tink_primitive(self, raw_key_bytes):
         gcm_key_proto = aes_gcm_pb2.AesGcmKey(version=0, key_value=raw_key_bytes)
         key_data = tink_pb2.KeyData(
@@ -105,3 +282,28 @@ class GoogleCloudHandler:
         keyset = tink_pb2.Keyset(primary_key_id=1, key=[key])
         handle = cleartext_keyset_handle.from_keyset(keyset)
         return handle.primitive(aead.Aead)
+
+    def __get_tink_streaming_primitive(self, raw_key_bytes):
+        streaming_key_proto = aes_gcm_hkdf_streaming_pb2.AesGcmHkdfStreamingKey(
+            version=0,
+            key_value=raw_key_bytes,
+            params=aes_gcm_hkdf_streaming_pb2.AesGcmHkdfStreamingParams(
+                ciphertext_segment_size=STREAM_SEGMENT_SIZE,
+                derived_key_size=32,
+                hkdf_hash_type=common_pb2.SHA256,
+            ),
+        )
+        key_data = tink_pb2.KeyData(
+            type_url="type.googleapis.com/google.crypto.tink.AesGcmHkdfStreamingKey",
+            value=streaming_key_proto.SerializeToString(),
+            key_material_type=tink_pb2.KeyData.SYMMETRIC,
+        )
+        key = tink_pb2.Keyset.Key(
+            key_data=key_data,
+            status=tink_pb2.ENABLED,
+            key_id=1,
+            output_prefix_type=tink_pb2.RAW,
+        )
+        keyset = tink_pb2.Keyset(primary_key_id=1, key=[key])
+        handle = cleartext_keyset_handle.from_keyset(keyset)
+        return handle.primitive(streaming_aead.StreamingAead)
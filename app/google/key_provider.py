@@ -1,9 +1,14 @@
-from core.tools.read_config import readconfig
+from core.tools.read_config import readconfig, read_unwrap_cache_config
+from core.tools.key_cache import UnwrappedKeyCache
 from core.tls.hsm_connection import ConnectionWorker
 from core.request.local import LocalRequest
 
 
 class KEKProvider:
+    # Cache of the unwrapped keys, disabled unless enable_unwrap_cache() is called (connect() does it
+    # with an "unwrap_cache" section in config.yaml)
+    unwrap_cache = None
+
     @staticmethod
     def wrap_key(key):
         request17 = LocalRequest("key17.com", ("wrap_cek", 1, key))
@@ -12,17 +17,55 @@ class KEKProvider:
         return wrapped
 
     @staticmethod
-    def unwrap_key(wrapped):
+    def wrap_keys(keys):
+        """
+        Wrap several keys, 8 keys per HSM command, the commands being pipelined.
+        The commands are bulk requests: interactive ones (e.g. unwrap_key for a download) go first.
+
+        Args:
+            keys (list[bytes]): The keys to wrap (32 bytes each).
+
+        Returns:
+            list[bytes]: The wrapped keys, in order.
+        """
+        requests = [LocalRequest("key17.com", ("wrap_cek_many", 1, keys[i : i + 8]), priority="bulk") for i in range(0, len(keys), 8)]
+        for request in requests:
+            ConnectionWorker.dispatch_request(request)
+        return [wrapped for request in requests for wrapped in request.get_response()]
+
+    @classmethod
+    def unwrap_key(cls, wrapped):
+        if cls.unwrap_cache is not None:
+            return cls.unwrap_cache.get_or_unwrap(wrapped, cls.__unwrap_key, "key17.com/1")
+        return cls.__unwrap_key(wrapped)
+
+    @staticmethod
+    def __unwrap_key(wrapped):
         request17 = LocalRequest("key17.com", ("unwrap_cek", 1, wrapped))
         ConnectionWorker.dispatch_request(request17)
         stripped_key = request17.get_response()
         full_key = stripped_key
         return full_key
 
-    @staticmethod
-    def connect():
+    @classmethod
+    def enable_unwrap_cache(cls, max_entries=1024, ttl=300):
+        """
+        Keep the unwrapped keys in memory, so that downloading an object again does not query the HSM.
+
+        Args:
+            max_entries (int): Maximum number of keys kept.
+            ttl (float): Seconds a key is kept.
+        """
+        cls.unwrap_cache = UnwrappedKeyCache(max_entries, ttl)
+
+    @classmethod
+    def connect(cls):
         keystores = readconfig("config.yaml")
-        for keystore_infos in keystores:
-            ConnectionWorker(*keystore_infos)
+        for *keystore_infos, options in keystores:
+            ConnectionWorker(*keystore_infos, **options)
+
+        unwrap_cache = read_unwrap_cache_config("config.yaml")
+        if unwrap_cache is not None:
+            cls.enable_unwrap_cache(**unwrap_cache)
 
         ConnectionWorker.start_all()
@@ -1,25 +1,57 @@
+import queue
 import sys
+import threading
 import tkinter as tk
 from tkinter import filedialog, simpledialog
 from tkinter import ttk
 from tkinter.scrolledtext import ScrolledText
 
+from app.graphics.transfers import Transfer, TransferManager
+
+POLL_INTERVAL = 50  # ms between two reads of the listing results
+LIST_PAGE_SIZE = 1000  # Files per listing request
+PLACEHOLDER = "Loading..."
+TRANSFER_REFRESH = 250  # ms between two updates of the transfers panel
+TRANSFER_WORKERS = 3  # Transfers run at once
+
 
 class AppWindow:
     """
     Depends on a cloud_handler that can do requests such as:
     listing buckets and files, uploading and downloading files.
+
+    Listings run in background threads: the containers are listed when the tree is refreshed,
+    the files of a container when its node is first expanded, page by page if the handler
+    has iter_pages_files (otherwise get_list_files in one go). The threads post their results
+    in a queue, read from the Tk thread every POLL_INTERVAL ms.
+
+    Uploads and downloads run in the worker threads of a TransferManager, TRANSFER_WORKERS at a time.
+    The transfers panel shows their progress, speed and ETA, and can cancel them.
     """
 
 
     class TextRedirector(object):
-        # To display prints in the window
+        # To display prints in the window. Any thread can print: the text is queued,
+        # and inserted by the Tk thread.
         def __init__(self, widget):
             self.widget = widget
+            self.pending = queue.Queue()
+            self.widget.after(POLL_INTERVAL, self.__insert_pending)
 
         def write(self, s):
-            self.widget.insert(tk.END, s)
-            self.widget.see(tk.END)
+            self.pending.put(s)
+
+        def __insert_pending(self):
+            text = []
+            try:
+                while True:
+                    text.append(self.pending.get_nowait())
+            except queue.Empty:
+                pass
+            if text:
+                self.widget.insert(tk.END, "".join(text))
+                self.widget.see(tk.END)
+            self.widget.after(POLL_INTERVAL, self.__insert_pending)
 
         def flush(self):
             pass  # Needed for compatibility with stdout
@@ -27,6 +59,14 @@ class AppWindow:
     # STORAGE INDEPENDANT
     def __init__(self, cloud_handler):
         self.cloud_handler = cloud_handler
+        self.__results = queue.Queue()  # Listings posted by the background threads
+        self.__generation = 0  # Incremented by each refresh of the tree, to drop outdated listings
+        self.__containers = {}  # container name: tree node
+        self.__loads = {}  # container name: ID of its last listing (absent: not listed)
+        self.__next_load = 0
+        self.transfer_manager = TransferManager(cloud_handler, TRANSFER_WORKERS)
+        self.__transfer_rows = {}  # Transfer: [widgets of its row in the panel, state displayed]
+        self.__next_transfer_row = 0
         self.root = tk.Tk()
         self.root.title("Client GUI")
         self.root.geometry("900x600")
@@ -54,6 +94,18 @@ class AppWindow:
         btn = tk.Button(self.bottom_left, text=f"Connect to HSM", command=self.on_connect_hsm_button_click)
         btn.pack(fill="x", pady=5, padx=5)
 
+        # Transfers, under the buttons
+        transfers_header = tk.Frame(self.bottom_left)
+        transfers_header.pack(fill="x", padx=5)
+        tk.Label(transfers_header, text="Transfers").pack(side="left")
+        btn = tk.Button(transfers_header, text="Clear finished", command=self.on_clear_transfers_button_click)
+        btn.pack(side="right")
+        self.transfers_frame = tk.Frame(self.bottom_left)
+        self.transfers_frame.pack(fill="both", expand=True, padx=5)
+        self.transfers_frame.columnconfigure(1, weight=1)
+        self.root.after(TRANSFER_REFRESH, self.__refresh_transfers)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
         # Logs on the right
         log_frame = tk.Frame(self.root, bd=2, relief="sunken")
         log_frame.grid(row=0, column=1, rowspan=2, sticky="nsew")
@@ -75,6 +127,8 @@ class AppWindow:
             self.tree = ttk.Treeview(self.upper_left)
             self.tree.heading("#0", text=self.cloud_handler.get_service_name())
             self.tree.pack(fill="both", expand=True)
+            self.tree.bind("<<TreeviewOpen>>", self.on_tree_open)
+            self.root.after(POLL_INTERVAL, self.__poll_results)
 
             if self.cloud_handler.connected:
                 self.refresh_tree()
@@ -110,11 +164,10 @@ class AppWindow:
         initialfile=filename,     # defaults to the original name of the blob
         title="Save blob as..."
     )
+        if not path:
+            return
         print("Downloading:", container, filename)
-        try:
-            self.cloud_handler.download(path, container, filename)
-        except Exception as e:
-            print("Download failed", e)
+        self.__add_transfer_row(self.transfer_manager.download(path, str(container), str(filename)))
 
 
 
@@ -143,11 +196,7 @@ class AppWindow:
                 return
 
             print("Uploading:", path, "to container:", container)
-            try:
-                self.cloud_handler.upload(path, container, newblob_name)
-                self.refresh_tree()
-            except Exception as e:
-                print("Upload failed", e)
+            self.__add_transfer_row(self.transfer_manager.upload(path, str(container), newblob_name))
 
 
     def on_bucket_button_click(self):
@@ -158,22 +207,207 @@ class AppWindow:
         if not name:
                 return
         self.cloud_handler.create_container(name)
-        self.refresh_tree()
+        if name not in self.__containers:
+            self.__add_container(name)
 
     def on_connect_hsm_button_click(self):
         self.cloud_handler.connect_hsm()
 
     def refresh_tree(self):
-    # Clear
+        """
+        List the containers again (in the background). Their files are listed when they are expanded.
+        """
         for item in self.tree.get_children():
             self.tree.delete(item)
+        self.__containers.clear()
+        self.__loads.clear()
+        self.__generation += 1
+        self.__start(self.__list_containers, self.__generation)
+
+    def refresh_container(self, container_name):
+        """
+        List the files of a container again, if they were listed.
+        """
+        container_name = str(container_name)  # Tk can turn the values of the nodes into numbers
+        node = self.__containers.get(container_name)
+        if node is None:
+            self.refresh_tree()  # Unknown container: created elsewhere
+            return
+        if container_name not in self.__loads:
+            return  # Listed when expanded
+        for item in self.tree.get_children(node):
+            self.tree.delete(item)
+        self.tree.insert(node, "end", text=PLACEHOLDER, values=(container_name, ""))
+        self.__load_container(container_name)
+
+    def on_tree_open(self, event):
+        node = self.tree.focus()
+        if self.tree.parent(node) != "":
+            return
+        container_name = self.tree.item(node, "text")
+        if container_name not in self.__loads:
+            self.__load_container(container_name)
+
+    def __add_container(self, container_name):
+        # The placeholder makes the node expandable until its files are listed
+        node = self.tree.insert("", "end", text=container_name, open=False, values=(container_name, ""))
+        self.tree.insert(node, "end", text=PLACEHOLDER, values=(container_name, ""))
+        self.__containers[container_name] = node
+
+    def __load_container(self, container_name):
+        self.__next_load += 1
+        self.__loads[container_name] = self.__next_load
+        self.__start(self.__list_files, container_name, self.__next_load)
+
+    @staticmethod
+    def __start(target, *args):
+        threading.Thread(target=target, args=args, daemon=True).start()
 
-        containers = self.cloud_handler.get_list_containers()
-        for container_name in containers:
-            container_node = self.tree.insert("", "end", text = container_name, open=False, values=(container_name, ""))
+    # Background threads: no Tk calls, the results go through the queue
 
-            for file in self.cloud_handler.get_list_files(container_name):
-                self.tree.insert(container_node, "end", text=file, values=(container_name, file))
+    def __list_containers(self, generation):
+        try:
+            self.__results.put(("containers", generation, self.cloud_handler.get_list_containers()))
+        except Exception as e:
+            self.__results.put(("error", generation, None, f"Listing the containers failed: {e}"))
+
+    def __list_files(self, container_name, load):
+        try:
+            if hasattr(self.cloud_handler, "iter_pages_files"):
+                pages = self.cloud_handler.iter_pages_files(container_name, LIST_PAGE_SIZE)
+            else:
+                pages = [self.cloud_handler.get_list_files(container_name)]
+            for page in pages:
+                if self.__loads.get(container_name) != load:
+                    return  # Outdated: the container (or the tree) was refreshed since
+                self.__results.put(("files", load, container_name, page))
+            self.__results.put(("done", load, container_name))
+        except Exception as e:
+            self.__results.put(("error", load, container_name, f"Listing the files of {container_name} failed: {e}"))
+
+    # Tk thread
+
+    def __poll_results(self):
+        try:
+            while True:
+                kind, generation, *result = self.__results.get_nowait()
+                if kind == "containers" or (kind == "error" and result[0] is None):
+                    if generation != self.__generation:
+                        continue
+                    if kind == "error":
+                        print(result[1])
+                    else:
+                        for container_name in result[0]:
+                            self.__add_container(container_name)
+                    continue
+
+                # generation is the ID of a listing of files
+                container_name = result[0]
+                if self.__loads.get(container_name) != generation:
+                    continue
+                node = self.__containers[container_name]
+                if kind == "files":
+                    # The placeholder stays first until the listing is over
+                    for file in result[1]:
+                        self.tree.insert(node, "end", text=file, values=(container_name, file))
+                elif kind == "done":
+                    self.tree.delete(self.tree.get_children(node)[0])
+                else:
+                    # Listed again when expanded again
+                    print(result[1])
+                    del self.__loads[container_name]
+                    for item in self.tree.get_children(node)[1:]:
+                        self.tree.delete(item)
+                    self.tree.item(node, open=False)
+        except queue.Empty:
+            pass
+        self.root.after(POLL_INTERVAL, self.__poll_results)
+
+    def on_clear_transfers_button_click(self):
+        for transfer in self.transfer_manager.remove_finished():
+            for widget in self.__transfer_rows.pop(transfer)[:4]:
+                widget.destroy()
+
+    def on_close(self):
+        # Running transfers stop at their next progress report
+        for transfer in self.transfer_manager.transfers:
+            transfer.cancel()
+        self.root.destroy()
+
+    def __add_transfer_row(self, transfer):
+        self.__next_transfer_row += 1
+        row = self.__next_transfer_row
+        arrow = "\u2191" if transfer.kind == "upload" else "\u2193"
+        name = tk.Label(self.transfers_frame, text=f"{arrow} {transfer.filename}", anchor="w", width=16)
+        bar = ttk.Progressbar(self.transfers_frame, mode="determinate", maximum=1)
+        status = tk.Label(self.transfers_frame, text=transfer.state, anchor="w", width=18)
+        cancel = tk.Button(self.transfers_frame, text="Cancel", command=transfer.cancel)
+        for column, widget in enumerate((name, bar, status, cancel)):
+            widget.grid(row=row, column=column, sticky="ew", padx=2)
+        self.__transfer_rows[transfer] = [name, bar, status, cancel, transfer.state]
+
+    def __refresh_transfers(self):
+        for transfer, widgets in self.__transfer_rows.items():
+            name, bar, status, cancel, reported = widgets
+            state = transfer.state
+            if reported in (Transfer.DONE, Transfer.FAILED, Transfer.CANCELLED):
+                continue
+
+            if state == Transfer.RUNNING and transfer.total is None:
+                # No progress reports: the transfer is only known to be running
+                if str(bar["mode"]) != "indeterminate":
+                    bar.configure(mode="indeterminate")
+                    bar.start()
+                status.configure(text=state)
+            elif state == Transfer.RUNNING:
+                if str(bar["mode"]) == "indeterminate":
+                    bar.stop()  # Until the first progress report
+                    bar.configure(mode="determinate")
+                bar.configure(maximum=transfer.total or 1, value=transfer.done)
+                status.configure(text=AppWindow.__transfer_status(transfer))
+            elif state != Transfer.QUEUED:
+                self.__end_transfer(transfer, widgets)
+            widgets[4] = state
+
+        self.root.after(TRANSFER_REFRESH, self.__refresh_transfers)
+
+    def __end_transfer(self, transfer, widgets):
+        name, bar, status, cancel, _ = widgets
+        if str(bar["mode"]) == "indeterminate":
+            bar.stop()
+            bar.configure(mode="determinate")
+        bar.configure(maximum=1, value=1 if transfer.state == Transfer.DONE else 0)
+        status.configure(text=transfer.state)
+        cancel.configure(state="disabled")
+
+        if transfer.state == Transfer.DONE:
+            if transfer.kind == "upload":
+                print("Uploaded:", transfer.filename, "to container:", transfer.container_name)
+                self.refresh_container(transfer.container_name)
+            else:
+                print("Downloaded:", transfer.container_name, transfer.filename, "to", transfer.path)
+        elif transfer.state == Transfer.FAILED:
+            print(transfer.kind.capitalize(), "failed", transfer.error)
+        else:
+            print(transfer.kind.capitalize(), "cancelled:", transfer.filename)
+
+    @staticmethod
+    def __transfer_status(transfer):
+        speed = transfer.speed()
+        eta = transfer.eta()
+        text = f"{AppWindow.__size(speed)}/s"
+        if eta is not None:
+            minutes, seconds = divmod(int(eta), 60)
+            text += f", {minutes}:{seconds:02d} left"
+        return text
+
+    @staticmethod
+    def __size(n):
+        for unit in ("B", "KB", "MB", "GB"):
+            if n < 1000:
+                return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+            n /= 1000
+        return f"{n:.1f} TB"
 
     def run(self):
         self.root.mainloop()
@@ -0,0 +1,173 @@
+import collections
+import inspect
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from core.tools.progress import TransferCancelled
+
+SPEED_WINDOW = 3.0  # Seconds of progress the speed is measured over
+
+
+class Transfer:
+    """
+    An upload or a download run by a TransferManager. Its progress is updated by the worker thread
+    and read by the GUI.
+
+    Attributes:
+        kind (str): "upload" or "download".
+        path (str): The path of the file on the computer.
+        container_name (str): The name of the container.
+        filename (str): The name of the file in the container.
+        state (str): QUEUED, RUNNING, DONE, FAILED or CANCELLED.
+        done (int): Bytes transferred.
+        total (int): Bytes to transfer, None if unknown (handler without progress reports).
+        error (Exception): Why the transfer failed.
+    """
+
+    QUEUED = "Queued"
+    RUNNING = "Running"
+    DONE = "Done"
+    FAILED = "Failed"
+    CANCELLED = "Cancelled"
+
+    def __init__(self, kind, path, container_name, filename):
+        self.kind = kind
+        self.path = path
+        self.container_name = container_name
+        self.filename = filename
+        self.state = Transfer.QUEUED
+        self.done = 0
+        self.total = None
+        self.error = None
+        self.future = None
+        self.__cancelled = threading.Event()
+        self.__samples = collections.deque()  # (time, done) over the last SPEED_WINDOW seconds
+        self.__lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.state in (Transfer.DONE, Transfer.FAILED, Transfer.CANCELLED)
+
+    @property
+    def cancelled(self):
+        return self.__cancelled.is_set()
+
+    def cancel(self):
+        """
+        Cancel the transfer: dropped if queued, aborted at its next progress report if running.
+        """
+        self.__cancelled.set()
+        if self.future is not None and self.future.cancel():
+            self.state = Transfer.CANCELLED
+
+    def progress(self, done, total):
+        """
+        Progress callback given to the cloud handler (worker thread).
+
+        Raises:
+            TransferCancelled: The transfer was cancelled.
+        """
+        if self.__cancelled.is_set():
+            raise TransferCancelled()
+        now = time.monotonic()
+        with self.__lock:
+            self.done = done
+            self.total = total
+            self.__samples.append((now, done))
+            while len(self.__samples) > 2 and now - self.__samples[0][0] > SPEED_WINDOW:
+                self.__samples.popleft()
+
+    def speed(self) -> float:
+        """
+        Returns:
+            float: Bytes/s over the last SPEED_WINDOW seconds.
+        """
+        with self.__lock:
+            if len(self.__samples) < 2:
+                return 0.0
+            (start, start_done), (_, end_done) = self.__samples[0], self.__samples[-1]
+        # Measured until now: the speed of a stalled transfer drops
+        elapsed = time.monotonic() - start
+        return (end_done - start_done) / elapsed if elapsed > 0 else 0.0
+
+    def eta(self) -> float | None:
+        """
+        Returns:
+            float: Seconds left at the current speed, None if unknown.
+        """
+        speed = self.speed()
+        if self.total is None or not speed:
+            return None
+        return max(self.total - self.done, 0) / speed
+
+
+class TransferManager:
+    """
+    Runs the uploads and downloads of a cloud handler in a pool of worker threads, so that the GUI
+    stays responsive and several files are transferred at once. Transfers wait in the queue of the
+    pool while all the workers are busy.
+
+    The progress is reported by the handlers whose upload() and download() take a progress callback,
+    the other handlers only report the end of the transfers.
+    """
+
+    def __init__(self, cloud_handler, workers = 3):
+        """
+        Args:
+            cloud_handler: The handler running the transfers.
+            workers (int): Transfers run at once.
+        """
+        self.cloud_handler = cloud_handler
+        self.transfers = []
+        self.__executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="transfer")
+
+    def upload(self, path, container_name, filename) -> Transfer:
+        return self.__submit(Transfer("upload", path, container_name, filename), self.cloud_handler.upload)
+
+    def download(self, path, container_name, filename) -> Transfer:
+        return self.__submit(Transfer("download", path, container_name, filename), self.cloud_handler.download)
+
+    def __submit(self, transfer, method):
+        self.transfers.append(transfer)
+        transfer.future = self.__executor.submit(self.__run, transfer, method)
+        return transfer
+
+    @staticmethod
+    def __run(transfer, method):
+        """Worker thread."""
+        if transfer.cancelled:
+            transfer.state = Transfer.CANCELLED
+            return
+        transfer.state = Transfer.RUNNING
+        arguments = {}
+        if "progress" in inspect.signature(method).parameters:
+            arguments["progress"] = transfer.progress
+        try:
+            method(transfer.path, transfer.container_name, transfer.filename, **arguments)
+        except TransferCancelled:
+            transfer.state = Transfer.CANCELLED
+        except Exception as e:
+            transfer.error = e
+            transfer.state = Transfer.CANCELLED if transfer.cancelled else Transfer.FAILED
+        else:
+            transfer.state = Transfer.DONE
+
+    def remove_finished(self):
+        """
+        Forget the transfers that are over.
+
+        Returns:
+            list[Transfer]: The transfers removed.
+        """
+        finished = [transfer for transfer in self.transfers if transfer.finished]
+        self.transfers = [transfer for transfer in self.transfers if not transfer.finished]
+        return finished
+
+    def shutdown(self):
+        """
+        Cancel every transfer, waiting for the running ones to stop.
+        """
+        for transfer in self.transfers:
+            transfer.cancel()
+        self.__executor.shutdown(wait=True)
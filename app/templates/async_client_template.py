@@ -0,0 +1,35 @@
+import asyncio
+import os
+from core.tools.read_config import readconfig
+from core.tls.async_hsm_connection import AsyncConnectionWorker
+
+
+async def main():
+    keystores = readconfig("config.yaml")
+
+    for *keystore_infos, options in keystores:
+        supported = {option: value for option, value in options.items() if option in AsyncConnectionWorker.OPTIONS}
+        AsyncConnectionWorker(*keystore_infos, **supported)
+
+    await AsyncConnectionWorker.start_all()
+
+    try:
+        # A single request
+        response = await AsyncConnectionWorker.dispatch("key22.com", ("read_record", 1))
+        print(response)
+
+        # Many concurrent requests share the sessions of the keystore (pipelined)
+        keys = [os.urandom(32) for _ in range(100)]
+        wrapped = await asyncio.gather(
+            *(AsyncConnectionWorker.dispatch("key17.com", ("wrap_cek", 1, key)) for key in keys)
+        )
+        unwrapped = await AsyncConnectionWorker.dispatch("key17.com", ("unwrap_cek_many", 1, wrapped))
+        print("Round trip OK:", unwrapped == keys)
+
+    except Exception as e:
+        print(e)
+    finally:
+        await AsyncConnectionWorker.stop_all()
+
+if __name__ == "__main__":
+    asyncio.run(main())
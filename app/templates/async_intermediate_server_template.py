@@ -0,0 +1,166 @@
+import argparse
+import asyncio
+import resource
+
+from core.tools.read_config import readconfig
+from core.tls.hsm_connection import ConnectionWorker
+from core.request.remote import RemoteRequest
+from core.request.coalescer import BlockRequestCoalescer
+from core.request.framing import FramedConnection, FramingError, is_framed
+from core.tools import metrics
+
+HOST = "0.0.0.0"  # Listen on all interfaces
+DEFAULT_PORT = 6123
+DEFAULT_BACKLOG = 1024
+DEFAULT_MAX_CONNECTIONS = 10000
+DEFAULT_COALESCE_WINDOW = 200  # µs
+
+
+class ClientOrigin:
+    """
+    Origin of the RemoteRequests of a client connection.
+
+    send() is called by the threads of the ConnectionWorkers: the response is
+    written by the event loop.
+    """
+
+    def __init__(self, loop, writer):
+        self.__loop = loop
+        self.__writer = writer
+
+    def __write(self, data):
+        if not self.__writer.is_closing():
+            self.__writer.write(data)
+
+    def send(self, data):
+        self.__loop.call_soon_threadsafe(self.__write, data)
+        return len(data)
+
+
+class IntermediateServer:
+    """
+    Intermediate server on a single event loop: the connections are handled without a thread per client,
+    the requests are sent to the keystores by the ConnectionWorkers.
+
+    The block requests of the framed connections can be merged into commands of up to 16 blocks
+    (see BlockRequestCoalescer).
+    """
+
+    def __init__(self, host, port, backlog = DEFAULT_BACKLOG, max_connections = DEFAULT_MAX_CONNECTIONS, coalescer = None):
+        """
+        Args:
+            host (str): Address to listen on.
+            port (int): Port to listen on.
+            backlog (int): Connections waiting to be accepted by the server.
+            max_connections (int): Connections handled at once, the next ones are closed right away.
+            coalescer (BlockRequestCoalescer): Dispatches the framed requests, None to dispatch them one by one.
+        """
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.max_connections = max_connections
+        self.connections = 0
+        self.dispatch_framed = ConnectionWorker.dispatch_request if coalescer is None else coalescer.dispatch
+
+    async def handle_client(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        if self.connections >= self.max_connections:
+            print(f"[!] Too many connections, refused {addr}")
+            writer.close()
+            return
+
+        self.connections += 1
+        origin = ClientOrigin(asyncio.get_running_loop(), writer)
+        framed = None  # FramedConnection if the client uses the framed protocol
+        try:
+            while True:
+                buffer = await reader.read(65536 if framed else 1024)
+                if not buffer:
+                    break
+
+                if framed is None and is_framed(buffer):
+                    framed = FramedConnection(origin)
+                if framed:
+                    try:
+                        frames = framed.feed(buffer)
+                    except FramingError as e:
+                        print(e)
+                        break
+                    for request_origin, payload in frames:
+                        try:
+                            self.dispatch_framed(RemoteRequest(request_origin, payload))
+                        except Exception as e:
+                            print(e)
+                            request_origin.send(b"01")
+                    continue
+
+                # Legacy protocol: one request per read
+                try:
+                    request = RemoteRequest(origin, buffer)
+                    ConnectionWorker.dispatch_request(request)
+                except Exception as e:
+                    print(e)
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(
+            self.handle_client, self.host, self.port, backlog=self.backlog, reuse_address=True
+        )
+        print(f"[*] Listening on {self.host}:{self.port} (backlog {self.backlog}, {self.max_connections} connections max)...")
+        async with server:
+            await server.serve_forever()
+
+
+def raise_open_files_limit(connections):
+    """
+    Raise the soft limit of open files (one per connection), up to the hard limit.
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = connections + 256  # Keystore sessions, stdio, etc.
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        limit = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+        if limit < wanted:
+            print(f"Warning: open files limited to {limit}, fewer connections can be held.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Intermediate server between the clients and the keystores.")
+    parser.add_argument("port", type=int, nargs="?", default=DEFAULT_PORT)
+    parser.add_argument("--backlog", type=int, default=DEFAULT_BACKLOG)
+    parser.add_argument("--max-connections", type=int, default=DEFAULT_MAX_CONNECTIONS)
+    parser.add_argument("--coalesce-window", type=float, default=DEFAULT_COALESCE_WINDOW,
+                        help="µs a framed block request waits to be merged with others, 0 to disable")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve the metrics of the keystores on http://0.0.0.0:<port>/metrics (Prometheus)")
+    args = parser.parse_args()
+
+    if args.metrics_port is not None:
+        metrics.start_http_server(args.metrics_port)
+
+    keystores = readconfig("config.yaml")
+
+    for *keystore_infos, options in keystores:
+        ConnectionWorker(*keystore_infos, **options)
+
+    ConnectionWorker.start_all()
+
+    raise_open_files_limit(args.max_connections)
+    coalescer = None
+    if args.coalesce_window > 0:
+        coalescer = BlockRequestCoalescer(ConnectionWorker.dispatch_request, args.coalesce_window / 1e6)
+    server = IntermediateServer(HOST, args.port, args.backlog, args.max_connections, coalescer)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ConnectionWorker.stop_all()
+
+
+if __name__ == "__main__":
+    main()
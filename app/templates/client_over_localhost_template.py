@@ -1,7 +1,10 @@
 # client_threads.py
 import socket
+import sys
 import threading
 
+from core.client.intermediate_client import IntermediateClient
+
 HOST = "127.0.0.1"
 PORT = 6123
 TIMEOUT = 5.0  # secondes
@@ -24,6 +27,21 @@ def worker(name: str, payload: bytes):
         print(f"[{name}] erreur: {e}")
 
 def main():
+    # Persistent, pipelined connections to the server (framed protocol)
+    with IntermediateClient(HOST, PORT, pool_size=2, timeout=TIMEOUT) as client:
+        futures = [
+            client.submit(*client.read_record_request("key17.com", 1)),
+            client.submit(*client.decrypt_AES_binary_request("key22.com", 1, bytes.fromhex("b6f8dec40428caf40a2dbc2721ad5008eec764fa2b0dde6b61cdc75390c67e28"))),
+        ]
+        for future in futures:
+            try:
+                print("received:", future.result(TIMEOUT))
+            except Exception as e:
+                print("error:", e)
+    print("Done.")
+
+
+def legacy_main():
     # exemples de payloads (octets)
     payload1 = b"\x00\x11\x01"
     payload2 = b"\x02\x16\x01" + bytes.fromhex("b6f8dec40428caf40a2dbc2721ad5008eec764fa2b0dde6b61cdc75390c67e28")
@@ -39,4 +57,7 @@ def main():
     print("Terminé.")
 
 if __name__ == "__main__":
-    main()
+    if "--legacy" in sys.argv:
+        legacy_main()
+    else:
+        main()
@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import os
+import resource
+import time
+
+HOST = "127.0.0.1"
+PORT = 6123
+TIMEOUT = 5.0  # seconds
+
+
+def encrypt_request(keystore: int, slot: int) -> bytes:
+    # cmd_id 1 (Encrypt AES), keyx.com, key slot, one block
+    return bytes([1, keystore, slot]) + os.urandom(16)
+
+
+class Stats:
+    def __init__(self):
+        self.connected = 0
+        self.held = 0
+        self.max_held = 0
+        self.failed_connections = 0
+        self.requests = 0
+        self.errors = 0
+        self.latencies = []
+
+
+async def client(stats, start, args):
+    """
+    A connection held until the end of the benchmark, sending requests one after the other.
+    """
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(args.host, args.port), TIMEOUT)
+    except (OSError, asyncio.TimeoutError):
+        stats.failed_connections += 1
+        return
+
+    stats.connected += 1
+    stats.held += 1
+    stats.max_held = max(stats.max_held, stats.held)
+    try:
+        await start.wait()
+        for _ in range(args.requests):
+            sent_at = time.perf_counter()
+            writer.write(encrypt_request(args.keystore, args.slot))
+            await writer.drain()
+            response = await asyncio.wait_for(reader.read(4096), TIMEOUT)
+            if not response:
+                stats.errors += 1
+                break
+            if response[:1] != b"\x00":
+                stats.errors += 1
+                continue
+            stats.requests += 1
+            stats.latencies.append(time.perf_counter() - sent_at)
+    except (OSError, asyncio.TimeoutError):
+        stats.errors += 1
+    finally:
+        stats.held -= 1
+        writer.close()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+async def benchmark(args):
+    stats = Stats()
+    start = asyncio.Event()
+
+    # Open every connection first, then start the requests at once
+    clients = [asyncio.create_task(client(stats, start, args)) for _ in range(args.connections)]
+    while stats.connected + stats.failed_connections < args.connections:
+        await asyncio.sleep(0.01)
+    print(f"Connections held: {stats.held}/{args.connections} ({stats.failed_connections} failed)")
+
+    began = time.perf_counter()
+    start.set()
+    await asyncio.gather(*clients)
+    elapsed = time.perf_counter() - began
+
+    print(f"Requests: {stats.requests} in {elapsed:.2f}s, {stats.requests / elapsed:.0f} requests/s, {stats.errors} errors")
+    if stats.latencies:
+        print(
+            f"Latency: p50 {percentile(stats.latencies, 0.5) * 1000:.1f} ms, "
+            f"p95 {percentile(stats.latencies, 0.95) * 1000:.1f} ms, "
+            f"p99 {percentile(stats.latencies, 0.99) * 1000:.1f} ms"
+        )
+
+
+def main():
+    """
+    Benchmark of an intermediate server: number of connections it holds and requests/s.
+
+    Run it against intermediate_server_over_localhost_template (thread per client) then
+    async_intermediate_server_template (event loop), with the same config.yaml and arguments.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark of an intermediate server.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--connections", type=int, default=1000, help="Connections opened and held")
+    parser.add_argument("--requests", type=int, default=10, help="Requests sent by each connection")
+    parser.add_argument("--keystore", type=int, default=1, help="x of keyx.com")
+    parser.add_argument("--slot", type=int, default=1, help="Key slot number")
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < args.connections + 64:
+        wanted = args.connections + 64
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted if hard == resource.RLIM_INFINITY else min(wanted, hard), hard))
+
+    asyncio.run(benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
 import socket
+import sys
 from core.tools.read_config import readconfig
 import threading
 from core.tls.hsm_connection import ConnectionWorker
 from core.request.remote import RemoteRequest
+from core.request.framing import FramedConnection, FramingError, is_framed
+from core.tools import metrics
 
 HOST = "0.0.0.0"  # Listen on all interfaces
 DEFAULT_PORT = 6123
@@ -11,14 +14,32 @@ DEFAULT_PORT = 6123
 def handle_client(conn, addr):
     print(f"[+] New connection from {addr}")
 
+    framed = None  # FramedConnection if the client uses the framed protocol
     with conn:
         while True:
             thread_id = threading.get_ident()
-            buffer = conn.recv(1024)
+            buffer = conn.recv(65536 if framed else 1024)
 
             if not buffer:
                 break
 
+            if framed is None and is_framed(buffer):
+                framed = FramedConnection(conn)
+            if framed:
+                try:
+                    frames = framed.feed(buffer)
+                except FramingError as e:
+                    print(e)
+                    break
+                for origin, payload in frames:
+                    try:
+                        ConnectionWorker.dispatch_request(RemoteRequest(origin, payload))
+                    except Exception as e:
+                        print(e)
+                        origin.send(b"01")
+                continue
+
+            # Legacy protocol: one request per recv
             try:
                 request = RemoteRequest(conn,buffer)
                 ConnectionWorker.dispatch_request(request)
@@ -35,8 +56,8 @@ def handle_client(conn, addr):
 def main():
     keystores = readconfig("config.yaml")
 
-    for keystore_infos in keystores:
-        ConnectionWorker(*keystore_infos)
+    for *keystore_infos, options in keystores:
+        ConnectionWorker(*keystore_infos, **options)
 
     ConnectionWorker.start_all()
 
@@ -45,6 +66,10 @@ def main():
     except Exception:
         port = DEFAULT_PORT
 
+    # Optional: port of the Prometheus metrics endpoint
+    if len(sys.argv) > 2:
+        metrics.start_http_server(int(sys.argv[2]))
+
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         s.bind((HOST, port))
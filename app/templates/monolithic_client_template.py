@@ -5,13 +5,14 @@ import threading
 from core.tls.hsm_connection import ConnectionWorker
 from core.request.local import LocalRequest
 from queue import Queue
+from concurrent.futures import as_completed
 
 
 def main():
     keystores = readconfig("config.yaml")
 
-    for keystore_infos in keystores:
-            ConnectionWorker(*keystore_infos)
+    for *keystore_infos, options in keystores:
+            ConnectionWorker(*keystore_infos, **options)
 
     ConnectionWorker.start_all()
 
@@ -33,6 +34,16 @@ def main():
         print(first.get_response())
         print("Winner", first.get_keystore())
 
+        # Requests are futures: they can be waited on together, with a deadline to drop them if they are not sent in time
+        worker = ConnectionWorker.get_worker("key22.com")
+        requests = [worker.submit(("read_record", record), timeout=5) for record in range(4)]
+        for request in as_completed(requests):
+            print(request.get_response())
+
+        # The same with hedging: key17.com only gets the request if key22.com is slower than usual (or fails)
+        response = ConnectionWorker.dispatch_hedged(["key22.com", "key17.com"], ("read_record", 1))
+        print(response)
+
 
     except Exception as e:
         print(e)
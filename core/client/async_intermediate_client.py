@@ -0,0 +1,199 @@
+import asyncio
+import socket
+
+from core.client.intermediate_client import IntermediateRequests
+from core.request.framing import FrameDecoder, FramingError, encode_frame
+
+
+class AsyncServerConnection:
+    """
+    asyncio counterpart of ServerConnection: a persistent, framed connection to the intermediate server.
+    """
+
+    def __init__(self, reader, writer):
+        self.__reader = reader
+        self.__writer = writer
+        self.__pending = {}  # request ID: (Future, parse)
+        self.__next_id = 0
+        self.__closed = False
+        self.__reader_task = asyncio.create_task(self.__read_responses())
+
+    @classmethod
+    async def open(cls, host, port, timeout=5):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return cls(reader, writer)
+
+    @property
+    def outstanding(self):
+        """Number of requests waiting for their response."""
+        return len(self.__pending)
+
+    @property
+    def closed(self):
+        return self.__closed
+
+    def submit(self, payload, parse) -> asyncio.Future:
+        """
+        Send a request without waiting for its response.
+
+        Returns:
+            asyncio.Future: the parsed response. Cancelling it forgets the request (its response is ignored).
+        """
+        if self.__closed:
+            raise ConnectionError("Connection to the intermediate server closed.")
+        future = asyncio.get_running_loop().create_future()
+        request_id = self.__next_id
+        self.__next_id = (self.__next_id + 1) & 0xFFFFFFFF
+        self.__pending[request_id] = (future, parse)
+        self.__writer.write(encode_frame(request_id, payload))
+        future.add_done_callback(lambda future: self.__forget(request_id, future))
+        return future
+
+    def __forget(self, request_id, future):
+        """Remove a cancelled request (e.g. by wait_for), so that it does not count as outstanding."""
+        if future.cancelled():
+            self.__pending.pop(request_id, None)
+
+    async def drain(self):
+        """Wait until the requests written can be sent (flow control)."""
+        try:
+            await self.__writer.drain()
+        except ConnectionError:
+            pass  # The reader task fails the pending requests
+
+    async def __read_responses(self):
+        decoder = FrameDecoder()
+        error = ConnectionError("Connection to the intermediate server closed.")
+        try:
+            while True:
+                data = await self.__reader.read(65536)
+                if not data:
+                    break
+                for request_id, response in decoder.feed(data):
+                    future, parse = self.__pending.pop(request_id, (None, None))
+                    if future is None or future.done():
+                        continue
+                    try:
+                        future.set_result(parse(response))
+                    except Exception as e:
+                        future.set_exception(e)
+        except (OSError, FramingError) as e:
+            error = ConnectionError(f"Connection to the intermediate server lost: {e}")
+        self.__fail(error)
+
+    def __fail(self, error):
+        """Fail every pending request and close the connection."""
+        self.__closed = True
+        for future, _ in self.__pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self.__pending.clear()
+        self.__writer.close()
+
+    async def close(self):
+        if not self.__closed:
+            self.__reader_task.cancel()
+            self.__fail(ConnectionError("Connection to the intermediate server closed."))
+
+
+class AsyncIntermediateClient(IntermediateRequests):
+    """
+    asyncio client of the intermediate server, with a pool of persistent connections (see IntermediateClient).
+
+    Example:
+        async with AsyncIntermediateClient("127.0.0.1", 6123) as client:
+            keys = await asyncio.gather(*(client.unwrap_cek("key17.com", 1, ck) for ck in cks))
+    """
+
+    def __init__(self, host, port, pool_size = 4, timeout = 5):
+        """
+        Args:
+            host (str): Address of the intermediate server.
+            port (int): Port of the intermediate server.
+            pool_size (int): Number of connections.
+            timeout (float): Seconds to connect, and to wait for a response.
+        """
+        if pool_size < 1:
+            raise ValueError("The pool needs at least one connection.")
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.__connections = [None] * pool_size
+        self.__lock = None
+
+    async def __connection(self):
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+        async with self.__lock:
+            for i, connection in enumerate(self.__connections):
+                if connection is None or connection.closed:
+                    self.__connections[i] = await AsyncServerConnection.open(self.host, self.port, self.timeout)
+        return min(self.__connections, key=lambda connection: connection.outstanding)
+
+    async def submit(self, payload, parse) -> asyncio.Future:
+        """
+        Send a request built by a *_request() method without waiting for its response.
+
+        Returns:
+            asyncio.Future: the parsed response.
+        """
+        connection = await self.__connection()
+        future = connection.submit(payload, parse)
+        await connection.drain()
+        return future
+
+    async def call(self, payload, parse):
+        """
+        Send a request built by a *_request() method and wait for its response.
+
+        Raises:
+            ServerErrorResponse, ConnectionError, TimeoutError
+        """
+        return await asyncio.wait_for(await self.submit(payload, parse), self.timeout)
+
+    async def read_record(self, keystore, record_number: int) -> bytes:
+        return await self.call(*self.read_record_request(keystore, record_number))
+
+    async def encrypt_AES_binary(self, keystore, index_key: int, data: bytes | bytearray) -> bytes:
+        return await self.call(*self.encrypt_AES_binary_request(keystore, index_key, data))
+
+    async def decrypt_AES_binary(self, keystore, index_key: int, data: bytes | bytearray) -> bytes:
+        return await self.call(*self.decrypt_AES_binary_request(keystore, index_key, data))
+
+    async def wrap_cek(self, keystore, index_key: int, key: bytes | bytearray) -> bytes:
+        return await self.call(*self.wrap_cek_request(keystore, index_key, key))
+
+    async def unwrap_cek(self, keystore, index_key: int, ck: bytes | bytearray) -> bytes:
+        return await self.call(*self.unwrap_cek_request(keystore, index_key, ck))
+
+    async def wrap_cek_many(self, keystore, index_key: int, keys: list[bytes | bytearray]) -> list[bytes]:
+        """Wrap any number of keys, 8 keys per request, pipelined."""
+        results = await asyncio.gather(
+            *(self.call(*self.wrap_cek_many_request(keystore, index_key, keys[i : i + 8])) for i in range(0, len(keys), 8))
+        )
+        return [ck for cks in results for ck in cks]
+
+    async def unwrap_cek_many(self, keystore, index_key: int, cks: list[bytes | bytearray]) -> list[bytes]:
+        """Recover any number of keys, 8 keys per request, pipelined."""
+        results = await asyncio.gather(
+            *(self.call(*self.unwrap_cek_many_request(keystore, index_key, cks[i : i + 8])) for i in range(0, len(cks), 8))
+        )
+        return [key for keys in results for key in keys]
+
+    async def close(self):
+        """
+        Close every connection, failing the pending requests.
+        """
+        for connection in self.__connections:
+            if connection is not None:
+                await connection.close()
+        self.__connections = [None] * len(self.__connections)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,312 @@
+import re
+import socket
+import threading
+from concurrent.futures import Future
+
+from core.request.framing import FrameDecoder, FramingError, encode_frame
+
+
+class ServerErrorResponse(Exception):
+    """The intermediate server (or the keystore behind it) answered a request with an error."""
+    pass
+
+
+class IntermediateRequests:
+    """
+    Builders of the requests to the intermediate server (see RemoteRequest for their format).
+
+    Each builder checks its arguments and returns the payload of the request with the parser
+    of its response, so that requests can be sent one by one or pipelined.
+    """
+
+    @staticmethod
+    def _keystore_id(keystore: str | int) -> int:
+        """
+        Args:
+            keystore (str | int): Hostname of the keystore ("keyx.com") or x.
+        """
+        if isinstance(keystore, str):
+            match = re.fullmatch(r"key(\d+)\.com", keystore)
+            if match is None:
+                raise ValueError(f"Unknown keystore: {keystore}")
+            keystore = int(match.group(1))
+        if not 0 <= keystore <= 0xFF:
+            raise ValueError(f"Unknown keystore: {keystore}")
+        return keystore
+
+    @staticmethod
+    def _parse(response: bytes) -> bytes:
+        """
+        Returns:
+            bytes: The data of a successful response.
+
+        Raises:
+            ServerErrorResponse
+        """
+        if response[:1] != b"\x00":
+            raise ServerErrorResponse(f"Request failed: {response!r}")
+        return response[1:]
+
+    @staticmethod
+    def _split_parser(size: int):
+        def parse(response):
+            data = IntermediateRequests._parse(response)
+            return [data[i : i + size] for i in range(0, len(data), size)]
+        return parse
+
+    @staticmethod
+    def __payload(cmd_id: int, keystore, byte: int, data: bytes | bytearray = b"") -> bytes:
+        if not 0 <= byte <= 0xFF:
+            raise ValueError("Record or key slot number out of range.")
+        return bytes([cmd_id, IntermediateRequests._keystore_id(keystore), byte]) + data
+
+    def read_record_request(self, keystore, record_number: int):
+        """Read the record of a keystore."""
+        return IntermediateRequests.__payload(0, keystore, record_number), IntermediateRequests._parse
+
+    def encrypt_AES_binary_request(self, keystore, index_key: int, data: bytes | bytearray):
+        """Encrypt 1 to 16 blocks with the key of a slot."""
+        return IntermediateRequests.__payload(1, keystore, index_key, data), IntermediateRequests._parse
+
+    def decrypt_AES_binary_request(self, keystore, index_key: int, data: bytes | bytearray):
+        """Decrypt 1 to 16 blocks with the key of a slot."""
+        return IntermediateRequests.__payload(2, keystore, index_key, data), IntermediateRequests._parse
+
+    def wrap_cek_request(self, keystore, index_key: int, key: bytes | bytearray):
+        """Wrap a 256 bits content encryption key."""
+        if len(key) != 32:
+            raise ValueError("Incorrect key length.")
+        return IntermediateRequests.__payload(3, keystore, index_key, key), IntermediateRequests._parse
+
+    def unwrap_cek_request(self, keystore, index_key: int, ck: bytes | bytearray):
+        """Recover a content encryption key from its wrapped form."""
+        if len(ck) != 48:
+            raise ValueError("Incorrect wrapped key length.")
+        return IntermediateRequests.__payload(4, keystore, index_key, ck), IntermediateRequests._parse
+
+    def wrap_cek_many_request(self, keystore, index_key: int, keys: list[bytes | bytearray]):
+        """Wrap 1 to 8 content encryption keys."""
+        if not 0 < len(keys) <= 8 or any(len(key) != 32 for key in keys):
+            raise ValueError("1 to 8 keys of 32 bytes are expected.")
+        return (
+            IntermediateRequests.__payload(5, keystore, index_key, b"".join(keys)),
+            IntermediateRequests._split_parser(48),
+        )
+
+    def unwrap_cek_many_request(self, keystore, index_key: int, cks: list[bytes | bytearray]):
+        """Recover 1 to 8 content encryption keys."""
+        if not 0 < len(cks) <= 8 or any(len(ck) != 48 for ck in cks):
+            raise ValueError("1 to 8 wrapped keys of 48 bytes are expected.")
+        return (
+            IntermediateRequests.__payload(6, keystore, index_key, b"".join(cks)),
+            IntermediateRequests._split_parser(32),
+        )
+
+
+class ServerConnection:
+    """
+    A persistent connection to the intermediate server, using the framed protocol:
+    requests are pipelined and their responses matched by request ID, in any order.
+    """
+
+    def __init__(self, host, port, timeout=5):
+        self.__socket = socket.create_connection((host, port), timeout=timeout)
+        self.__socket.settimeout(None)
+        self.__socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.__lock = threading.Lock()
+        self.__pending = {}  # request ID: (Future, parse)
+        self.__next_id = 0
+        self.__closed = False
+        self.__thread = threading.Thread(target=self.__read_responses, daemon=True)
+        self.__thread.start()
+
+    @property
+    def outstanding(self):
+        """Number of requests waiting for their response."""
+        return len(self.__pending)
+
+    @property
+    def closed(self):
+        return self.__closed
+
+    def submit(self, payload, parse) -> Future:
+        """
+        Send a request without waiting for its response.
+
+        Returns:
+            Future: the parsed response. Cancelling it forgets the request (its response is ignored).
+        """
+        future = Future()
+        with self.__lock:
+            if self.__closed:
+                raise ConnectionError("Connection to the intermediate server closed.")
+            request_id = self.__next_id
+            self.__next_id = (self.__next_id + 1) & 0xFFFFFFFF
+            self.__pending[request_id] = (future, parse)
+            try:
+                self.__socket.sendall(encode_frame(request_id, payload))
+            except OSError:
+                del self.__pending[request_id]
+                self.__fail(ConnectionError("Connection to the intermediate server lost."))
+                raise
+        future.add_done_callback(lambda future: self.__forget(request_id, future))
+        return future
+
+    def __forget(self, request_id, future):
+        """Remove a cancelled request, so that it does not count as outstanding."""
+        # Not for the other outcomes: __fail completes the requests with the lock held
+        if future.cancelled():
+            with self.__lock:
+                self.__pending.pop(request_id, None)
+
+    def __read_responses(self):
+        decoder = FrameDecoder()
+        error = ConnectionError("Connection to the intermediate server closed.")
+        try:
+            while True:
+                data = self.__socket.recv(65536)
+                if not data:
+                    break
+                for request_id, response in decoder.feed(data):
+                    with self.__lock:
+                        future, parse = self.__pending.pop(request_id, (None, None))
+                    if future is None or not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        future.set_result(parse(response))
+                    except Exception as e:
+                        future.set_exception(e)
+        except (OSError, FramingError) as e:
+            error = ConnectionError(f"Connection to the intermediate server lost: {e}")
+        with self.__lock:
+            self.__fail(error)
+
+    def __fail(self, error):
+        """Fail every pending request and close the connection (the lock must be held)."""
+        self.__closed = True
+        for future, _ in self.__pending.values():
+            if future.set_running_or_notify_cancel():
+                future.set_exception(error)
+        self.__pending.clear()
+        try:
+            self.__socket.close()
+        except OSError:
+            pass
+
+    def close(self):
+        with self.__lock:
+            if not self.__closed:
+                try:
+                    self.__socket.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                self.__fail(ConnectionError("Connection to the intermediate server closed."))
+
+
+class IntermediateClient(IntermediateRequests):
+    """
+    Client of the intermediate server, with a pool of persistent connections.
+
+    Requests are sent on the connection with the fewest outstanding requests and pipelined.
+    A lost connection fails its pending requests and is opened again by the next request.
+
+    Example:
+        with IntermediateClient("127.0.0.1", 6123) as client:
+            ck = client.wrap_cek("key17.com", 1, key)
+            futures = [client.submit(*client.unwrap_cek_request("key17.com", 1, ck)) for ck in cks]
+    """
+
+    def __init__(self, host, port, pool_size = 4, timeout = 5):
+        """
+        Args:
+            host (str): Address of the intermediate server.
+            port (int): Port of the intermediate server.
+            pool_size (int): Number of connections.
+            timeout (float): Seconds to connect, and to wait for a response.
+        """
+        if pool_size < 1:
+            raise ValueError("The pool needs at least one connection.")
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.__connections = [None] * pool_size
+        self.__lock = threading.Lock()
+
+    def __connection(self):
+        with self.__lock:
+            for i, connection in enumerate(self.__connections):
+                if connection is None or connection.closed:
+                    self.__connections[i] = ServerConnection(self.host, self.port, self.timeout)
+            return min(self.__connections, key=lambda connection: connection.outstanding)
+
+    def submit(self, payload, parse) -> Future:
+        """
+        Send a request built by a *_request() method without waiting for its response.
+
+        Returns:
+            Future: the parsed response.
+        """
+        return self.__connection().submit(payload, parse)
+
+    def call(self, payload, parse):
+        """
+        Send a request built by a *_request() method and wait for its response.
+        On timeout, the request is cancelled.
+
+        Raises:
+            ServerErrorResponse, ConnectionError, TimeoutError
+        """
+        future = self.submit(payload, parse)
+        try:
+            return future.result(self.timeout)
+        finally:
+            future.cancel()
+
+    def read_record(self, keystore, record_number: int) -> bytes:
+        return self.call(*self.read_record_request(keystore, record_number))
+
+    def encrypt_AES_binary(self, keystore, index_key: int, data: bytes | bytearray) -> bytes:
+        return self.call(*self.encrypt_AES_binary_request(keystore, index_key, data))
+
+    def decrypt_AES_binary(self, keystore, index_key: int, data: bytes | bytearray) -> bytes:
+        return self.call(*self.decrypt_AES_binary_request(keystore, index_key, data))
+
+    def wrap_cek(self, keystore, index_key: int, key: bytes | bytearray) -> bytes:
+        return self.call(*self.wrap_cek_request(keystore, index_key, key))
+
+    def unwrap_cek(self, keystore, index_key: int, ck: bytes | bytearray) -> bytes:
+        return self.call(*self.unwrap_cek_request(keystore, index_key, ck))
+
+    def wrap_cek_many(self, keystore, index_key: int, keys: list[bytes | bytearray]) -> list[bytes]:
+        """Wrap any number of keys, 8 keys per request, pipelined."""
+        futures = [self.submit(*self.wrap_cek_many_request(keystore, index_key, keys[i : i + 8])) for i in range(0, len(keys), 8)]
+        return self.__results(futures)
+
+    def unwrap_cek_many(self, keystore, index_key: int, cks: list[bytes | bytearray]) -> list[bytes]:
+        """Recover any number of keys, 8 keys per request, pipelined."""
+        futures = [self.submit(*self.unwrap_cek_many_request(keystore, index_key, cks[i : i + 8])) for i in range(0, len(cks), 8)]
+        return self.__results(futures)
+
+    def __results(self, futures):
+        """Concatenate the results of pipelined requests, cancelling them on timeout or error."""
+        try:
+            return [item for future in futures for item in future.result(self.timeout)]
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def close(self):
+        """
+        Close every connection, failing the pending requests.
+        """
+        with self.__lock:
+            for connection in self.__connections:
+                if connection is not None:
+                    connection.close()
+            self.__connections = [None] * len(self.__connections)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,205 @@
+import threading
+import time
+
+from core.request.interface import BaseRequest
+
+
+class CoalescedRequest(BaseRequest):
+    """
+    Block requests (encrypt_AES_binary or decrypt_AES_binary) of a keystore and key slot
+    sent as a single command. The response is split back to each request.
+    """
+
+    def __init__(self, keystore: str, method_name: str, index_key: int, requests: list):
+        """
+        Args:
+            keystore (str): keystore hostname.
+            method_name (str): "encrypt_AES_binary" or "decrypt_AES_binary".
+            index_key (int): Key index.
+            requests (list[tuple]): The requests and their data (whole blocks), in order.
+        """
+        self.__keystore = keystore
+        self.__method_name = method_name
+        self.__index_key = index_key
+        self.__requests = requests
+
+    def get_keystore(self):
+        """
+        Get the request's keystore.
+
+        Returns:
+            str: keystore hostname.
+        """
+        return self.__keystore
+
+    def get_method_name(self):
+        """
+        Returns:
+            str: "encrypt_AES_binary" or "decrypt_AES_binary".
+        """
+        return self.__method_name
+
+    def start_request(self):
+        """
+        Start the merged requests, leaving out those that must not be sent.
+
+        Returns:
+            bool: False if no request is left.
+        """
+        self.__requests = [(request, data) for request, data in self.__requests if request.start_request()]
+        return bool(self.__requests)
+
+    def __data(self):
+        return b"".join(data for _, data in self.__requests)
+
+    def process_request(self, socketWrapper):
+        """
+        Send the merged request, retrieve the response then complete each request.
+
+        Args:
+            socketWrapper (TLSSocketWrapper): TLSSocketWrapper instance.
+        """
+        if not self.start_request():
+            return
+        try:
+            response = getattr(socketWrapper, self.__method_name)(self.__index_key, self.__data())
+        except Exception as e:
+            self.complete_request(error=e)
+        else:
+            self.complete_request(response)
+
+    def prepare_command(self, socketWrapper):
+        """
+        Build the command of the merged request.
+
+        Args:
+            socketWrapper (TLSSocketWrapper): TLSSocketWrapper instance.
+
+        Returns:
+            KeystoreCommand: the command to send.
+        """
+        return getattr(socketWrapper, f"{self.__method_name}_command")(self.__index_key, self.__data())
+
+    def complete_request(self, response=None, error=None):
+        """
+        Complete each request with its part of the response (or with the error).
+
+        Args:
+            response (bytes): the response of the merged request.
+            error (Exception): the error raised instead of a response.
+        """
+        offset = 0
+        for request, data in self.__requests:
+            try:
+                if error is not None:
+                    request.complete_request(error=error)
+                else:
+                    request.complete_request(response[offset : offset + len(data)])
+            except Exception as e:
+                print("Error: could not complete the request for", request.get_keystore(), e)
+            offset += len(data)
+
+
+class BlockRequestCoalescer:
+    """
+    Merge the block requests (encrypt_AES_binary, decrypt_AES_binary) sent to the same keystore and key slot
+    within a short window into commands of up to max_blocks blocks, before dispatching them.
+
+    The other requests are dispatched right away.
+    Merging changes the order in which the responses of a keystore are sent: only use it for
+    clients that match the responses by request ID (framed protocol).
+
+    Requests must provide get_method() (see RemoteRequest).
+    """
+
+    METHODS = ("encrypt_AES_binary", "decrypt_AES_binary")
+    BLOCK_SIZE = 16
+
+    def __init__(self, dispatch, window: float = 0.0002, max_blocks: int = 16):
+        """
+        Args:
+            dispatch (callable): Called with each request to send, e.g. ConnectionWorker.dispatch_request.
+            window (float): Seconds a block request waits for others to be merged with.
+            max_blocks (int): Blocks of a merged command (16 at most for the keystore).
+        """
+        self.__dispatch = dispatch
+        self.window = window
+        self.max_blocks = max_blocks
+        self.__buckets = {}  # (keystore, method name, key index): (deadline, blocks, [(request, data)])
+        self.__condition = threading.Condition()
+        self.__thread = threading.Thread(target=self.__flush_expired, daemon=True)
+        self.__thread.start()
+
+    def __blocks(self, request):
+        """
+        Returns:
+            tuple: (bucket key, data, number of blocks), or None if the request is not merged.
+        """
+        method = request.get_method()
+        if method[0] not in BlockRequestCoalescer.METHODS or len(method) != 3:
+            return None
+        name, index_key, data = method
+        blocks, rest = divmod(len(data), BlockRequestCoalescer.BLOCK_SIZE)
+        if rest or not 0 < blocks < self.max_blocks:
+            return None
+        return (request.get_keystore(), name, index_key), data, blocks
+
+    def dispatch(self, request):
+        """
+        Send a request, merged with other block requests if possible.
+
+        Raises:
+            Exceptions of dispatch for the requests not merged (merged requests are completed with their errors).
+        """
+        merge = self.__blocks(request)
+        if merge is None:
+            self.__dispatch(request)
+            return
+
+        key, data, blocks = merge
+        full = []
+        with self.__condition:
+            bucket = self.__buckets.get(key)
+            if bucket is not None and bucket[1] + blocks > self.max_blocks:
+                full.append((key, self.__buckets.pop(key)[2]))
+                bucket = None
+            if bucket is None:
+                bucket = (time.monotonic() + self.window, 0, [])
+                self.__condition.notify()
+            deadline, total, requests = bucket
+            requests.append((request, data))
+            if total + blocks == self.max_blocks:
+                self.__buckets.pop(key, None)
+                full.append((key, requests))
+            else:
+                self.__buckets[key] = (deadline, total + blocks, requests)
+
+        for key, requests in full:
+            self.__send(key, requests)
+
+    def __send(self, key, requests):
+        keystore, name, index_key = key
+        if len(requests) == 1:
+            request = requests[0][0]
+        else:
+            request = CoalescedRequest(keystore, name, index_key, requests)
+        try:
+            self.__dispatch(request)
+        except Exception as e:
+            request.complete_request(error=e)
+
+    def __flush_expired(self):
+        """Dispatch the requests whose window is over."""
+        while True:
+            with self.__condition:
+                while True:
+                    now = time.monotonic()
+                    expired = [key for key, bucket in self.__buckets.items() if bucket[0] <= now]
+                    if expired:
+                        break
+                    timeout = min((bucket[0] for bucket in self.__buckets.values()), default=None)
+                    self.__condition.wait(None if timeout is None else timeout - now)
+                batches = [(key, self.__buckets.pop(key)[2]) for key in expired]
+
+            for key, requests in batches:
+                self.__send(key, requests)
@@ -0,0 +1,130 @@
+import struct
+import threading
+
+# Framed protocol of the intermediate server (version 1):
+# [byte 0: 0xF1 (marker and version, cannot be a legacy cmd_id)]
+# [bytes 1-4: request ID (big endian), chosen by the client, echoed in the response]
+# [bytes 5-8: payload length (big endian)]
+# [bytes 9-: payload: a legacy request (cmd_id, keyx.com, ...) or its response (0x00 + data, or "01")]
+#
+# A connection whose first byte is not the marker uses the legacy protocol (one request per recv,
+# responses in the order of each keystore).
+FRAME_MARKER = 0xF1
+FRAME_HEADER = struct.Struct(">BII")
+MAX_FRAME_PAYLOAD = 64 * 1024
+
+
+class FramingError(Exception):
+    """The bytes received are not a valid frame: the connection can no longer be used."""
+    pass
+
+
+def is_framed(buffer) -> bool:
+    """
+    Check if a connection uses the framed protocol, from its first bytes.
+    """
+    return len(buffer) > 0 and buffer[0] == FRAME_MARKER
+
+
+def encode_frame(request_id: int, payload: bytes | bytearray) -> bytes:
+    """
+    Args:
+        request_id (int): ID of the request (0 to 2**32 - 1).
+        payload (bytes-like object): The request or the response.
+
+    Returns:
+        bytes: The frame.
+    """
+    if len(payload) > MAX_FRAME_PAYLOAD:
+        raise ValueError("Frame payload too long.")
+    return FRAME_HEADER.pack(FRAME_MARKER, request_id, len(payload)) + payload
+
+
+class FrameDecoder:
+    """
+    Split a byte stream into frames, whatever the chunks it is received in.
+    """
+
+    def __init__(self):
+        self.__buffer = bytearray()
+
+    def feed(self, data: bytes | bytearray) -> list[tuple[int, bytes]]:
+        """
+        Args:
+            data (bytes-like object): Bytes received.
+
+        Returns:
+            list[tuple[int, bytes]]: (request ID, payload) of the frames completed by the data.
+
+        Raises:
+            FramingError: Unknown marker or too long payload.
+        """
+        self.__buffer += data
+        frames = []
+        offset = 0
+        while len(self.__buffer) - offset >= FRAME_HEADER.size:
+            marker, request_id, length = FRAME_HEADER.unpack_from(self.__buffer, offset)
+            if marker != FRAME_MARKER:
+                raise FramingError(f"Unknown frame marker: {marker:#02x}")
+            if length > MAX_FRAME_PAYLOAD:
+                raise FramingError(f"Frame payload too long: {length} bytes")
+            end = offset + FRAME_HEADER.size + length
+            if len(self.__buffer) < end:
+                break
+            frames.append((request_id, bytes(self.__buffer[offset + FRAME_HEADER.size : end])))
+            offset = end
+        del self.__buffer[:offset]
+        return frames
+
+
+class FramedOrigin:
+    """
+    Origin of a RemoteRequest received in a frame: its response is sent in a frame with the same request ID.
+    """
+
+    def __init__(self, connection, request_id):
+        self.__connection = connection
+        self.__request_id = request_id
+
+    def send(self, data):
+        self.__connection.send_frame(self.__request_id, data)
+        return len(data)
+
+
+class FramedConnection:
+    """
+    Server side of a client connection using the framed protocol.
+
+    The responses of the keystores are sent as soon as they are ready, possibly out of order,
+    from the threads of the workers: a lock keeps the frames whole.
+    """
+
+    def __init__(self, origin):
+        """
+        Args:
+            origin: The client connection (socket or object with a send() method).
+        """
+        self.__send = getattr(origin, "sendall", origin.send)
+        self.__lock = threading.Lock()
+        self.__decoder = FrameDecoder()
+
+    def send_frame(self, request_id, payload):
+        frame = encode_frame(request_id, payload)
+        with self.__lock:
+            self.__send(frame)
+
+    def feed(self, data) -> list[tuple[FramedOrigin, bytes]]:
+        """
+        Args:
+            data (bytes-like object): Bytes received from the client.
+
+        Returns:
+            list[tuple[FramedOrigin, bytes]]: The origin and the payload of each request received.
+
+        Raises:
+            FramingError
+        """
+        return [
+            (FramedOrigin(self, request_id), payload)
+            for request_id, payload in self.__decoder.feed(data)
+        ]
@@ -32,3 +32,71 @@ class BaseRequest(ABC):
         """
         ...
 
+    @abstractmethod
+    def prepare_command(self, socketWrapper):
+        """
+        Build the command of the request, to send it in a pipeline.
+
+        Args:
+            socketWrapper (TLSSocketWrapper): TLSSocketWrapper instance.
+
+        Returns:
+            KeystoreCommand: the command to send.
+
+        Raises:
+            ValueError: invalid arguments for the command.
+        """
+        ...
+
+    @abstractmethod
+    def complete_request(self, response=None, error=None):
+        """
+        Handle the outcome of the request once its command was sent.
+        It can : store the response, signal the response is ready, or send the response.
+
+        Args:
+            response: the parsed response of the command.
+            error (Exception): the error raised instead of a response.
+        """
+        ...
+
+    def get_method_name(self) -> str:
+        """
+        Get the name of the TLSSocketWrapper method of the request (e.g. for metrics).
+
+        Returns:
+            str: e.g. "unwrap_cek", "unknown" if the request does not tell.
+        """
+        return "unknown"
+
+    def get_priority(self) -> str:
+        """
+        Get the priority class of the request in the queues of the workers (see core.tls.request_scheduler).
+
+        Returns:
+            str: "interactive" (default) or "bulk".
+        """
+        return "interactive"
+
+    def get_deadline(self) -> float | None:
+        """
+        Returns:
+            float: Time (monotonic) after which the request is not sent, None if it has no deadline.
+        """
+        return None
+
+    def is_cancelled(self) -> bool:
+        """
+        Returns:
+            bool: True if the request was cancelled before being sent.
+        """
+        return False
+
+    def start_request(self) -> bool:
+        """
+        Called just before the request is sent.
+
+        Returns:
+            bool: False if the request must not be sent (e.g. cancelled).
+        """
+        return True
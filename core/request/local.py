@@ -1,22 +1,39 @@
 from operator import methodcaller
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from core.request.interface import BaseRequest
-import threading
 import time
 
-class LocalRequest(BaseRequest):
+class LocalRequest(BaseRequest, Future):
     """
     A class that represents a request with its response.
 
+    The request is a concurrent.futures.Future of its response: add_done_callback(),
+    concurrent.futures.wait() and as_completed() can be used on requests directly.
+
     Depends on:
         TLSSocketWrapper: name of the methods to use.
     """
-    def __init__(self, keystore: str, method: tuple[str, ...], response_queue = None):
-        self.__response = None
+    DEFAULT_TIMEOUT = 3  # Seconds get_response() waits for a request without deadline
+
+    def __init__(self, keystore: str, method: tuple[str, ...], response_queue = None, timeout = None, priority = "interactive"):
+        """
+        Args:
+            keystore (str): keystore hostname.
+            method (tuple): Name of the TLSSocketWrapper method then its arguments, e.g. ("unwrap_cek", 1, ck).
+            response_queue (queue.Queue): Queue in which the request is put once done.
+            timeout (float): Seconds from now after which the request is dropped instead of sent (deadline).
+            priority (str): "interactive" (e.g. a user waiting) or "bulk" (e.g. a backup job), sent after the
+                interactive requests (see core.tls.request_scheduler).
+        """
+        Future.__init__(self)
         self.__keystore = keystore
+        self.__method_name = method[0]
         self.__SocketWrapperMethodCaller = methodcaller(*method)
-        self.__done = threading.Event()
-        self.__error = None
-        self.__simultaneous_queue = response_queue
+        self.__SocketWrapperCommandCaller = methodcaller(f"{method[0]}_command", *method[1:])
+        self.__deadline = None if timeout is None else time.monotonic() + timeout
+        self.__priority = priority
+        if response_queue is not None:
+            self.add_done_callback(response_queue.put)
 
     def get_keystore(self):
         """
@@ -27,6 +44,45 @@ class LocalRequest(BaseRequest):
         """
         return self.__keystore
 
+    def get_method_name(self):
+        """
+        Returns:
+            str: name of the TLSSocketWrapper method of the request.
+        """
+        return self.__method_name
+
+    def get_priority(self):
+        """
+        Returns:
+            str: priority class of the request.
+        """
+        return self.__priority
+
+    def get_deadline(self):
+        """
+        Returns:
+            float: see deadline.
+        """
+        return self.__deadline
+
+    @property
+    def deadline(self):
+        """Time (monotonic) after which the request is not sent, None if it has no deadline."""
+        return self.__deadline
+
+    def start_request(self):
+        """
+        Mark the request as being sent. Past its deadline, the request fails with TimeoutError.
+
+        Returns:
+            bool: False if the request was cancelled or expired (do not send it).
+        """
+        if self.__deadline is not None and time.monotonic() > self.__deadline:
+            if self.set_running_or_notify_cancel():
+                self.set_exception(TimeoutError(f"Deadline of the request to {self.__keystore} expired."))
+            return False
+        return self.set_running_or_notify_cancel()
+
     def process_request(self, socketWrapper):
         """
         Send the request, retrieve the response then stores it.
@@ -35,33 +91,72 @@ class LocalRequest(BaseRequest):
             socketWrapper (TLSSocketWrapper): TLSSocketWrapper instance.
         """
 
+        if not self.start_request():
+            return
         try:
-            self.__response = self.__SocketWrapperMethodCaller(socketWrapper)
-            if self.__simultaneous_queue:
-                self.__simultaneous_queue.put(self)
+            response = self.__SocketWrapperMethodCaller(socketWrapper)
         except Exception as e:
-            self.__error = e
-        finally:
-            self.__done.set()
+            self.complete_request(error=e)
+        else:
+            self.complete_request(response)
+
+    def prepare_command(self, socketWrapper):
+        """
+        Build the command of the request.
+
+        Args:
+            socketWrapper (TLSSocketWrapper): TLSSocketWrapper instance.
+
+        Returns:
+            KeystoreCommand: the command to send.
+        """
+        return self.__SocketWrapperCommandCaller(socketWrapper)
 
+    def complete_request(self, response=None, error=None):
+        """
+        Store the response (or the error) and signal it is ready.
+        The request is put in the response queue, if any, even on error.
+
+        Args:
+            response: the response.
+            error (Exception): the error raised instead of a response.
+        """
+        if error is not None:
+            self.set_exception(error)
+        else:
+            self.set_result(response)
+
+    def is_cancelled(self):
+        """
+        Returns:
+            bool: True if the request was cancelled.
+        """
+        return self.cancelled()
 
-    def get_response(self, timeout=3):
+    def get_response(self, timeout=None):
         """
         Returns the response of the client (blocking).
+        If the timeout expires before the request is sent, the request is cancelled: the caller gave up on it.
 
         Argument:
-            timeout (int): timeout to get a response.
+            timeout (float): timeout to get a response, by default until the deadline of the request
+                (without deadline, DEFAULT_TIMEOUT).
 
         Returns:
             bytes: the response.
 
         Raises:
+            TimeoutError: no response before the timeout.
+            concurrent.futures.CancelledError: the request was cancelled.
             Exceptions of socketWrapper.
         """
-        self.__done.wait(timeout)
-        #time.sleep(2)
-        if self.__error:
-            print(self.__error)
-            raise self.__error
-        return self.__response
-
+        if timeout is None:
+            if self.__deadline is None:
+                timeout = self.DEFAULT_TIMEOUT
+            else:
+                timeout = max(0, self.__deadline - time.monotonic())
+        try:
+            return self.result(timeout)
+        except FutureTimeoutError:
+            self.cancel()
+            raise
@@ -18,7 +18,9 @@ class RemoteRequest(BaseRequest):
         self.__origin_socket = socket  # some wrapper with a queue
         self.__raw_request = request
         self.__keystore = None
+        self.__method = None
         self.__SocketWrapperMethodCaller = None
+        self.__SocketWrapperCommandCaller = None
         self.__decode_request()
 
     def get_keystore(self):
@@ -30,6 +32,22 @@ class RemoteRequest(BaseRequest):
         """
         return self.__keystore
 
+    def get_method(self):
+        """
+        Get the TLSSocketWrapper method of the request.
+
+        Returns:
+            tuple: Name of the method then its arguments, e.g. ("encrypt_AES_binary", 1, data).
+        """
+        return self.__method
+
+    def get_method_name(self):
+        """
+        Returns:
+            str: name of the TLSSocketWrapper method of the request, "unknown" if it could not be decoded.
+        """
+        return self.__method[0] if self.__method else "unknown"
+
     def process_request(self, socketWrapper):
         """
         Send the request, retrieve the response then transmits it.
@@ -40,6 +58,33 @@ class RemoteRequest(BaseRequest):
         self.__runSocketWrapperMethod(socketWrapper)
         self.send_response()
 
+    def prepare_command(self, socketWrapper):
+        """
+        Build the command of the request.
+
+        Args:
+            socketWrapper (TLSSocketWrapper): TLSSocketWrapper instance.
+
+        Returns:
+            KeystoreCommand: the command to send.
+        """
+        return self.__SocketWrapperCommandCaller(socketWrapper)
+
+    def complete_request(self, response=None, error=None):
+        """
+        Store the response (or the error code) then transmits it.
+
+        Args:
+            response (bytes): the response.
+            error (Exception): the error raised instead of a response.
+        """
+        if error is not None:
+            # Error codes
+            print(error)
+            self.__response = b"01"
+        else:
+            self.__response = b"\x00" + RemoteRequest.__to_bytes(response)
+        self.send_response()
 
     def __runSocketWrapperMethod(self, socketWrapper):
         """
@@ -53,7 +98,7 @@ class RemoteRequest(BaseRequest):
             Exceptions from TLSSocketWrapper.
         """
         try:
-            self.__response = b"\x00" + self.__SocketWrapperMethodCaller(socketWrapper)
+            self.__response = b"\x00" + RemoteRequest.__to_bytes(self.__SocketWrapperMethodCaller(socketWrapper))
         except Exception as e:
             # Error codes
             print(e)
@@ -80,6 +125,27 @@ class RemoteRequest(BaseRequest):
         # Add a try block or use a response dispatcher if there is concurrency on the socket (more than 1 destination per origin socket)
         self.__origin_socket.send(response)
 
+    @staticmethod
+    def __to_bytes(response):
+        """
+        Concatenate the responses of the methods returning a list (e.g. wrap_cek_many).
+        """
+        if isinstance(response, list):
+            return b"".join(response)
+        return response
+
+    @staticmethod
+    def __split(data, size):
+        """
+        Split the data of a request into items of the given size (e.g. keys).
+
+        Raises:
+            ValueError: The length of the data is not a multiple of the size.
+        """
+        if len(data) % size != 0:
+            raise ValueError(f"Request data is not made of {size} bytes items.")
+        return [data[i : i + size] for i in range(0, len(data), size)]
+
     def __decode_request(self):
         """
         Decode the raw binary request stored in the instance.
@@ -95,43 +161,49 @@ class RemoteRequest(BaseRequest):
         # Here is the byte syntax of the clients' requests
         dispatch = {
             # Read record
-            0: lambda: methodcaller("read_record", self.__raw_request[2]),
+            0: lambda: ("read_record", self.__raw_request[2]),
             # [byte 0: 0x00 (cmd_id 0)]
             # [byte 1: keyx.com]
             # [byte 2: record number]
             # Encrypt AES (binary)
-            1: lambda: methodcaller(
-                "encrypt_AES_binary", self.__raw_request[2], self.__raw_request[3:]
-            ),
+            1: lambda: ("encrypt_AES_binary", self.__raw_request[2], self.__raw_request[3:]),
             # [byte 0: 0x01 (cmd_id 1)]
             # [byte 1: keyx.com]
             # [byte 2: key slot number]
             # [bytes 3-: data blocks (up to 16 blocks)]
             # Decrypt AES (binary)
-            2: lambda: methodcaller(
-                "decrypt_AES_binary", self.__raw_request[2], self.__raw_request[3:]
-            ),
+            2: lambda: ("decrypt_AES_binary", self.__raw_request[2], self.__raw_request[3:]),
             # [byte 0: 0x02 (cmd_id 2)]
             # [byte 1: keyx.com]
             # [byte 2: key slot number]
             # [bytes 3-: data blocks (up to 16 blocks)]
             # Generate Ck from k
-            3: lambda: methodcaller(
-                "wrap_cek", self.__raw_request[2], self.__raw_request[3:]
-            ),
+            3: lambda: ("wrap_cek", self.__raw_request[2], self.__raw_request[3:]),
             # [byte 0: 0x01 (cmd_id 1)]
             # [byte 1: keyx.com]
             # [byte 2: key slot number]
             # [bytes 3-34: key k (256 bits)]
             # Get K from ck
-            4: lambda: methodcaller(
-                "unwrap_cek", self.__raw_request[2], self.__raw_request[3:]
-            ),
+            4: lambda: ("unwrap_cek", self.__raw_request[2], self.__raw_request[3:]),
             # [byte 0: 0x02 (cmd_id 2)]
             # [byte 1: keyx.com]
             # [byte 2: key slot number]
             # [bytes 3-50: key k (256 bits)]
-            9: lambda: methodcaller("other request not implemented yet"),
+            # Generate Ck from k, for several keys in one HSM command
+            5: lambda: ("wrap_cek_many", self.__raw_request[2], RemoteRequest.__split(self.__raw_request[3:], 32)),
+            # [byte 0: 0x05 (cmd_id 5)]
+            # [byte 1: keyx.com]
+            # [byte 2: key slot number]
+            # [bytes 3-: 1 to 8 keys k (256 bits each)]
+            # Response: the wrapped keys Ck (384 bits each), in order
+            # Get K from Ck, for several keys in one HSM command
+            6: lambda: ("unwrap_cek_many", self.__raw_request[2], RemoteRequest.__split(self.__raw_request[3:], 48)),
+            # [byte 0: 0x06 (cmd_id 6)]
+            # [byte 1: keyx.com]
+            # [byte 2: key slot number]
+            # [bytes 3-: 1 to 8 wrapped keys Ck (384 bits each)]
+            # Response: the keys k (256 bits each), in order
+            9: lambda: ("other request not implemented yet",),
             # [byte 0: 0x09 (cmd_id 9)]
             # [byte 1: keyx.com]
             # [byte 0x02: key slot number]
@@ -141,5 +213,8 @@ class RemoteRequest(BaseRequest):
         if cmd_id not in dispatch:
             raise ValueError(f"Unknown request ID: {cmd_id:#02x}")
 
-        self.__SocketWrapperMethodCaller = dispatch[cmd_id]()
+        method = dispatch[cmd_id]()
+        self.__method = method
+        self.__SocketWrapperMethodCaller = methodcaller(*method)
+        self.__SocketWrapperCommandCaller = methodcaller(f"{method[0]}_command", *method[1:])
         self.__keystore = f"key{self.__raw_request[1]}.com"
@@ -0,0 +1,117 @@
+import asyncio
+
+from core.tls.async_socket_wrapper import AsyncTLSSocketWrapper
+
+
+class AsyncConnectionWorker:
+    """
+    asyncio counterpart of ConnectionWorker: a pool of TLS sessions to a keystore, without threads.
+
+    Calls to the keystore are coroutines; concurrent calls are pipelined on the session
+    with the fewest outstanding commands.
+
+    Class attributes:
+        allWorkers (list): List of instances.
+        OPTIONS (tuple): Settings of a keystore (see core.tools.read_config.KEYSTORE_OPTIONS) supported
+            by the asyncio worker, the others only apply to ConnectionWorker.
+
+    Attribute:
+        servername (str): Hostname of the keystore.
+    """
+    allWorkers = []
+
+    OPTIONS = ("pipeline_depth", "pool_size")
+
+    def __init__(self, hostname, port, servername, psk = None, ensure_connected_before_send = True, pipeline_depth = 16, pool_size = 1):
+        self.servername = servername #ID
+
+        if pool_size < 1:
+            raise ValueError("The pool needs at least one session.")
+        self.__sessions = [
+            AsyncTLSSocketWrapper(hostname, port, servername, psk, ensure_connected_before_send, pipeline_depth)
+            for _ in range(pool_size)
+        ]
+        self.__running = False
+
+        AsyncConnectionWorker.allWorkers.append(self)
+
+    async def start_worker(self):
+        """
+        Start a worker: connect every session of the pool.
+        """
+        if not self.__running:
+            await asyncio.gather(*(session.connect() for session in self.__sessions))
+            print("Connected to", self.servername, f"({len(self.__sessions)} sessions)")
+            self.__running = True
+
+    def is_running(self):
+        """
+        Check if the worker is started.
+
+        Returns:
+            True if started, else returns False.
+        """
+        return self.__running
+
+    async def submit(self, method: tuple[str, ...]):
+        """
+        Call a method of AsyncTLSSocketWrapper on the least busy session.
+
+        Args:
+            method (tuple): Name of the method then its arguments, e.g. ("unwrap_cek", 1, ck).
+
+        Returns:
+            The response of the method.
+        """
+        session = min(self.__sessions, key=lambda session: session.outstanding)
+        name, *args = method
+        return await getattr(session, name)(*args)
+
+    @classmethod
+    def get_worker(cls, servername):
+        """
+        Find the worker of a keystore.
+
+        Raises:
+            LookupError
+        """
+        for worker in cls.allWorkers:
+            if worker.servername == servername:
+                return worker
+        raise LookupError("Keystore not found.")
+
+    @classmethod
+    def dispatch(cls, keystore: str, method: tuple[str, ...]):
+        """
+        Send a request to the right worker.
+
+        Args:
+            keystore (str): Hostname of the keystore.
+            method (tuple): Name of the method then its arguments, e.g. ("wrap_cek", 1, key).
+
+        Returns:
+            Awaitable: the response of the request.
+
+        Raises:
+            LookupError
+        """
+        return cls.get_worker(keystore).submit(method)
+
+    @classmethod
+    async def start_all(cls):
+        """
+        Start all workers.
+        """
+        await asyncio.gather(
+            *(worker.start_worker() for worker in cls.allWorkers if not worker.is_running())
+        )
+
+    @classmethod
+    async def stop_all(cls):
+        """
+        Stop all workers.
+        """
+        for worker in cls.allWorkers:
+            if worker.is_running():
+                await asyncio.gather(*(session.close() for session in worker.__sessions))
+                worker.__running = False
@@ -0,0 +1,362 @@
+import asyncio
+import collections
+import ssl
+
+from core.tls.socket_wrapper import (
+    TLSSocketWrapper,
+    KeystoreCommands,
+    TLSConnectionClosed,
+    TLSReconnectFailed,
+    CommandUnexpectedResponse,
+)
+
+
+class AsyncTLSSocketWrapper(KeystoreCommands):
+    """
+    asyncio TLS socket wrapper for secure client-server communication.
+
+    Same TLS 1.3 PSK context and Keystore commands as TLSSocketWrapper, built on asyncio streams.
+    Concurrent calls are pipelined on the session: each command is written as soon as it is
+    called (in its own TLS record, see TLSSocketWrapper), and a reader task matches the responses
+    to the commands in order.
+    """
+
+    def __init__(
+        self,
+        hostname,
+        port,
+        servername,
+        psk=None,
+        ensure_connected_before_send=True,
+        pipeline_depth=16,
+    ):
+        """
+        Initialize the TLS socket wrapper and SSL context.
+
+        Args:
+            servername (str): Server Name for TLS handshake.
+            hostname (str): Server IP or hostname.
+            port (int): Server port.
+            psk (bytes): The pre-shared key value.
+            ensure_connected_before_send (bool): Reconnects and sends again the unanswered commands
+                if the connection timed out (only if they cannot have been executed, see __recover).
+            pipeline_depth (int): Maximum number of commands waiting for their response.
+
+        Infos:
+            30s after executing a command the server will disconnect upon the reception of another command (except for echo)
+        """
+
+        self.__hostname = hostname
+        self.__port = port
+        self.__servername = servername
+        self.__context = TLSSocketWrapper.create_ssl_context()
+        self.__psk = psk
+        self.__ensure_connected_before_send = ensure_connected_before_send
+        if psk is not None:
+            self.__context.set_psk_client_callback(
+                lambda hint: ("Client_identity", self.__psk)
+            )
+
+        self.__reader = None
+        self.__writer = None
+        self.__reader_task = None
+        self.__pending = collections.deque()  # (command, future, responses read before it was sent) waiting for their response
+        self.__responses = 0  # Responses read on the session
+        self.__has_pending = asyncio.Event()
+        self.__connection_lock = asyncio.Lock()
+        self.__slots = asyncio.Semaphore(pipeline_depth)
+
+    ############## Read-only instance attributes ###############
+    @property
+    def hostname(self):
+        return self.__hostname
+
+    @property
+    def servername(self):
+        return self.__servername
+
+    @property
+    def outstanding(self):
+        """Number of commands waiting for their response."""
+        return len(self.__pending)
+
+    async def connect(self):
+        """
+        Establish a secure TLS connection with the given server.
+        Returns:
+            AsyncTLSSocketWrapper: The active socket wrapper instance.
+        Raises:
+            Exception: If connection or TLS handshake fails.
+        """
+        async with self.__connection_lock:
+            await self.__open()
+        return self
+
+    async def __open(self):
+        """
+        Open the connection and start the reader task (the connection lock must be held).
+        """
+        if not self.__hostname or not self.__port:
+            raise Exception("Hostname or port not set")
+        try:
+            self.__reader, self.__writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    self.__hostname,
+                    self.__port,
+                    ssl=self.__context,
+                    server_hostname=self.__servername,
+                ),
+                timeout=10,
+            )
+        except Exception as e:
+            raise Exception(f"TLS handshake failed: {e}")
+
+        if self.__reader_task is None or self.__reader_task.done():
+            self.__reader_task = asyncio.create_task(self.__read_responses())
+
+    def __drop_connection(self):
+        """
+        Close the current connection without waiting.
+        """
+        if self.__writer is not None:
+            self.__writer.close()
+        self.__reader = None
+        self.__writer = None
+
+    async def __read_response(self, response_length):
+        """
+        Receive exactly one response (see ResponseReader for the framing).
+
+        Returns:
+            memoryview: The response, without its terminator.
+        """
+        if response_length is None:
+            response = await self.__reader.readuntil(b"\n")
+        else:
+            response = await self.__reader.readexactly(len(b"ERROR"))
+            if response == b"ERROR":
+                response += await self.__reader.readuntil(b"\n")
+            else:
+                response += await self.__reader.readexactly(
+                    response_length - len(b"ERROR") + 1
+                )
+                if response[-1:] != b"\n":
+                    raise CommandUnexpectedResponse(
+                        "Binary response is not followed by the terminator."
+                    )
+        return memoryview(response)[:-1]
+
+    async def __read_responses(self):
+        """
+        Reader task: resolve the futures of the pending commands with their parsed responses.
+        """
+        while True:
+            if not self.__pending:
+                self.__has_pending.clear()
+                await self.__has_pending.wait()
+                continue
+
+            command, future, _ = self.__pending[0]
+            try:
+                response = await self.__read_response(command.response_length)
+            except (
+                asyncio.IncompleteReadError,
+                ConnectionResetError,
+                BrokenPipeError,
+                ssl.SSLEOFError,
+                TLSConnectionClosed,
+            ) as e:
+                if not await self.__recover(e):
+                    return
+                continue
+            except Exception as e:
+                # Out of sync with the server, or another failure (the commands may have been
+                # executed): the session can no longer be used, the next command opens a new one
+                async with self.__connection_lock:
+                    self.__drop_connection()
+                    self.__fail_pending(e)
+                return
+
+            self.__pending.popleft()
+            self.__responses += 1
+            self.__slots.release()
+            if future.done():  # Cancelled by the caller
+                continue
+            try:
+                future.set_result(command.parse(response))
+            except Exception as e:
+                future.set_exception(e)
+
+    async def __recover(self, error):
+        """
+        Reconnect after the server closed the connection, then send the unanswered commands again,
+        if no response was read since the first of them was sent (e.g. a session dropped after being
+        idle) or if they are all idempotent. Otherwise they may have been executed: they fail.
+
+        Returns:
+            bool: True if the session was recovered.
+        """
+        async with self.__connection_lock:
+            self.__drop_connection()
+            if not self.__ensure_connected_before_send:
+                self.__fail_pending(
+                    TLSConnectionClosed(
+                        "Server closed the connection (auto-reconnect disabled)."
+                    )
+                )
+                return False
+            answered = self.__pending and self.__pending[0][2] < self.__responses
+            if answered and not all(command.idempotent for command, _, _ in self.__pending):
+                self.__fail_pending(
+                    TLSConnectionClosed(
+                        "Server closed the connection: the unanswered commands may have been executed."
+                    )
+                )
+                return False
+            print("Info: reconnecting before sending data")
+            try:
+                await self.__open()
+                for command, _, _ in self.__pending:
+                    self.__writer.write(command.data)
+                await self.__writer.drain()
+            except Exception as e:
+                self.__drop_connection()
+                reconnect_error = TLSReconnectFailed(
+                    f"Reconnection to {self.__servername} failed: {e}"
+                )
+                reconnect_error.__cause__ = e
+                self.__fail_pending(reconnect_error)
+                return False
+        return True
+
+    def __fail_pending(self, error):
+        """
+        Fail every command waiting for its response.
+        """
+        while self.__pending:
+            _, future, _ = self.__pending.popleft()
+            self.__slots.release()
+            if not future.done():
+                future.set_exception(error)
+
+    async def execute(self, command):
+        """
+        Send a command and wait for its parsed response, pipelined with the other calls.
+
+        Args:
+            command (KeystoreCommand): The command to send.
+
+        Returns:
+            The parsed response of the command.
+        """
+        if command.data is None:
+            return command.parse(None)
+        await self.__slots.acquire()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            async with self.__connection_lock:
+                if self.__writer is None:
+                    await self.__open()
+                # Writing and queuing without awaiting in between keeps the order of the responses
+                writer = self.__writer
+                writer.write(command.data)
+                self.__pending.append((command, future, self.__responses))
+                self.__has_pending.set()
+        except BaseException:
+            self.__slots.release()
+            raise
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass  # The reader task reconnects and sends the command again
+        return await future
+
+    ########## METHODS TO USE THE SOCKET ################
+
+    async def echo(self, msg: str):
+        """Send an echo command."""
+        await self.execute(self.echo_command(msg))
+
+    async def read_record(self, record_number: int) -> bytes:
+        """Reads the string stored at the specified record number on the remote server."""
+        return await self.execute(self.read_record_command(record_number))
+
+    async def write_record(self, record_number: int, data: bytes | bytearray):
+        """Writes bytes to the specified record number on the remote server."""
+        await self.execute(self.write_record_command(record_number, data))
+
+    async def set_AES_key(self, index_key: int, key: bytes | bytearray):
+        """Define a new AES key on the Keystore."""
+        await self.execute(self.set_AES_key_command(index_key, key))
+
+    async def encrypt_AES(self, index_key: int, data: bytes | bytearray) -> bytes:
+        """Encrypt data using the AES key at the specified index."""
+        return await self.execute(self.encrypt_AES_command(index_key, data))
+
+    async def decrypt_AES(self, index_key: int, data: bytes | bytearray) -> bytes:
+        """Decrypt data using the AES key at the specified index."""
+        return await self.execute(self.decrypt_AES_command(index_key, data))
+
+    async def encrypt_AES_binary(self, index_key: int, data: bytes | bytearray) -> bytes:
+        """Encrypt binary data using the AES key at the specified index."""
+        return await self.execute(self.encrypt_AES_binary_command(index_key, data))
+
+    async def decrypt_AES_binary(self, index_key: int, data: bytes | bytearray) -> bytes:
+        """Decrypt binary data using the AES key at the specified index."""
+        return await self.execute(self.decrypt_AES_binary_command(index_key, data))
+
+    async def wrap_cek(self, index_key: int, key: bytes | bytearray) -> bytes:
+        """Wrap a content encryption key."""
+        return await self.execute(self.wrap_cek_command(index_key, key))
+
+    async def unwrap_cek(self, index_key: int, ck: bytes | bytearray) -> bytes:
+        """Recover a content encryption key from its wrapped form."""
+        return await self.execute(self.unwrap_cek_command(index_key, ck))
+
+    async def wrap_cek_many(self, index_key: int, keys: list[bytes | bytearray]) -> list[bytes]:
+        """Wrap several content encryption keys, CEKS_PER_COMMAND keys per command."""
+        n = KeystoreCommands.CEKS_PER_COMMAND
+        results = await asyncio.gather(
+            *(
+                self.execute(self.wrap_cek_many_command(index_key, keys[i : i + n]))
+                for i in range(0, len(keys), n)
+            )
+        )
+        return [ck for cks in results for ck in cks]
+
+    async def unwrap_cek_many(self, index_key: int, cks: list[bytes | bytearray]) -> list[bytes]:
+        """Recover several content encryption keys, CEKS_PER_COMMAND keys per command."""
+        n = KeystoreCommands.CEKS_PER_COMMAND
+        results = await asyncio.gather(
+            *(
+                self.execute(self.unwrap_cek_many_command(index_key, cks[i : i + n]))
+                for i in range(0, len(cks), n)
+            )
+        )
+        return [key for keys in results for key in keys]
+
+    async def close(self):
+        """
+        Send a termination command and close the TLS connection.
+        """
+        async with self.__connection_lock:
+            if self.__writer is not None:
+                self.__writer.write("?02\n".encode("utf-8"))
+                try:
+                    await self.__writer.drain()
+                except ConnectionError:
+                    pass
+            self.__drop_connection()
+            if self.__reader_task is not None:
+                self.__reader_task.cancel()
+                self.__reader_task = None
+            self.__fail_pending(TLSConnectionClosed("Connection closed by the client."))
+
+    def __str__(self):
+        return (
+            self.__hostname
+            + str(self.__port)
+            + str(self.__servername)
+            + str(self.__context)
+            + str(self.__writer)
+        )
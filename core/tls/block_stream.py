@@ -0,0 +1,130 @@
+import itertools
+
+BLOCK_SIZE = 16
+CHUNK_SIZE = 256  # 16 blocks: the most a binary AES command takes
+
+MODES = ("ECB", "CTR")
+
+
+def read_chunks(source, size: int = CHUNK_SIZE):
+    """
+    Cut a source into chunks of size bytes (the last one can be shorter), holding one chunk at a time.
+
+    Args:
+        source: File-like object (with read()), bytes-like object, or iterable of bytes-like objects.
+        size (int): Length of the chunks.
+
+    Yields:
+        bytes: The chunks.
+    """
+    if hasattr(source, "read"):
+        while chunk := source.read(size):
+            # read() can return less than asked (pipes, sockets): complete the chunk
+            while len(chunk) < size and (more := source.read(size - len(chunk))):
+                chunk += more
+            yield bytes(chunk)
+        return
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = [source]
+
+    pending = bytearray()
+    for data in source:
+        pending += data
+        offset = 0
+        while len(pending) - offset >= size:
+            yield bytes(pending[offset : offset + size])
+            offset += size
+        del pending[:offset]
+    if pending:
+        yield bytes(pending)
+
+
+def pkcs7_pad(data: bytes) -> bytes:
+    """Pad the last chunk of a stream to whole blocks (a full block is added to whole data)."""
+    padding = BLOCK_SIZE - len(data) % BLOCK_SIZE
+    return data + bytes([padding]) * padding
+
+
+def pkcs7_unpad(data: bytes) -> bytes:
+    """
+    Raises:
+        ValueError: Invalid padding.
+    """
+    padding = data[-1] if data else 0
+    if not 0 < padding <= BLOCK_SIZE or data[-padding:] != bytes([padding]) * padding:
+        raise ValueError("Invalid padding.")
+    return data[:-padding]
+
+
+def _xor(data, keystream) -> bytes:
+    return (int.from_bytes(data, "big") ^ int.from_bytes(keystream[: len(data)], "big")).to_bytes(len(data), "big")
+
+
+def _counter_blocks(iv: bytes, first: int, count: int) -> bytes:
+    """Blocks iv + first, ..., iv + first + count - 1 (128 bits big endian counter)."""
+    start = int.from_bytes(iv, "big") + first
+    return b"".join(
+        ((start + i) % (1 << 128)).to_bytes(BLOCK_SIZE, "big") for i in range(count)
+    )
+
+
+def block_operations(source, mode: str = "ECB", decrypt: bool = False, iv: bytes | None = None):
+    """
+    Turn a stream into the binary AES operations to ask the keystore, one per chunk.
+
+    ECB: the data is encrypted (or decrypted) block by block, with PKCS#7 padding.
+    CTR: the keystore encrypts the counter blocks iv, iv + 1, ... and the data is XORed with them
+    (no padding, encryption and decryption are the same operation).
+
+    Args:
+        source: See read_chunks. For ECB decryption, whole blocks are expected.
+        mode (str): "ECB" or "CTR".
+        decrypt (bool): Decrypt instead of encrypt.
+        iv (bytes): Initial counter block (16 bytes), required in CTR mode. Never use it twice with the same key.
+
+    Yields:
+        tuple: (operation, data, finish): operation is "encrypt_AES_binary" or "decrypt_AES_binary",
+        data the 1 to 16 blocks to send, finish turns the response into the output chunk.
+
+    Raises:
+        ValueError: Unknown mode, missing iv, data not made of whole blocks (ECB decryption), invalid padding.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode: {mode}")
+
+    if mode == "CTR":
+        if iv is None or len(iv) != BLOCK_SIZE:
+            raise ValueError("CTR mode needs a 16 bytes iv.")
+        first = 0
+        for chunk in read_chunks(source):
+            count = -(-len(chunk) // BLOCK_SIZE)
+            yield (
+                "encrypt_AES_binary",
+                _counter_blocks(iv, first, count),
+                lambda keystream, chunk=chunk: _xor(chunk, keystream),
+            )
+            first += count
+        return
+
+    if not decrypt:
+        chunks = read_chunks(source)
+        last = b""
+        for chunk in chunks:
+            if len(chunk) < CHUNK_SIZE:
+                last = chunk
+                break
+            yield "encrypt_AES_binary", chunk, bytes
+        # The padding completes the last chunk, or is a block of its own after whole chunks
+        yield "encrypt_AES_binary", pkcs7_pad(last), bytes
+        return
+
+    chunks = read_chunks(source)
+    chunk = next(chunks, None)
+    if chunk is None:
+        raise ValueError("Nothing to decrypt.")
+    for next_chunk in itertools.chain(chunks, [None]):
+        if len(chunk) % BLOCK_SIZE:
+            raise ValueError("Data is not made of whole blocks.")
+        # The last chunk is unpadded once decrypted
+        yield "decrypt_AES_binary", chunk, bytes if next_chunk is not None else pkcs7_unpad
+        chunk = next_chunk
@@ -1,74 +1,395 @@
 from core.tls.socket_wrapper import TLSSocketWrapper
+from core.tls.keystream_pool import KeystreamPool
+from core.tls.block_stream import block_operations
+from core.tls.request_scheduler import RequestScheduler, PRIORITIES
+from core.request.local import LocalRequest
+from core.tools.metrics import REGISTRY
+import collections
 import threading
 import queue
 import time
 
 
+class WorkerSession:
+    """
+    A TLS session of a ConnectionWorker, with its thread taking requests from the scheduler of the worker.
+
+    Attributes:
+        socketWrapper (TLSSocketWrapper): The TLS session.
+        thread (threading.Thread): Thread sending the requests taken by the session.
+        last_keepalive (float): Time (monotonic) of the last keep-alive attempt.
+    """
+
+    def __init__(self, socketWrapper):
+        self.socketWrapper = socketWrapper
+        self.thread = None
+        self.last_keepalive = 0
+
+
 class ConnectionWorker:
     """
     A class that represents a connection to an HSM, with a queue of reqests to send in a thread.
+    The connection can be a pool of TLS sessions to the same keystore, each with its thread.
 
-    Class attribute:
+    Class attributes:
         allWorkers (list): List of instances.
+        default_hedge_delay (float): Hedge delay (s) of a replica without latency samples yet.
+        keystream_retry_delay (float): Seconds before refilling the keystream pool again after a failure.
 
-    Attribute:
+    Attributes:
         servername (str): Hostname of the keystore.
+        keystream_pool (KeystreamPool): Precomputed wrap_cek material shared by the sessions, None if disabled.
+        scheduler (RequestScheduler): Requests waiting to be sent, shared by the sessions.
+
+    Notes:
+        A free session takes the waiting requests, pipeline_depth at a time, and pipelines them.
+        The cancelled or expired requests are dropped instead of sent.
+
+    Scheduling:
+        Requests are "interactive" (default) or "bulk" (see LocalRequest): the interactive ones are sent
+        first, earliest deadline first, and bulk requests get one turn in starvation_limit.
+        queue_limits bounds the waiting requests of each class ({"interactive": 1024, "bulk": 8192} by
+        default): past it, a new request fails with queue.Full instead of waiting.
+        Idle sessions sleep until a request arrives or their next keep-alive is due.
+
+    Keep-alive:
+        The server drops a session 30s after a command, which is only noticed (and paid with
+        a handshake) by the next request. After keepalive_interval seconds without activity, an idle session:
+        - "reconnect" (default): reconnects ahead of the next request, if a command was sent since its connection,
+        - "echo": sends an echo probe, reconnecting if the session was dropped. The keystores answer echo
+          even on an idle session, but do not document that it restarts their 30s: only use it with
+          a keystore known to do so,
+        - "off": waits for the next request.
+
+    Keystream pool:
+        With keystream_slots, idle sessions precompute the wrap_cek material of these key slots
+        (one pipeline at a time, between two requests), so that wrap_cek is a local XOR
+        while the pool holds material (see KeystreamPool). The material is only used for keystream_check_interval
+        seconds after a check of the key of its slot, which notices a key changed by another client.
+
+    Metrics (core.tools.metrics.REGISTRY, labels keystore and command): completed requests by outcome,
+    their latency from dispatch to response, their wait in the queue, errors by exception class,
+    rejected requests, and the queue depth of the worker by priority class. See also the metrics of TLSSocketWrapper.
     """
     allWorkers = []
+    default_hedge_delay = 0.1
+    keystream_retry_delay = 5
 
-    def __init__(self, hostname, port, servername, psk = None, ensure_connected_before_send = True):
+    KEEPALIVE_MODES = ("echo", "reconnect", "off")
+
+    def __init__(self, hostname, port, servername, psk = None, ensure_connected_before_send = True, pipeline_depth = 16, pool_size = 1, keepalive = "reconnect", keepalive_interval = 25, session_resumption = True, keystream_slots = None, keystream_low_watermark = 64, keystream_high_watermark = 256, keystream_check_interval = 5, queue_limits = None, starvation_limit = 32):
         self.servername = servername #ID
+        self.pipeline_depth = pipeline_depth
+
+        if keepalive not in ConnectionWorker.KEEPALIVE_MODES:
+            raise ValueError(f"Unknown keep-alive mode: {keepalive}")
+        self.keepalive = keepalive
+        self.keepalive_interval = keepalive_interval
+
+        if pool_size < 1:
+            raise ValueError("The pool needs at least one session.")
+        self.__sessions = [
+            WorkerSession(TLSSocketWrapper(hostname, port, servername, psk, ensure_connected_before_send, session_resumption))
+            for _ in range(pool_size)
+        ]
+        self.keystream_pool = None
+        if keystream_slots:
+            self.keystream_pool = KeystreamPool(
+                keystream_slots, keystream_low_watermark, keystream_high_watermark, keystream_check_interval
+            )
+            for session in self.__sessions:
+                session.socketWrapper.keystream_pool = self.keystream_pool
+        self.__keystream_retry_at = 0
 
-        self.__socketWrapper = TLSSocketWrapper(hostname, port, servername, psk, ensure_connected_before_send)
-        self.__request_queue = queue.Queue()
-        self.__worker_thread = None
         self.__running = False
         self.__lock = threading.Lock()
+        self.__latencies = collections.deque(maxlen=256)  # Latencies (s) of the last completed requests
+        self.__labels = {"keystore": servername}
+        self.scheduler = RequestScheduler(queue_limits, starvation_limit, on_drop=self.__drop)
+        for priority in PRIORITIES:
+            REGISTRY.gauge("keystore_queue_depth", dict(self.__labels, priority=priority),
+                           lambda priority=priority: self.scheduler.depth(priority))
 
         ConnectionWorker.allWorkers.append(self)
 
 
     def start_worker(self):
         """
-        Start a worker.
+        Start a worker: connect every session of the pool.
         """
         if not self.__running:
-            try:
-                self.__socketWrapper.connect()
-                print("Connected to", self.servername)
-            except Exception as e:
-                print(self.__socketWrapper)
-                raise e
+            for session in self.__sessions:
+                try:
+                    session.socketWrapper.connect()
+                except Exception as e:
+                    print(session.socketWrapper)
+                    raise e
+            print("Connected to", self.servername, f"({len(self.__sessions)} sessions)")
 
             self.__running = True
-            self.__worker_thread = threading.Thread(target=self.__process_queue, daemon=True)
-            self.__worker_thread.start()
+            self.scheduler.reopen()
+            for session in self.__sessions:
+                session.thread = threading.Thread(target=self.__process_queue, args=(session,), daemon=True)
+                session.thread.start()
 
-    def __process_queue(self):
-        """Continuously send queued requests."""
+    def __process_queue(self, session):
+        """Continuously send the requests taken from the scheduler, pipelining those already waiting."""
         while self.__running:
-            try:
-                cmd = self.__request_queue.get(timeout=1)
-            except queue.Empty:
+            refill = self.__keystream_refill_needed()
+            entries = self.scheduler.take(self.pipeline_depth, 0 if refill else self.__idle_wait(session))
+            if not entries:
+                if not self.__running:
+                    break
+                if refill:
+                    self.__refill_keystreams(session)
+                else:
+                    self.__keep_alive(session)
                 continue
 
-            cmd.process_request(self.__socketWrapper)
+            requests = []
+            while entries:
+                dequeued_at = time.monotonic()
+                for request, enqueued_at in entries:
+                    labels = dict(self.__labels, priority=request.get_priority())
+                    REGISTRY.observe("keystore_queue_wait_seconds", labels, dequeued_at - enqueued_at)
+                    if request.start_request():
+                        requests.append((request, enqueued_at))
+                    else:
+                        self.__count_dropped(request)
+                # Dropped requests leave room in the pipeline for the next ones
+                missing = self.pipeline_depth - len(requests)
+                entries = self.scheduler.take(missing, 0) if missing > 0 else []
+            if not requests:
+                continue
+
+            self.__process_requests(session, requests)
 #            except Exception as e:
 #                print(e)
 #                print("debug", e)
 #                time.sleep(1)  # avoid spamming in case of repeated errors
 
+    def __idle_wait(self, session):
+        """
+        Seconds an idle session can sleep before its next keep-alive or keystream refill is due,
+        None to wait for the next request.
+        """
+        now = time.monotonic()
+        waits = []
+        if self.keepalive != "off":
+            waits.append(max(
+                self.keepalive_interval - session.socketWrapper.idle_time,
+                session.last_keepalive + self.keepalive_interval - now,
+            ))
+        if self.keystream_pool is not None and self.keystream_pool.needs_refill():
+            waits.append(self.__keystream_retry_at - now)
+        return max(0, min(waits)) if waits else None
+
+    def __count_dropped(self, request):
+        REGISTRY.inc("keystore_requests_dropped_total", dict(self.__labels, command=request.get_method_name()))
+
+    def __drop(self, request, enqueued_at):
+        """Fail a cancelled or expired request purged from the scheduler (start_request does it)."""
+        request.start_request()
+        self.__count_dropped(request)
+
+    def __keystream_refill_needed(self):
+        return (
+            self.keystream_pool is not None
+            and time.monotonic() >= self.__keystream_retry_at
+            and self.keystream_pool.needs_refill()
+        )
+
+    def __refill_keystreams(self, session):
+        """
+        Precompute wrap_cek material with one pipeline on an idle session.
+
+        Args:
+            session (WorkerSession): The idle session.
+        """
+        try:
+            self.keystream_pool.refill(session.socketWrapper, self.pipeline_depth)
+        except Exception as e:
+            print("Warning: keystream precomputation of", self.servername, "failed:", e)
+            self.__keystream_retry_at = time.monotonic() + self.keystream_retry_delay
+
+    def __keep_alive(self, session):
+        """
+        Keep an idle session usable, according to the keep-alive mode of the worker.
+
+        Args:
+            session (WorkerSession): The idle session.
+        """
+        if self.keepalive == "off":
+            return
+        socketWrapper = session.socketWrapper
+        now = time.monotonic()
+        if socketWrapper.idle_time < self.keepalive_interval or now - session.last_keepalive < self.keepalive_interval:
+            return
+
+        session.last_keepalive = now
+        try:
+            if self.keepalive == "echo":
+                socketWrapper.echo("keepalive")
+            elif socketWrapper.commands_since_connect > 0:
+                socketWrapper.reconnect()
+        except Exception as e:
+            print("Warning: keep-alive of", self.servername, "failed:", e)
+
+    def __process_requests(self, session, requests):
+        """
+        Send the commands of the requests in one pipeline, then complete each request.
+
+        Args:
+            session (WorkerSession): The session to send the requests on.
+            requests (list[tuple]): Started requests taken from the scheduler, with their enqueue time.
+        """
+        pending = []
+        commands = []
+        for request, enqueued_at in requests:
+            try:
+                commands.append(request.prepare_command(session.socketWrapper))
+                pending.append((request, enqueued_at))
+            except Exception as e:
+                self.__complete(request, enqueued_at, error=e)
+
+        if not commands:
+            return
+
+        try:
+            results = session.socketWrapper.execute_many(commands, return_exceptions=True)
+        except Exception as e:
+            results = [e] * len(pending)
+
+        for (request, enqueued_at), result in zip(pending, results):
+            if isinstance(result, Exception):
+                self.__complete(request, enqueued_at, error=result)
+            else:
+                self.__complete(request, enqueued_at, response=result)
+
+    def __complete(self, request, enqueued_at, response=None, error=None):
+        """
+        Complete a request without letting its errors (e.g. a closed origin socket) stop the worker.
+        Records the latency of the successful requests.
+        """
+        latency = time.monotonic() - enqueued_at
+        labels = dict(self.__labels, command=request.get_method_name())
+        REGISTRY.observe("keystore_request_duration_seconds", labels, latency)
+        if error is None:
+            self.__latencies.append(latency)
+            REGISTRY.inc("keystore_requests_total", dict(labels, outcome="ok"))
+        else:
+            REGISTRY.inc("keystore_requests_total", dict(labels, outcome="error"))
+            REGISTRY.inc("keystore_errors_total", dict(labels, error=type(error).__name__))
+        try:
+            request.complete_request(response, error)
+        except Exception as e:
+            print("Error: could not complete the request for", request.get_keystore(), e)
+
+    def latency_percentile(self, percentile = 0.95):
+        """
+        Latency of the recent requests of the worker, from their dispatch to their response.
+
+        Args:
+            percentile (float): Between 0 and 1.
+
+        Returns:
+            float: The latency percentile in seconds, or None without any completed request yet.
+        """
+        latencies = sorted(self.__latencies)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(percentile * len(latencies)))]
+
     def __put_request(self, request):
         """
-        Add a request to the queue of the worker.
+        Add a request to the scheduler of the worker.
+        A request rejected by the admission control fails with queue.Full.
 
         Args:
             request (Command): Command to add.
         """
-        self.__request_queue.put(request)
+        try:
+            self.scheduler.put(request)
+        except queue.Full as e:
+            REGISTRY.inc("keystore_requests_rejected_total",
+                         dict(self.__labels, command=request.get_method_name(), priority=request.get_priority()))
+            if request.start_request():
+                try:
+                    request.complete_request(error=e)
+                except Exception as error:
+                    print("Error: could not complete the request for", request.get_keystore(), error)
+
+    def submit(self, method, timeout = None, priority = "interactive"):
+        """
+        Send a request to the keystore of the worker.
+
+        Args:
+            method (tuple): Name of the TLSSocketWrapper method then its arguments, e.g. ("unwrap_cek", 1, ck).
+            timeout (float): Seconds after which the request is dropped if it was not sent yet.
+            priority (str): "interactive" or "bulk".
+
+        Returns:
+            LocalRequest: the future of the response.
+        """
+        request = LocalRequest(self.servername, method, timeout=timeout, priority=priority)
+        self.__put_request(request)
+        return request
+
+    def encrypt_stream(self, index_key, source, mode = "ECB", iv = None, window = None):
+        """
+        Encrypt a stream of any length (see TLSSocketWrapper.encrypt_stream), 16 blocks per request.
+        The requests are spread over the sessions of the worker, window requests at a time, as bulk requests.
+
+        Args:
+            window (int): Requests in flight, by default pipeline_depth per session.
+
+        Yields:
+            bytes: The encrypted stream, in chunks.
+        """
+        return self.__stream(block_operations(source, mode, False, iv), index_key, window)
+
+    def decrypt_stream(self, index_key, source, mode = "ECB", iv = None, window = None):
+        """
+        Decrypt a stream encrypted by encrypt_stream (same arguments).
+
+        Yields:
+            bytes: The decrypted stream, in chunks.
+        """
+        return self.__stream(block_operations(source, mode, True, iv), index_key, window)
+
+    def __stream(self, operations, index_key, window):
+        window = window or self.pipeline_depth * len(self.__sessions)
+        in_flight = collections.deque()  # (request, finish), in the order of the stream
+        try:
+            for operation, data, finish in operations:
+                if len(in_flight) >= window:
+                    request, finish_request = in_flight.popleft()
+                    yield finish_request(request.get_response())
+                in_flight.append((self.submit((operation, index_key, data), priority="bulk"), finish))
+            while in_flight:
+                request, finish_request = in_flight.popleft()
+                yield finish_request(request.get_response())
+        finally:
+            # Stream closed early or failed: do not send what is left
+            for request, _ in in_flight:
+                request.cancel()
+
+    def get_queue_depth(self):
+        """
+        Returns:
+            int: The number of requests waiting in the scheduler, every priority class.
+        """
+        return self.scheduler.depth()
 
     def get_socketWrapper(self):
-        return self.__socketWrapper
+        return self.__sessions[0].socketWrapper
+
+    def get_pool_size(self):
+        """
+        Returns:
+            int: The number of TLS sessions of the worker.
+        """
+        return len(self.__sessions)
 
     def is_running(self):
         """
@@ -96,6 +417,96 @@ class ConnectionWorker:
                 return
         raise LookupError("Keystore not found.")
 
+    @classmethod
+    def get_worker(cls, servername):
+        """
+        Find the worker of a keystore.
+
+        Raises:
+            LookupError
+        """
+        for worker in cls.allWorkers:
+            if worker.servername == servername:
+                return worker
+        raise LookupError("Keystore not found.")
+
+    @classmethod
+    def dispatch_hedged(cls, keystores, method, hedge_delay = None, percentile = 0.95, timeout = 3, priority = "interactive"):
+        """
+        Send a request to a group of replicated keystores (holding the same key slot) and return the first success.
+
+        The request goes to the replica with the lowest latency percentile. If it has not answered
+        after the hedge delay (by default its latency percentile), the request is also sent to the
+        next replica, and so on. A failed replica is replaced right away by the next one.
+        The requests still queued when a response arrives are cancelled, the others are ignored.
+
+        Args:
+            keystores (list[str]): Hostnames of the replicas.
+            method (tuple): Name of the TLSSocketWrapper method then its arguments, e.g. ("unwrap_cek", 1, ck).
+            hedge_delay (float): Seconds before hedging to the next replica, overrides the percentile.
+            percentile (float): Latency percentile of a replica used as its hedge delay.
+            timeout (float): Seconds to wait for a response.
+            priority (str): Priority class of the requests, "interactive" or "bulk".
+
+        Returns:
+            The first successful response.
+
+        Raises:
+            LookupError: A keystore was not found.
+            TimeoutError: No response before the timeout.
+            Exceptions of socketWrapper: every replica failed (error of the last one).
+        """
+        def expected_latency(worker):
+            # Fastest replicas first, those without samples keep their order at the end
+            latency = worker.latency_percentile(percentile)
+            return (latency is None, latency or 0)
+
+        replicas = sorted((cls.get_worker(keystore) for keystore in keystores), key=expected_latency)
+
+        responses = queue.Queue()
+        requests = []
+        deadline = time.monotonic() + timeout
+        failures = 0
+
+        def hedge():
+            worker = replicas[len(requests)]
+            request = LocalRequest(worker.servername, method, responses, priority=priority)
+            requests.append(request)
+            worker.__put_request(request)
+            if hedge_delay is not None:
+                return hedge_delay
+            return worker.latency_percentile(percentile) or cls.default_hedge_delay
+
+        next_hedge_delay = hedge()
+        next_hedge_at = time.monotonic() + next_hedge_delay
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    raise TimeoutError(f"No response from {', '.join(keystores)}.")
+                wait = deadline - now
+                if len(requests) < len(replicas):
+                    wait = max(0, min(wait, next_hedge_at - now))
+
+                try:
+                    request = responses.get(timeout=wait)
+                except queue.Empty:
+                    if len(requests) < len(replicas) and time.monotonic() >= next_hedge_at:
+                        next_hedge_at = time.monotonic() + hedge()
+                    continue
+
+                try:
+                    return request.get_response(timeout=0)
+                except Exception:
+                    failures += 1
+                    if len(requests) < len(replicas):
+                        next_hedge_at = time.monotonic() + hedge()
+                    elif failures == len(replicas):
+                        raise
+        finally:
+            for request in requests:
+                request.cancel()
+
     @classmethod
     def start_all(cls):
         """
@@ -112,12 +523,17 @@ class ConnectionWorker:
         """
         for worker in cls.allWorkers:
             if worker.is_running():
-                worker.__socketWrapper.close()
+                for session in worker.__sessions:
+                    session.socketWrapper.close()
                 worker.__running = False
+                for request, enqueued_at in worker.scheduler.close():
+                    if request.start_request():
+                        worker.__complete(request, enqueued_at, error=RuntimeError(f"The worker of {worker.servername} was stopped."))
+                if worker.keystream_pool is not None:
+                    worker.keystream_pool.clear()
 
         #TODO Test
         #TODO Following :
         #@classmethod
         #persistent
         #ondemand
-
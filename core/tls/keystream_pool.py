@@ -0,0 +1,207 @@
+import collections
+import os
+import threading
+import time
+
+from core.tls.socket_wrapper import KeystoreCommands
+
+
+class KeystreamPool:
+    """
+    Precomputed wrap_cek material of a keystore: triples (r, E(r+1), E(r+2)) per key slot.
+
+    The material does not depend on the wrapped key, so it can be asked to the keystore ahead of time
+    (e.g. by idle sessions) and wrap_cek becomes a local XOR.
+    Each triple is handed out once and removed from the pool; its keystream is zeroed once used.
+
+    Refill:
+        A slot is refilled when it falls below low_watermark entries, up to high_watermark entries.
+
+    Note:
+        The material is only valid for the key it was computed with: the pool of a slot must be
+        cleared when its key changes (set_AES_key_command does it for the sessions using the pool).
+        The pool assumes its sessions are the only writers of the keys. A key changed by another
+        client is detected by a check block: each refill also encrypts a fixed block of the slot, and
+        a different result clears the slot. The entries are not handed out once the last check is
+        older than check_interval seconds (until the next refill checks again), so material of a
+        replaced key is used at most check_interval seconds after the change.
+    """
+
+    def __init__(self, slots: list[int], low_watermark: int = 64, high_watermark: int = 256, check_interval: float = 5):
+        """
+        Args:
+            slots (list[int]): Key indexes (0–3) to precompute material for.
+            low_watermark (int): Number of entries of a slot under which it is refilled.
+            high_watermark (int): Number of entries of a slot after a refill.
+            check_interval (float): Seconds during which the entries of a slot are used after a check of its key.
+        """
+        if not 0 <= low_watermark < high_watermark:
+            raise ValueError("The low watermark must be below the high watermark.")
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self.check_interval = check_interval
+        self.__entries = {slot: collections.deque() for slot in slots}  # slot: deque of (r, bytearray keystream)
+        self.__requested = {slot: 0 for slot in slots}  # Entries being computed
+        self.__refilling = set()  # Slots below their low watermark, not yet back to the high watermark
+        self.__generations = {slot: 0 for slot in slots}  # Incremented when a slot is cleared
+        self.__check_blocks = {slot: os.urandom(16) for slot in slots}
+        self.__checks = {slot: None for slot in slots}  # slot: (E(check block), time of the check)
+        self.__check_wanted = set()  # Slots whose entries were asked for after their check expired
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def __zero(keystream: bytearray):
+        keystream[:] = bytes(len(keystream))
+
+    def take(self, index_key: int, count: int = 1):
+        """
+        Remove entries of a slot from the pool.
+
+        Args:
+            index_key (int): Key index.
+            count (int): Number of entries.
+
+        Returns:
+            list[tuple[bytes, bytearray]]: count pairs (r, E(r+1) || E(r+2)), or None if the pool
+            does not hold enough entries or the key of the slot was not checked recently (none are taken).
+        """
+        with self.__lock:
+            entries = self.__entries.get(index_key)
+            if entries is None or len(entries) < count:
+                return None
+            check = self.__checks[index_key]
+            if check is None or time.monotonic() - check[1] > self.check_interval:
+                self.__check_wanted.add(index_key)
+                return None
+            return [entries.popleft() for _ in range(count)]
+
+    def wrap(self, entries, keys: list[bytes | bytearray]) -> list[bytes]:
+        """
+        Wrap keys with entries taken from the pool (see KeystoreCommands.wrap_cek_command),
+        then zero the keystreams of the entries.
+
+        Args:
+            entries (list[tuple]): As many entries as keys, returned by take().
+            keys (list of bytes-like objects): The keys to wrap (32 bytes each).
+
+        Returns:
+            list[bytes]: The wrapped keys.
+        """
+        try:
+            return [
+                r + KeystoreCommands._xor_bytes(keystream, key)
+                for (r, keystream), key in zip(entries, keys)
+            ]
+        finally:
+            for _, keystream in entries:
+                KeystreamPool.__zero(keystream)
+
+    def __needs_refill(self, slot) -> bool:
+        """Update the refill state of a slot (the lock must be held)."""
+        available = len(self.__entries[slot]) + self.__requested[slot]
+        if slot in self.__refilling:
+            if available >= self.high_watermark:
+                self.__refilling.discard(slot)
+        elif len(self.__entries[slot]) < self.low_watermark:
+            self.__refilling.add(slot)
+        return slot in self.__refilling and available < self.high_watermark
+
+    def needs_refill(self) -> bool:
+        """
+        Returns:
+            bool: True if a slot is waiting for material or for a check of its key.
+        """
+        with self.__lock:
+            return bool(self.__check_wanted) or any(self.__needs_refill(slot) for slot in self.__entries)
+
+    def refill(self, socketWrapper, max_commands: int = 16) -> int:
+        """
+        Compute material for the slot that needs it the most, with one pipeline of commands
+        (CEKS_PER_COMMAND entries per command), followed by the check of its key.
+        A slot only waiting for a check is checked without computing material.
+
+        Args:
+            socketWrapper (TLSSocketWrapper): The session sending the commands.
+            max_commands (int): Maximum number of commands of the pipeline.
+
+        Returns:
+            int: Number of entries added to the pool.
+
+        Raises:
+            Exceptions of socketWrapper (no entry is added).
+        """
+        n = KeystoreCommands.CEKS_PER_COMMAND
+        with self.__lock:
+            slots = [slot for slot in self.__entries if self.__needs_refill(slot)]
+            if slots:
+                slot = min(slots, key=lambda slot: len(self.__entries[slot]) + self.__requested[slot])
+                missing = self.high_watermark - len(self.__entries[slot]) - self.__requested[slot]
+                count = min(missing, max(max_commands - 1, 1) * n)
+            elif self.__check_wanted:
+                slot, count = min(self.__check_wanted), 0
+            else:
+                return 0
+            self.__check_wanted.discard(slot)
+            self.__requested[slot] += count
+            generation = self.__generations[slot]
+
+        try:
+            rs = [os.urandom(16) for _ in range(count)]
+            commands = [
+                socketWrapper.encrypt_AES_binary_command(
+                    slot, b"".join(KeystoreCommands._counter_blocks(r) for r in rs[i : i + n])
+                )
+                for i in range(0, count, n)
+            ]
+            # Last: a key changed during the pipeline changes the check
+            commands.append(socketWrapper.encrypt_AES_binary_command(slot, self.__check_blocks[slot]))
+            results = socketWrapper.execute_many(commands)
+            check = bytes(results.pop())
+            entries = [
+                (r, bytearray(results[i // n][32 * (i % n) : 32 * (i % n + 1)]))
+                for i, r in enumerate(rs)
+            ]
+            with self.__lock:
+                if self.__generations[slot] != generation:
+                    # Cleared meanwhile: the material may have been computed with the previous key
+                    for _, keystream in entries:
+                        KeystreamPool.__zero(keystream)
+                    return 0
+                if self.__checks[slot] is not None and self.__checks[slot][0] != check:
+                    print(f"Warning: key n°{slot:02x} changed by another client, keystream material dropped.")
+                    self.__clear(slot)
+                    for _, keystream in entries:
+                        KeystreamPool.__zero(keystream)
+                    self.__checks[slot] = (check, time.monotonic())
+                    return 0
+                self.__checks[slot] = (check, time.monotonic())
+                self.__entries[slot].extend(entries)
+            return count
+        finally:
+            with self.__lock:
+                self.__requested[slot] -= count
+
+    def clear(self, index_key: int | None = None):
+        """
+        Remove the entries of a slot (or of every slot), zeroing them.
+
+        Args:
+            index_key (int): Key index, None for every slot.
+        """
+        with self.__lock:
+            slots = self.__entries if index_key is None else [index_key]
+            for slot in slots:
+                if slot in self.__entries:
+                    self.__clear(slot)
+                    self.__checks[slot] = None
+
+    def __clear(self, slot):
+        """Zero and remove the entries of a slot (the lock must be held)."""
+        self.__generations[slot] += 1
+        entries = self.__entries[slot]
+        while entries:
+            _, keystream = entries.popleft()
+            KeystreamPool.__zero(keystream)
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.__entries.values())
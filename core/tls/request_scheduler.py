@@ -0,0 +1,161 @@
+import heapq
+import itertools
+import queue
+import threading
+import time
+
+# Priority classes, most urgent first
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PRIORITIES = (INTERACTIVE, BULK)
+
+
+class RequestScheduler:
+    """
+    Requests waiting to be sent to a keystore, by priority class, shared by the sessions of a ConnectionWorker.
+
+    Scheduling:
+        The requests of the most urgent class are taken first, earliest deadline first (the requests
+        without deadline after, in their arrival order). A less urgent class passed over starvation_limit
+        times in a row gets the next turn, so a flow of interactive requests only slows bulk ones down.
+
+    Admission control:
+        Each class holds at most limits[class] requests: past that, the cancelled and expired requests
+        of the class are purged, then the new request is rejected with queue.Full.
+
+    The sessions wait on a condition, woken by a new request or by close(), instead of polling.
+    """
+
+    DEFAULT_LIMITS = {INTERACTIVE: 1024, BULK: 8192}
+
+    def __init__(self, limits: dict | None = None, starvation_limit: int = 32, on_drop = None):
+        """
+        Args:
+            limits (dict): Maximum number of waiting requests per priority class (DEFAULT_LIMITS for the others).
+            starvation_limit (int): Requests of more urgent classes taken before a waiting class gets a turn.
+            on_drop (callable): Called with (request, enqueued_at) for each request purged from a full class,
+                outside the lock (e.g. to fail it).
+        """
+        limits = dict(RequestScheduler.DEFAULT_LIMITS, **(limits or {}))
+        unknown = set(limits) - set(PRIORITIES)
+        if unknown:
+            raise ValueError(f"Unknown priority classes: {', '.join(sorted(unknown))}")
+        if any(limit < 1 for limit in limits.values()):
+            raise ValueError("Each priority class must hold at least one request.")
+        if starvation_limit < 1:
+            raise ValueError("The starvation limit must be at least 1.")
+        self.limits = limits
+        self.starvation_limit = starvation_limit
+        self.__on_drop = on_drop
+        self.__heaps = {priority: [] for priority in PRIORITIES}  # priority: heap of (deadline, seq, request, enqueued_at)
+        self.__passed_over = {priority: 0 for priority in PRIORITIES}
+        self.__sequence = itertools.count()
+        self.__closed = False
+        self.__condition = threading.Condition()
+
+    @staticmethod
+    def __is_dead(request, now):
+        deadline = request.get_deadline()
+        return request.is_cancelled() or (deadline is not None and now > deadline)
+
+    def put(self, request):
+        """
+        Add a request to the queue of its priority class and wake a waiting session.
+
+        Raises:
+            ValueError: Unknown priority class.
+            queue.Full: The class is full.
+        """
+        priority = request.get_priority()
+        if priority not in self.__heaps:
+            raise ValueError(f"Unknown priority class: {priority}")
+        deadline = request.get_deadline()
+        purged = []
+        with self.__condition:
+            heap = self.__heaps[priority]
+            if len(heap) >= self.limits[priority]:
+                now = time.monotonic()
+                purged = [entry for entry in heap if RequestScheduler.__is_dead(entry[2], now)]
+                if purged:
+                    heap[:] = [entry for entry in heap if not RequestScheduler.__is_dead(entry[2], now)]
+                    heapq.heapify(heap)
+            full = len(heap) >= self.limits[priority]
+            if not full:
+                entry = (float("inf") if deadline is None else deadline, next(self.__sequence), request, time.monotonic())
+                heapq.heappush(heap, entry)
+                self.__condition.notify()
+
+        if self.__on_drop is not None:
+            for _, _, dropped, enqueued_at in purged:
+                self.__on_drop(dropped, enqueued_at)
+        if full:
+            raise queue.Full(f"Too many {priority} requests waiting for {request.get_keystore()}.")
+
+    def __pop(self):
+        """Take the next request (lock held), None if there is none."""
+        waiting = [priority for priority in PRIORITIES if self.__heaps[priority]]
+        if not waiting:
+            return None
+        chosen = waiting[0]
+        for priority in waiting[1:]:
+            if self.__passed_over[priority] >= self.starvation_limit:
+                chosen = priority
+                break
+        for priority in waiting:
+            if PRIORITIES.index(priority) > PRIORITIES.index(chosen):
+                self.__passed_over[priority] += 1
+        self.__passed_over[chosen] = 0
+        _, _, request, enqueued_at = heapq.heappop(self.__heaps[chosen])
+        return request, enqueued_at
+
+    def take(self, count: int, timeout: float | None = None) -> list:
+        """
+        Take up to count requests, in scheduling order, waiting for one if there is none.
+
+        Args:
+            count (int): Maximum number of requests.
+            timeout (float): Seconds to wait for a request, None to wait until one arrives or close().
+
+        Returns:
+            list[tuple]: (request, enqueued_at) pairs, empty after the timeout or once closed.
+        """
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__closed or self.depth() > 0, timeout)
+            if self.__closed:
+                return []
+            entries = []
+            while len(entries) < count:
+                entry = self.__pop()
+                if entry is None:
+                    break
+                entries.append(entry)
+            return entries
+
+    def depth(self, priority: str | None = None) -> int:
+        """
+        Returns:
+            int: Requests waiting in a priority class, in every class if None.
+        """
+        if priority is not None:
+            return len(self.__heaps[priority])
+        return sum(len(heap) for heap in self.__heaps.values())
+
+    def close(self) -> list:
+        """
+        Wake the waiting sessions, take() returning nothing from now on.
+
+        Returns:
+            list[tuple]: The (request, enqueued_at) pairs that were waiting.
+        """
+        with self.__condition:
+            self.__closed = True
+            entries = [(request, enqueued_at) for heap in self.__heaps.values() for _, _, request, enqueued_at in heap]
+            for heap in self.__heaps.values():
+                heap.clear()
+            self.__condition.notify_all()
+        return entries
+
+    def reopen(self):
+        """Accept requests again after close() (worker restarted)."""
+        with self.__condition:
+            self.__closed = False
@@ -2,6 +2,12 @@ import ssl
 import socket
 import os
 import threading
+import binascii
+import itertools
+import time
+
+from core.tls.block_stream import block_operations
+from core.tools.metrics import REGISTRY
 
 
 class TLSConnectionClosed(Exception):
@@ -22,16 +28,524 @@ class CommandErrorResponse(Exception):
     pass
 
 
-class TLSSocketWrapper:
+class KeystoreCommand:
+    """
+    A command to send to the keystore, with what is needed to read and parse its response.
+
+    Attributes:
+        data (bytes | None): The newline-terminated command, None if the result is computed locally
+            (parse is then called with None, without sending anything).
+        response_length (int | None): Length of a binary response, None if the response is text.
+        parse (callable): Turns the raw response (memoryview, without its terminator) into the result.
+            The memoryview is only valid during the call: the result must not reference it.
+        idempotent (bool): Executing the command twice has the same effect as once (e.g. a read),
+            so it can be sent again when the connection is lost before its response.
+    """
+
+    __slots__ = ("data", "response_length", "parse", "idempotent")
+
+    def __init__(self, data: bytes | None, parse, response_length: int | None = None, idempotent: bool = False):
+        self.data = data
+        self.parse = parse
+        self.response_length = response_length
+        self.idempotent = idempotent
+
+
+class KeystoreCommands:
+    """
+    Builders of the Keystore commands (read, write, encrypt, decrypt, etc.).
+
+    Each builder checks its arguments and returns a KeystoreCommand,
+    so that commands can be sent one by one or pipelined.
+
+    Protocol:
+        Every command and every response ends with "\\n".
+        A binary response has the length of the payload of its command, or is "ERROR".
+
+    Class attributes:
+        CEKS_PER_COMMAND (int): Keys wrapped or unwrapped by one command (2 blocks per key, 16 blocks max).
+        keystream_pool (KeystreamPool): Precomputed wrap_cek material, None to always ask the keystore.
+            Set on an instance to use a pool (see ConnectionWorker).
+    """
+
+    CEKS_PER_COMMAND = 8
+    keystream_pool = None
+
+    @staticmethod
+    def __check_payload_length(data: bytes | bytearray):
+        if len(data) == 0:
+            raise ValueError("Empty payload.")
+        elif len(data) > 16 * 16:
+            raise ValueError("Payload length exeeds 16 blocks.")
+        elif len(data) % 16 != 0:
+            raise ValueError("Payload unpadded.")
+
+    @staticmethod
+    def __check_key_index(key_index: int):
+        if (key_index < 0) or (key_index > 3):
+            raise ValueError("Incorrect key index.")
+
+    @staticmethod
+    def __check_record_index(record_index: int):
+        if (record_index < 0) or (record_index > 31):
+            raise ValueError("Incorrect record index.")
+
+    @staticmethod
+    def _xor_bytes(b1: bytes, b2: bytes) -> bytes:
+        """Returns the byte-by-byte XOR of two byte sequences of the same length."""
+        return bytes(a ^ b for a, b in zip(b1, b2))
+
+    @staticmethod
+    def _counter_blocks(r: bytes | bytearray) -> bytes:
+        """Returns the blocks r+1 and r+2 (128 bits, big endian) encrypted to wrap a CEK with r."""
+        r_int = int.from_bytes(r, byteorder="big")
+        r1 = (r_int + 1).to_bytes(16, byteorder="big")
+        r2 = (r_int + 2).to_bytes(16, byteorder="big")
+        return r1 + r2
+
+    @staticmethod
+    def __check_cek_count(ceks: list):
+        if len(ceks) == 0:
+            raise ValueError("No key.")
+        elif len(ceks) > KeystoreCommands.CEKS_PER_COMMAND:
+            raise ValueError(
+                f"More than {KeystoreCommands.CEKS_PER_COMMAND} keys in one command."
+            )
+
+    @staticmethod
+    def __check_ok(response: memoryview, error_message: str):
+        response = bytes(response).decode()
+        if not response.startswith("OK"):
+            if response.startswith("ERROR"):
+                raise CommandErrorResponse(error_message)
+            else:
+                raise CommandUnexpectedResponse(
+                    f"Unexpected response from server: {response}"
+                )
+
+    @staticmethod
+    def __check_binary(response: memoryview, error_message: str) -> memoryview:
+        if response == b"ERROR":
+            raise CommandErrorResponse(error_message)
+        return response
+
+    def echo_command(self, msg: str) -> KeystoreCommand:
+        """
+        Build an echo command.
+
+        Args:
+            msg (str): Message to send for testing.
+        """
+
+        def parse(response):
+            if not bytes(response).decode().startswith(msg):
+                raise CommandUnexpectedResponse("Echo failed")
+
+        return KeystoreCommand(f"?01{msg}\n".encode("utf-8"), parse, idempotent=True)
+
+    def read_record_command(self, record_number: int) -> KeystoreCommand:
+        """
+        Build a command reading the string stored at the specified record number.
+
+        Args:
+            record_number (int): The record number to read from.
+
+        Notes:
+            Reading "ERROR" will raise an exception.
+        """
+
+        KeystoreCommands.__check_record_index(record_number)
+
+        def parse(response):
+            response = bytes(response)
+            if response.startswith(b"ERROR"):
+                raise CommandErrorResponse(f"Read record n°{record_number:02x} failed")
+            return response
+
+        return KeystoreCommand(f"I{record_number:02x}\n".encode("utf-8"), parse, idempotent=True)
+
+    def write_record_command(
+        self, record_number: int, data: bytes | bytearray
+    ) -> KeystoreCommand:
+        """
+        Build a command writing bytes to the specified record number.
+
+        Args:
+            record_number (int): The record number to write to.
+            data (bytes-like object): The bytes to write.
+        """
+
+        KeystoreCommands.__check_record_index(record_number)
+        command_data = (
+            f"Z{record_number:02x}".encode("utf-8") + data + "\n".encode("utf-8")
+        )
+        return KeystoreCommand(
+            command_data,
+            lambda response: KeystoreCommands.__check_ok(
+                response, f"Write record n°{record_number:02x} failed"
+            ),
+        )
+
+    def set_AES_key_command(
+        self, index_key: int, key: bytes | bytearray
+    ) -> KeystoreCommand:
+        """
+        Build a command defining a new AES key on the Keystore.
+
+        Args:
+            index_key (int): Key index (00–03).
+            key (bytes | bytearray): 16 bytes AES key.
+        """
+
+        KeystoreCommands.__check_key_index(index_key)
+        text_key = key.hex()
+        pool = self.keystream_pool
+
+        def parse(response):
+            # Cleared once the keystore answered: a command not sent, or refused, keeps the key.
+            # Acknowledged (or unexpected response): the material of the previous key must not be used.
+            if pool is not None and not bytes(response).startswith(b"ERROR"):
+                pool.clear(index_key)
+            KeystoreCommands.__check_ok(response, f"Set key n°{index_key:02x} failed")
+
+        return KeystoreCommand(f"t{index_key:02x}{text_key}\n".encode("utf-8"), parse)
+
+    def encrypt_AES_command(
+        self, index_key: int, data: bytes | bytearray
+    ) -> KeystoreCommand:
+        """
+        Build a command encrypting data using the AES key at the specified index.
+
+        Args:
+            index_key (int): Key index (0–3).
+            data (bytes | bytearray): Data to encrypt, 1 to 16 blocks of 16 bytes.
+        """
+
+        KeystoreCommands.__check_payload_length(data)
+        KeystoreCommands.__check_key_index(index_key)
+
+        def parse(response):
+            if response[:5] == b"ERROR":
+                raise CommandErrorResponse(
+                    f"Encrypting using AES key n°{index_key:x} failed"
+                )
+            return binascii.unhexlify(response)  # We decode hex text to python bytes.
+
+        text_data = data.hex()
+        return KeystoreCommand(f"A4{index_key:x}{text_data}\n".encode("utf-8"), parse)
+
+    def decrypt_AES_command(
+        self, index_key: int, data: bytes | bytearray
+    ) -> KeystoreCommand:
+        """
+        Build a command decrypting data using the AES key at the specified index.
+
+        Args:
+            index_key (int): Key index (0–3).
+            data (bytes | bytearray): Data to decrypt, 1 to 16 blocks of 16 bytes.
+        """
+
+        KeystoreCommands.__check_payload_length(data)
+        KeystoreCommands.__check_key_index(index_key)
+
+        def parse(response):
+            if response[:5] == b"ERROR":
+                raise CommandErrorResponse(
+                    f"Decrypting using AES key n°{index_key:x} failed"
+                )
+            return binascii.unhexlify(response)
+
+        text_data = data.hex()
+        return KeystoreCommand(f"a4{index_key:x}{text_data}\n".encode("utf-8"), parse)
+
+    def encrypt_AES_binary_command(
+        self, index_key: int, data: bytes | bytearray
+    ) -> KeystoreCommand:
+        """
+        Build a command encrypting binary data using the AES key at the specified index.
+
+        Args:
+            index_key (int): Key index (0–3).
+            data (bytes-like object): Data to encrypt, 1 to 16 blocks of 16 bytes.
+        """
+
+        KeystoreCommands.__check_payload_length(data)
+        KeystoreCommands.__check_key_index(index_key)
+
+        command_data = f"Ac{index_key:1X}".encode("utf-8") + data + "\n".encode("utf-8")
+        return KeystoreCommand(
+            command_data,
+            lambda response: bytes(
+                KeystoreCommands.__check_binary(response, "Encryption failed.")
+            ),
+            len(data),
+        )
+
+    def decrypt_AES_binary_command(
+        self, index_key: int, data: bytes | bytearray
+    ) -> KeystoreCommand:
+        """
+        Build a command decrypting binary data using the AES key at the specified index.
+
+        Args:
+            index_key (int): Key index (0–3).
+            data (bytes-like object): Data to decrypt, 1 to 16 blocks of 16 bytes.
+        """
+
+        KeystoreCommands.__check_payload_length(data)
+        KeystoreCommands.__check_key_index(index_key)
+
+        command_data = f"ac{index_key:1X}".encode("utf-8") + data + "\n".encode("utf-8")
+        return KeystoreCommand(
+            command_data,
+            lambda response: bytes(
+                KeystoreCommands.__check_binary(response, "Decryption failed.")
+            ),
+            len(data),
+        )
+
+    def wrap_cek_command(self, index_key: int, key: bytes | bytearray) -> KeystoreCommand:
+        """
+        Build a command wrapping a 256 bits content encryption key: ck = r || E(r+1)^k1 || E(r+2)^k2.
+
+        Args:
+            index_key (int): Key index (0–3).
+            key (bytes-like object): The key to wrap (32 bytes).
+
+        With a keystream pool holding material for the slot, the key is wrapped locally.
+        """
+
+        if len(key) != 32:
+            raise ValueError("Incorrect key length.")
+
+        if self.keystream_pool is not None:
+            entries = self.keystream_pool.take(index_key)
+            if entries is not None:
+                ck = self.keystream_pool.wrap(entries, [key])[0]
+                return KeystoreCommand(None, lambda response: ck)
+
+        r = os.urandom(16)
+        encrypt = self.encrypt_AES_binary_command(
+            index_key, KeystoreCommands._counter_blocks(r)
+        )
+
+        def parse(response):
+            evals = encrypt.parse(response)
+            c = KeystoreCommands._xor_bytes(evals, key)
+            return r + c
+
+        return KeystoreCommand(encrypt.data, parse, encrypt.response_length)
+
+    def unwrap_cek_command(
+        self, index_key: int, ck: bytes | bytearray
+    ) -> KeystoreCommand:
+        """
+        Build a command recovering the content encryption key from its wrapped form.
+
+        Args:
+            index_key (int): Key index (0–3).
+            ck (bytes-like object): The wrapped key (48 bytes).
+        """
+
+        r = ck[:16]
+        encrypt = self.encrypt_AES_binary_command(
+            index_key, KeystoreCommands._counter_blocks(r)
+        )
+
+        def parse(response):
+            evals = encrypt.parse(response)
+            return KeystoreCommands._xor_bytes(ck[16:48], evals)
+
+        return KeystoreCommand(encrypt.data, parse, encrypt.response_length)
+
+    def wrap_cek_many_command(
+        self, index_key: int, keys: list[bytes | bytearray]
+    ) -> KeystoreCommand:
+        """
+        Build a single command wrapping several content encryption keys (see wrap_cek_command).
+
+        Args:
+            index_key (int): Key index (0–3).
+            keys (list of bytes-like objects): 1 to CEKS_PER_COMMAND keys to wrap (32 bytes each).
+
+        Returns:
+            KeystoreCommand: its result is the list of the wrapped keys, in the order of the keys.
+        """
+
+        KeystoreCommands.__check_cek_count(keys)
+        if any(len(key) != 32 for key in keys):
+            raise ValueError("Incorrect key length.")
+
+        if self.keystream_pool is not None:
+            entries = self.keystream_pool.take(index_key, len(keys))
+            if entries is not None:
+                cks = self.keystream_pool.wrap(entries, keys)
+                return KeystoreCommand(None, lambda response: cks)
+
+        rs = [os.urandom(16) for _ in keys]
+        encrypt = self.encrypt_AES_binary_command(
+            index_key, b"".join(KeystoreCommands._counter_blocks(r) for r in rs)
+        )
+
+        def parse(response):
+            evals = encrypt.parse(response)
+            return [
+                r + KeystoreCommands._xor_bytes(evals[32 * i : 32 * (i + 1)], key)
+                for i, (r, key) in enumerate(zip(rs, keys))
+            ]
+
+        return KeystoreCommand(encrypt.data, parse, encrypt.response_length)
+
+    def unwrap_cek_many_command(
+        self, index_key: int, cks: list[bytes | bytearray]
+    ) -> KeystoreCommand:
+        """
+        Build a single command recovering several content encryption keys (see unwrap_cek_command).
+
+        Args:
+            index_key (int): Key index (0–3).
+            cks (list of bytes-like objects): 1 to CEKS_PER_COMMAND wrapped keys (48 bytes each).
+
+        Returns:
+            KeystoreCommand: its result is the list of the keys, in the order of the wrapped keys.
+        """
+
+        KeystoreCommands.__check_cek_count(cks)
+        if any(len(ck) != 48 for ck in cks):
+            raise ValueError("Incorrect wrapped key length.")
+
+        encrypt = self.encrypt_AES_binary_command(
+            index_key, b"".join(KeystoreCommands._counter_blocks(ck[:16]) for ck in cks)
+        )
+
+        def parse(response):
+            evals = encrypt.parse(response)
+            return [
+                KeystoreCommands._xor_bytes(ck[16:48], evals[32 * i : 32 * (i + 1)])
+                for i, ck in enumerate(cks)
+            ]
+
+        return KeystoreCommand(encrypt.data, parse, encrypt.response_length)
+
+
+class ResponseReader:
+    """
+    Buffered reader framing the responses received on a socket.
+
+    Data is received with recv_into() in a preallocated buffer which is reused,
+    and responses are returned as memoryview slices of this buffer.
+    A text response ends at the "\n" terminator, a binary response has a known length
+    (followed by the terminator) unless it is "ERROR".
+
+    Notes:
+        A returned memoryview is only valid until the next call to read_response().
+    """
+
+    def __init__(self, sock=None, buffer_size: int = 8192):
+        self.__buffer = bytearray(buffer_size)
+        self.__view = memoryview(self.__buffer)
+        self.__start = 0  # First byte not yet returned
+        self.__end = 0  # End of the received bytes
+        self.__sock = sock
+
+    def reset(self, sock=None):
+        """
+        Drop the buffered bytes, and read from another socket if given.
+
+        Args:
+            sock (socket): The new socket to read from.
+        """
+        if sock is not None:
+            self.__sock = sock
+        self.__start = 0
+        self.__end = 0
+
+    def __fill(self):
+        """
+        Receive more bytes at the end of the buffer, making room first if needed.
+
+        Raises:
+            TLSConnectionClosed: the server closed the connection.
+        """
+        if self.__start == self.__end:
+            self.__start = self.__end = 0
+        elif self.__end == len(self.__buffer):
+            pending = self.__end - self.__start
+            if self.__start > 0:
+                # Move the partial response to the beginning of the buffer, through a copy:
+                # the two ranges can overlap
+                self.__buffer[:pending] = self.__buffer[self.__start : self.__end]
+            else:
+                # The response does not fit: the views already returned keep the old buffer
+                buffer = bytearray(2 * len(self.__buffer))
+                buffer[:pending] = self.__view[: self.__end]
+                self.__buffer = buffer
+                self.__view = memoryview(buffer)
+            self.__start, self.__end = 0, pending
+
+        received = self.__sock.recv_into(self.__view[self.__end :])
+        if received == 0:
+            raise TLSConnectionClosed("Server closed connection (EOF).")
+        self.__end += received
+
+    def read_response(self, response_length: int | None = None) -> memoryview:
+        """
+        Receive exactly one response, keeping the bytes that follow it for the next responses.
+
+        Args:
+            response_length (int | None): Length of a binary response, None for a text response.
+
+        Returns:
+            memoryview: The response, without its terminator.
+
+        Raises:
+            TLSConnectionClosed: the server closed the connection.
+            CommandUnexpectedResponse: a binary response is not followed by the terminator.
+        """
+        scanned = 0  # Bytes of the pending response already searched for the terminator
+        while True:
+            pending = self.__end - self.__start
+            if response_length is None or self.__buffer.startswith(
+                b"ERROR", self.__start, self.__end
+            ):
+                end = self.__buffer.find(b"\n", self.__start + scanned, self.__end)
+                if end >= 0:
+                    response = self.__view[self.__start : end]
+                    self.__start = end + 1
+                    return response
+                scanned = pending
+            elif pending > response_length and pending >= len(b"ERROR"):
+                end = self.__start + response_length
+                if self.__buffer[end] != ord("\n"):
+                    raise CommandUnexpectedResponse(
+                        "Binary response is not followed by the terminator."
+                    )
+                response = self.__view[self.__start : end]
+                self.__start = end + 1
+                return response
+            self.__fill()
+
+
+class TLSSocketWrapper(KeystoreCommands):
     """
     TLS socket wrapper for secure client-server communication.
 
     Handles TLS 1.3 connection setup, PSK authentication, and
     Keystore command sending (read, write, encrypt, decrypt, etc.).
+    Commands can be pipelined on the session with execute_many().
+
+    Metrics (core.tools.metrics.REGISTRY, label keystore): pipelines, commands and bytes sent and received,
+    pipeline durations, handshakes (and their duration), reconnections, failed handshakes and reconnections.
     """
 
     def __init__(
-        self, hostname, port, servername, psk=None, ensure_connected_before_send=True
+        self,
+        hostname,
+        port,
+        servername,
+        psk=None,
+        ensure_connected_before_send=True,
+        session_resumption=True,
     ):
         """
         Initialize the TLS socket wrapper and SSL context.
@@ -42,6 +556,8 @@ class TLSSocketWrapper:
             port (int): Server port.
             psk (bytes): The pre-shared key value.
             ensure_connected_before_send (bool): Tries to reconnect before sending if the connection timed out
+            session_resumption (bool): Resume the previous TLS session (ticket) on reconnection.
+                Disabled automatically if a resumed handshake fails.
 
         Infos:
             30s after executing a command the server will disconnect upon the reception of another command (except for echo)
@@ -50,8 +566,16 @@ class TLSSocketWrapper:
         self.__hostname = hostname
         self.__port = port
         self.__servername = servername
-        self.__context = self.__create_ssl_context()
+        self.__labels = {"keystore": servername}
+        self.__session_resumption = session_resumption
+        self.__context = self.create_ssl_context(session_resumption)
+        self.__session = None  # TLS session to resume on the next connection
+        self.__handshake_duration = None
         self.__ssock = None
+        self.__reader = ResponseReader()
+        self.__closed_by_client = False  # close() was called: do not reconnect
+        self.__last_activity = time.monotonic()  # Last connection or response received
+        self.__commands_since_connect = 0
         self.__psk = psk
         self.__ensure_connected_before_send = ensure_connected_before_send
         if psk is not None:
@@ -68,10 +592,33 @@ class TLSSocketWrapper:
     def servername(self):
         return self.__servername
 
+    @property
+    def idle_time(self):
+        """Seconds since the last response received, or since the connection."""
+        return time.monotonic() - self.__last_activity
+
+    @property
+    def commands_since_connect(self):
+        """Number of commands answered since the (re)connection."""
+        return self.__commands_since_connect
+
+    @property
+    def handshake_duration(self):
+        """Duration (s) of the last TLS handshake, None before the first connection."""
+        return self.__handshake_duration
+
+    @property
+    def session_reused(self):
+        """True if the current connection resumed the previous TLS session (abbreviated handshake)."""
+        return self.__ssock is not None and self.__ssock.session_reused
+
     @staticmethod
-    def __create_ssl_context():
+    def create_ssl_context(session_resumption=False):
         """
         Create and configure the TLS 1.3 context.
+
+        Args:
+            session_resumption (bool): Accept session tickets, needed to resume sessions.
         """
 
         ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
@@ -80,7 +627,8 @@ class TLSSocketWrapper:
         ssl_context.minimum_version = ssl.TLSVersion.TLSv1_3
         ssl_context.maximum_version = ssl.TLSVersion.TLSv1_3
         ssl_context.set_ecdh_curve("prime256v1")
-        ssl_context.options &= ssl.OP_NO_TICKET
+        if not session_resumption:
+            ssl_context.options |= ssl.OP_NO_TICKET
         return ssl_context
 
     # DEPRECATED
@@ -108,41 +656,48 @@ class TLSSocketWrapper:
         if not self.__hostname or not self.__port:
             print("Hostname or port not set")
             raise Exception("Hostname or port not set")
-        sock = socket.create_connection((self.__hostname, self.__port), timeout=10)
+        try:
+            sock = socket.create_connection((self.__hostname, self.__port), timeout=10)
+        except OSError as e:
+            REGISTRY.inc("keystore_connection_errors_total", dict(self.__labels, error=type(e).__name__))
+            raise
 
+        session = self.__session if self.__session_resumption else None
+        started = time.perf_counter()
         try:
             self.__ssock = self.__context.wrap_socket(
-                sock, server_hostname=self.__servername
+                sock, server_hostname=self.__servername, session=session
             )
 
         except Exception as e:
             sock.close()
-            raise Exception(f"TLS handshake failed: {e}")
-
+            if session is None:
+                REGISTRY.inc("keystore_connection_errors_total", dict(self.__labels, error=type(e).__name__))
+                raise Exception(f"TLS handshake failed: {e}")
+            print("Info: TLS session resumption failed, disabled for", self.__servername)
+            self.__session_resumption = False
+            self.__session = None
+            return self.connect()
+
+        self.__handshake_duration = time.perf_counter() - started
+        REGISTRY.inc("keystore_handshakes_total", dict(self.__labels, resumed=str(self.session_reused).lower()))
+        REGISTRY.observe("keystore_handshake_duration_seconds", self.__labels, self.__handshake_duration)
+        self.__reader.reset(self.__ssock)
+        self.__closed_by_client = False
+        self.__last_activity = time.monotonic()
+        self.__commands_since_connect = 0
         return self
 
-    @staticmethod
-    def __check_payload_length(data: bytes | bytearray):
-        if len(data) == 0:
-            raise ValueError("Empty payload.")
-        elif len(data) > 16 * 16:
-            raise ValueError("Payload length exeeds 16 blocks.")
-        elif len(data) % 16 != 0:
-            raise ValueError("Payload unpadded.")
-
-    @staticmethod
-    def __check_key_index(key_index: int):
-        if (key_index < 0) or (key_index > 3):
-            raise ValueError("Incorrect key index.")
-
-    def __check_record_index(record_index: int):
-        if (record_index < 0) or (record_index > 31):
-            raise ValueError("Incorrect record index.")
-
-    @staticmethod
-    def __xor_bytes(b1: bytes, b2: bytes) -> bytes:
-        """Returns the byte-by-byte XOR of two byte sequences of the same length."""
-        return bytes(a ^ b for a, b in zip(b1, b2))
+    def reconnect(self):
+        """
+        Close the TLS socket (without the termination command) and establish a new connection.
+        Returns:
+            TLSSocketWrapper: The active socket wrapper instance.
+        """
+        if self.__ssock is not None:
+            self._close_socket()
+        REGISTRY.inc("keystore_reconnects_total", dict(self.__labels, reason="requested"))
+        return self.connect()
 
     # def ensure_connected(self):
     #     """
@@ -168,9 +723,7 @@ class TLSSocketWrapper:
             msg (str): Message to send for testing.
         """
 
-        data = f"?01{msg}\n".encode("utf-8")
-        if not self.send_command(data).decode().startswith(msg):
-            raise CommandUnexpectedResponse("Echo failed")
+        self.execute(self.echo_command(msg))
 
     def read_record(self, record_number: int) -> bytes:
         """
@@ -186,12 +739,7 @@ class TLSSocketWrapper:
             Reading "ERROR" will raise an exception.
         """
 
-        TLSSocketWrapper.__check_record_index(record_number)
-        data = f"I{record_number:02x}\n".encode("utf-8")
-        response = self.send_command(data)
-        if response.startswith(b"ERROR"):
-            raise CommandErrorResponse(f"Read record n°{record_number:02x} failed")
-        return response
+        return self.execute(self.read_record_command(record_number))
 
     def write_record(self, record_number: int, data: bytes | bytearray):
         """
@@ -202,19 +750,7 @@ class TLSSocketWrapper:
             data (bytes-like object): The bytes to write.
         """
 
-        TLSSocketWrapper.__check_record_index(record_number)
-
-        command_data = (
-            f"Z{record_number:02x}".encode("utf-8") + data + "\n".encode("utf-8")
-        )
-        response = self.send_command(command_data).decode()
-        if not response.startswith("OK"):
-            if response.startswith("ERROR"):
-                raise CommandErrorResponse(f"Write record n°{record_number:02x} failed")
-            else:
-                raise CommandUnexpectedResponse(
-                    f"Unexpected response from server: {response}"
-                )
+        self.execute(self.write_record_command(record_number, data))
 
     def set_AES_key(self, index_key: int, key: bytes | bytearray):
         """
@@ -225,17 +761,7 @@ class TLSSocketWrapper:
             key (bytes | bytearray): 16 bytes AES key.
         """
 
-        TLSSocketWrapper.__check_key_index(index_key)
-        text_key = key.hex()
-        data = f"t{index_key:02x}{text_key}\n".encode("utf-8")
-        response = self.send_command(data).decode()
-        if not response.startswith("OK"):
-            if response.startswith("ERROR"):
-                raise CommandErrorResponse(f"Set key n°{index_key:02x} failed")
-            else:
-                raise CommandUnexpectedResponse(
-                    f"Unexpected response from server: {response}"
-                )
+        self.execute(self.set_AES_key_command(index_key, key))
 
     def encrypt_AES(self, index_key: int, data: bytes | bytearray) -> bytes:
         """
@@ -246,19 +772,7 @@ class TLSSocketWrapper:
             data (bytes | bytearray): Data to encrypt, 1 to 16 blocks of 16 bytes.
         """
 
-        TLSSocketWrapper.__check_payload_length(data)
-        TLSSocketWrapper.__check_key_index(index_key)
-
-        text_data = data.hex()
-        text_command = f"A4{index_key:x}{text_data}\n".encode("utf-8")
-        response = self.send_command(
-            text_command
-        ).decode()  # We decode text encoded hex.
-        if response.startswith("ERROR"):
-            raise CommandErrorResponse(
-                f"Encrypting using AES key n°{index_key:x} failed"
-            )
-        return bytes.fromhex(response)  # We encode hex text to python bytes.
+        return self.execute(self.encrypt_AES_command(index_key, data))
 
     def decrypt_AES(self, index_key: int, data: bytes | bytearray) -> bytes:
         """
@@ -269,17 +783,7 @@ class TLSSocketWrapper:
             data (bytes | bytearray): Data to decrypt, 1 to 16 blocks of 16 bytes.
         """
 
-        TLSSocketWrapper.__check_payload_length(data)
-        TLSSocketWrapper.__check_key_index(index_key)
-
-        text_data = data.hex()
-        text_command = f"a4{index_key:x}{text_data}\n".encode("utf-8")
-        response = self.send_command(text_command).decode()
-        if response.startswith("ERROR"):
-            raise CommandErrorResponse(
-                f"Decrypting using AES key n°{index_key:x} failed"
-            )
-        return bytes.fromhex(response)
+        return self.execute(self.decrypt_AES_command(index_key, data))
 
     def encrypt_AES_binary(self, index_key: int, data: bytes | bytearray) -> bytes:
         """
@@ -290,15 +794,10 @@ class TLSSocketWrapper:
             data (bytes-like object): Data to encrypt.
         """
 
-        TLSSocketWrapper.__check_payload_length(data)
-        TLSSocketWrapper.__check_key_index(index_key)
-
-        command_data = f"Ac{index_key:1X}".encode("utf-8") + data + "\n".encode("utf-8")
         try:
-            response = self.send_command(command_data)
+            return self.execute(self.encrypt_AES_binary_command(index_key, data))
         except TLSConnectionClosed as e:
             raise CommandErrorResponse("Encryption failed.")
-        return response
 
     def decrypt_AES_binary(self, index_key: int, data: bytes | bytearray) -> bytes:
         """
@@ -309,48 +808,92 @@ class TLSSocketWrapper:
             data (bytes-like object): Data to decrypt.
         """
 
-        TLSSocketWrapper.__check_payload_length(data)
-        TLSSocketWrapper.__check_key_index(index_key)
-
-        command_data = f"ac{index_key:1X}".encode("utf-8") + data + "\n".encode("utf-8")
         try:
-            response = self.send_command(command_data)
+            return self.execute(self.decrypt_AES_binary_command(index_key, data))
         except TLSConnectionClosed as e:
             raise CommandErrorResponse("Decryption failed.")
-        return response
 
     def wrap_cek(self, index_key: int, key: bytes | bytearray) -> bytes:
-        r = os.urandom(16)
-        r1 = int.from_bytes(r, byteorder="big") + 1
-        r1 = r1.to_bytes(16, byteorder="big")
-        r2 = int.from_bytes(r, byteorder="big") + 2
-        r2 = r2.to_bytes(16, byteorder="big")
+        return self.execute(self.wrap_cek_command(index_key, key))
 
-        eval1 = self.encrypt_AES_binary(index_key, r1)
-        eval2 = self.encrypt_AES_binary(index_key, r2)
+    def unwrap_cek(self, index_key: int, ck: bytes | bytearray) -> bytes:
+        return self.execute(self.unwrap_cek_command(index_key, ck))
 
-        k1, k2 = key[:16], key[16:]
-        c1 = TLSSocketWrapper.__xor_bytes(eval1, k1)
-        c2 = TLSSocketWrapper.__xor_bytes(eval2, k2)
-        ck = b"".join((r, c1, c2))
-        return ck
+    def wrap_cek_many(self, index_key: int, keys: list[bytes | bytearray]) -> list[bytes]:
+        """
+        Wrap several content encryption keys, CEKS_PER_COMMAND keys per command.
 
-    def unwrap_cek(self, index_key: int, ck: bytes | bytearray) -> bytes:
-        r = ck[:16]
+        Args:
+            index_key (int): Key index (0–3).
+            keys (list of bytes-like objects): Keys to wrap (32 bytes each).
+
+        Returns:
+            list[bytes]: The wrapped keys, in the order of the keys.
+        """
+
+        n = KeystoreCommands.CEKS_PER_COMMAND
+        commands = [
+            self.wrap_cek_many_command(index_key, keys[i : i + n])
+            for i in range(0, len(keys), n)
+        ]
+        return [ck for cks in self.execute_many(commands) for ck in cks]
 
-        r1 = int.from_bytes(r, byteorder="big") + 1  # Convertit r en entier
-        r1 = r1.to_bytes(16, byteorder="big")  # Reconvertit en bytes (16 octets)
-        r2 = int.from_bytes(r, byteorder="big") + 2
-        r2 = r2.to_bytes(16, byteorder="big")
+    def unwrap_cek_many(self, index_key: int, cks: list[bytes | bytearray]) -> list[bytes]:
+        """
+        Recover several content encryption keys, CEKS_PER_COMMAND keys per command.
 
-        eval1 = self.encrypt_AES_binary(index_key, r1)
-        eval2 = self.encrypt_AES_binary(index_key, r2)
+        Args:
+            index_key (int): Key index (0–3).
+            cks (list of bytes-like objects): Wrapped keys (48 bytes each).
 
-        k1 = TLSSocketWrapper.__xor_bytes(ck[16:32], eval1)
-        k2 = TLSSocketWrapper.__xor_bytes(ck[32:], eval2)
-        k = k1 + k2
+        Returns:
+            list[bytes]: The keys, in the order of the wrapped keys.
+        """
 
-        return k
+        n = KeystoreCommands.CEKS_PER_COMMAND
+        commands = [
+            self.unwrap_cek_many_command(index_key, cks[i : i + n])
+            for i in range(0, len(cks), n)
+        ]
+        return [key for keys in self.execute_many(commands) for key in keys]
+
+    def encrypt_stream(self, index_key: int, source, mode: str = "ECB", iv: bytes | None = None, window: int = 16):
+        """
+        Encrypt a stream of any length, 16 blocks per command, window commands pipelined at a time.
+        Only window chunks of 256 bytes are held in memory.
+
+        Args:
+            index_key (int): Key index (0–3).
+            source: File-like object, bytes-like object or iterable of bytes-like objects.
+            mode (str): "ECB" (PKCS#7 padding) or "CTR" (counter blocks encrypted by the keystore).
+            iv (bytes): Initial counter block (16 bytes) of the CTR mode.
+            window (int): Commands sent at once.
+
+        Yields:
+            bytes: The encrypted stream, in chunks.
+
+        Raises:
+            ValueError: see block_stream.block_operations.
+            CommandErrorResponse, TLSConnectionClosed, TLSReconnectFailed
+        """
+        return self.__stream(block_operations(source, mode, False, iv), index_key, window)
+
+    def decrypt_stream(self, index_key: int, source, mode: str = "ECB", iv: bytes | None = None, window: int = 16):
+        """
+        Decrypt a stream encrypted by encrypt_stream (same arguments).
+
+        Yields:
+            bytes: The decrypted stream, in chunks.
+        """
+        return self.__stream(block_operations(source, mode, True, iv), index_key, window)
+
+    def __stream(self, operations, index_key, window):
+        while batch := list(itertools.islice(operations, window)):
+            results = self.execute_many(
+                [getattr(self, f"{operation}_command")(index_key, data) for operation, data, _ in batch]
+            )
+            for (_, _, finish), result in zip(batch, results):
+                yield finish(result)
 
     def close(self):
         """
@@ -358,19 +901,34 @@ class TLSSocketWrapper:
         """
 
         data = "?02\n".encode("utf-8")
+        self.__closed_by_client = True
         self.__ssock.send(data)
         self.__ssock.close()
 
     def _close_socket(self):
         """
-        Close the TLS socket
+        Close the TLS socket, keeping its TLS session to resume it on the next connection.
         """
 
+        self.__save_session()
         self.__ssock.close()
 
+    def __save_session(self):
+        """
+        Keep the TLS session of the socket if it can be resumed (the server sent a ticket).
+        """
+        if not self.__session_resumption or self.__ssock is None:
+            return
+        try:
+            session = self.__ssock.session
+        except (OSError, ValueError):
+            return
+        if session is not None and session.has_ticket:
+            self.__session = session
+
     def receive_command_bytes(self):
         """
-        Receive raw data from the TLS socket.
+        Receive raw data from the TLS socket, bypassing the response reader.
 
         Returns:
             bytes: Data received from the server.
@@ -380,12 +938,133 @@ class TLSSocketWrapper:
             raise TLSConnectionClosed("Server closed connection (EOF).")
         return data
 
-    def send_command(self, data: bytes | bytearray) -> bytes:
+    def __pipeline(self, commands, response_lengths, handle_response, idempotent=None):
+        """
+        Send the commands, then pass each response to handle_response in order.
+
+        Args:
+            commands (list of bytes-like objects): Newline-terminated commands to send.
+            response_lengths (list): Length of each binary response, None for text responses.
+            handle_response (callable): Called with each response (memoryview), must not raise.
+            idempotent (list[bool]): Whether each command can be executed twice, None if none can.
+
+        Raises:
+            TLSConnectionClosed: if the server closed the connection and the unanswered commands
+                cannot be sent again (auto-reconnect disabled, or they may have been executed).
+            TLSReconnectFailed: if reconnection or resend fails.
+            OSError: the session failed otherwise (e.g. timeout): it is closed, nothing is sent again.
+
+        Notes:
+            The keystore answers the commands of a socket in order.
+            When the server closes the connection, the unanswered commands are sent again on a new
+            connection only if none of the commands was answered (e.g. a session dropped after being
+            idle, see __init__) or if they are all idempotent: otherwise they may have been executed,
+            and sending them again could execute twice a command changing the state of the keystore.
+        """
+        answered = 0
+        received = 0
+        started = time.perf_counter()
+        try:
+            if self.__ssock.fileno() < 0:
+                # Closed after a failure: the keystore did not receive the commands
+                raise TLSConnectionClosed("Session closed.")
+            self.__send(commands)
+            for response_length in response_lengths:
+                response = self.__reader.read_response(response_length)
+                received += len(response) + 1
+                handle_response(response)
+                answered += 1
+                self.__commands_since_connect += 1
+        except CommandUnexpectedResponse:
+            # Out of sync with the server: the session can no longer be used
+            self._close_socket()
+            raise
+        except (TLSConnectionClosed, ConnectionResetError, BrokenPipeError, ssl.SSLEOFError) as e:
+            # The responses still on their way would be read as the responses of the next commands
+            self._close_socket()
+            if self.__closed_by_client:
+                raise TLSConnectionClosed("Connection closed by the client.") from e
+            if not self.__ensure_connected_before_send:
+                raise TLSConnectionClosed(
+                    "Server closed the connection (auto-reconnect disabled)."
+                )
+            if answered > 0 and not (idempotent and all(idempotent[answered:])):
+                raise TLSConnectionClosed(
+                    f"Server closed the connection after {answered} of {len(commands)} "
+                    "commands: the others may have been executed, they are not sent again."
+                ) from e
+            print("Info: reconnecting before sending data")
+            REGISTRY.inc("keystore_reconnects_total", dict(self.__labels, reason="connection_lost"))
+            try:
+                self.connect()
+                self.__send(commands[answered:])
+                for response_length in response_lengths[answered:]:
+                    response = self.__reader.read_response(response_length)
+                    received += len(response) + 1
+                    handle_response(response)
+                    self.__commands_since_connect += 1
+            except Exception as e:
+                REGISTRY.inc("keystore_connection_errors_total", dict(self.__labels, error=type(e).__name__))
+                raise TLSReconnectFailed(
+                    f"Reconnection to {self.__servername} failed: {e}"
+                ) from e
+        except OSError:
+            # E.g. a timeout: the keystore may have executed the commands, the caller must know
+            self._close_socket()
+            raise
+        finally:
+            REGISTRY.inc("keystore_bytes_received_total", self.__labels, received)
+        self.__last_activity = time.monotonic()
+        REGISTRY.inc("keystore_pipelines_total", self.__labels)
+        REGISTRY.inc("keystore_commands_total", self.__labels, len(commands))
+        REGISTRY.observe("keystore_pipeline_duration_seconds", self.__labels, time.perf_counter() - started)
+
+    def __send(self, commands):
+        """
+        Send the commands one after the other, without waiting for their responses.
+        Each command is sent on its own, in its own TLS record: the keystore reads one command per record.
+        """
+        for command in commands:
+            self.__ssock.sendall(command)
+            REGISTRY.inc("keystore_bytes_sent_total", self.__labels, len(command))
+
+    def send_commands(
+        self,
+        commands: list[bytes | bytearray],
+        response_lengths: list[int | None] | None = None,
+        idempotent: list[bool] | None = None,
+    ) -> list[bytes]:
+        """
+        Send several commands on the TLS socket, then receive their responses (pipelining).
+
+        Arguments:
+            commands (list of bytes-like objects): Newline-terminated commands to send.
+            response_lengths (list): Length of each binary response, None for text responses.
+            idempotent (list[bool]): Whether each command can be executed twice, None if none can.
+        Returns:
+            list[bytes]: Responses received from the server, in the order of the commands.
+        Raises:
+            TLSConnectionClosed: if the server closed the connection and the unanswered commands
+                cannot be sent again (auto-reconnect disabled, or they may have been executed).
+            TLSReconnectFailed: if reconnection or resend fails.
+        """
+        if response_lengths is None:
+            response_lengths = [None] * len(commands)
+        responses = []
+        self.__pipeline(
+            commands, response_lengths, lambda response: responses.append(bytes(response)), idempotent
+        )
+        return responses
+
+    def send_command(
+        self, data: bytes | bytearray, response_length: int | None = None
+    ) -> bytes:
         """
         Send raw data from the TLS socket.
 
         Arguments:
             data (bytes-like object): Command to send.
+            response_length (int | None): Length of a binary response, None for a text response.
         Returns:
             bytes: Data received from the server.
         Raises:
@@ -393,28 +1072,74 @@ class TLSSocketWrapper:
             TLSReconnectFailed: if reconnection or resend fails.
         """
 
-        # TODO add a try block to ensure connection (no close socket in the except)
-        self.__ssock.send(data)
-        try:
-            response = self.receive_command_bytes()
-        except TLSConnectionClosed:
-            if self.__ensure_connected_before_send:
-                print("Info: reconnecting before sending data")
-                try:
-                    self._close_socket()
-                    self.connect()
-                    self.__ssock.send(data)
-                    response = self.receive_command_bytes()
-                except Exception as e:
-                    raise TLSReconnectFailed(
-                        f"Reconnection to {self.__servername} failed: {e}"
-                    ) from e
-                # print("Warning: auto reconnecting the socket upon server timeout which is monopolizing resources")
-            else:
-                raise TLSConnectionClosed(
-                    "Server closed the connection (auto-reconnect disabled)."
-                )
-        return response
+        return self.send_commands([data], [response_length])[0]
+
+    def execute(self, command: KeystoreCommand):
+        """
+        Send a command and parse its response.
+
+        Args:
+            command (KeystoreCommand): The command to send.
+
+        Returns:
+            The parsed response of the command.
+        """
+
+        return self.execute_many([command])[0]
+
+    def execute_many(self, commands: list[KeystoreCommand], return_exceptions=False) -> list:
+        """
+        Pipeline commands on the TLS session: send them all, then parse the responses in order.
+        Local commands (without data) are not sent.
+
+        Args:
+            commands (list[KeystoreCommand]): The commands to send.
+            return_exceptions (bool): Put the exception of a failed parse in the results
+                instead of raising it.
+
+        Returns:
+            list: The parsed response of each command.
+
+        Raises:
+            TLSConnectionClosed, TLSReconnectFailed: the whole pipeline failed.
+            Exceptions of the first failed parse, if return_exceptions is False.
+        """
+
+        results = [None] * len(commands)
+        sent = []  # Indexes of the commands sent, in order
+        for i, command in enumerate(commands):
+            if command.data is not None:
+                sent.append(i)
+                continue
+            try:
+                results[i] = command.parse(None)
+            except Exception as e:
+                results[i] = e
+
+        received = 0
+
+        def handle_response(response):
+            # Parse while the response is in the buffer, and read every response even after a failure
+            nonlocal received
+            i = sent[received]
+            received += 1
+            try:
+                results[i] = commands[i].parse(response)
+            except Exception as e:
+                results[i] = e
+
+        if sent:
+            self.__pipeline(
+                [commands[i].data for i in sent],
+                [commands[i].response_length for i in sent],
+                handle_response,
+                [commands[i].idempotent for i in sent],
+            )
+        if not return_exceptions:
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+        return results
 
     def __str__(self):
         return (
@@ -0,0 +1,107 @@
+import collections
+import hashlib
+import threading
+import time
+from concurrent.futures import Future
+
+
+class UnwrappedKeyCache:
+    """
+    Bounded in-memory cache of unwrapped content encryption keys, indexed by a digest of the wrapped key.
+
+    Entries expire after ttl seconds and the least recently used entry is evicted when the cache is full.
+    The bytes of an expired or evicted key are overwritten with zeros (the copies returned to the
+    callers are theirs to dispose of).
+    Concurrent unwraps of the same wrapped key are merged into a single HSM request.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300):
+        """
+        Args:
+            max_entries (int): Maximum number of keys kept.
+            ttl (float): Seconds a key is kept after it was unwrapped.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.__entries = collections.OrderedDict()  # digest: (expiry, bytearray key), LRU first
+        self.__in_flight = {}  # digest: Future of the key being unwrapped
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def __digest(wrapped: bytes | bytearray, context: str) -> bytes:
+        return hashlib.sha256(context.encode("utf-8") + b"\x00" + bytes(wrapped)).digest()
+
+    @staticmethod
+    def __zero(key: bytearray):
+        key[:] = bytes(len(key))
+
+    def __evict(self, digest):
+        """Remove an entry and zero its key (the lock must be held)."""
+        _, key = self.__entries.pop(digest)
+        UnwrappedKeyCache.__zero(key)
+
+    def get_or_unwrap(self, wrapped: bytes | bytearray, unwrap, context: str = "") -> bytes:
+        """
+        Get the key of a wrapped key from the cache, or unwrap it.
+
+        Args:
+            wrapped (bytes-like object): The wrapped key.
+            unwrap (callable): Called with the wrapped key to unwrap it on a miss.
+            context (str): What else the unwrapped key depends on (e.g. keystore and key slot).
+
+        Returns:
+            bytes: The unwrapped key.
+
+        Raises:
+            Exceptions of unwrap.
+        """
+        digest = UnwrappedKeyCache.__digest(wrapped, context)
+        with self.__lock:
+            entry = self.__entries.get(digest)
+            if entry is not None:
+                expiry, key = entry
+                if time.monotonic() < expiry:
+                    self.__entries.move_to_end(digest)
+                    return bytes(key)
+                self.__evict(digest)
+
+            future = self.__in_flight.get(digest)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.__in_flight[digest] = future
+
+        if not owner:
+            # Same key already being unwrapped
+            return future.result()
+
+        try:
+            key = bytes(unwrap(wrapped))
+            with self.__lock:
+                if digest in self.__entries:
+                    self.__evict(digest)
+                self.__entries[digest] = (time.monotonic() + self.ttl, bytearray(key))
+                while len(self.__entries) > self.max_entries:
+                    self.__evict(next(iter(self.__entries)))
+            future.set_result(key)
+            return key
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            # Also on KeyboardInterrupt and the like: the waiting callers must not be left blocked
+            with self.__lock:
+                del self.__in_flight[digest]
+            if not future.done():
+                future.set_exception(RuntimeError("Unwrapping of the key was interrupted."))
+
+    def clear(self):
+        """
+        Remove every key from the cache, zeroing them.
+        """
+        with self.__lock:
+            for digest in list(self.__entries):
+                self.__evict(digest)
+
+    def __len__(self):
+        return len(self.__entries)
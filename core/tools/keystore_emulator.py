@@ -0,0 +1,463 @@
+import argparse
+import hashlib
+import math
+import random
+import socket
+import ssl
+import threading
+import time
+
+from Crypto.Cipher import AES
+
+DEFAULT_PORT = 4433
+IDLE_TIMEOUT = 30  # s after a command before the next one (except echo) closes the session
+RECORD_SIZE = 16384  # Maximum plaintext of a TLS record
+
+KEY_SLOTS = 4
+RECORDS = 32
+MAX_PAYLOAD = 16 * 16
+
+# Command prefix: name (the one of the TLSSocketWrapper method, used to configure the latencies)
+COMMAND_NAMES = {
+    b"?01": "echo",
+    b"?02": "close",
+    b"I": "read_record",
+    b"Z": "write_record",
+    b"t": "set_AES_key",
+    b"A4": "encrypt_AES",
+    b"a4": "decrypt_AES",
+    b"Ac": "encrypt_AES_binary",
+    b"ac": "decrypt_AES_binary",
+}
+ERROR = b"ERROR\n"
+
+
+class LatencyDistribution:
+    """
+    Service time of a command, in milliseconds:
+    - "5": constant,
+    - "uniform:1:5": uniform between 1 and 5,
+    - "normal:5:1": normal of mean 5 and standard deviation 1 (clipped at 0),
+    - "lognormal:5:0.5": log-normal of median 5 and shape 0.5 (long tail),
+    - "exp:5": exponential of mean 5.
+    """
+
+    def __init__(self, spec: str):
+        kind, *parameters = spec.split(":") if ":" in spec else ("constant", spec)
+        try:
+            parameters = [float(parameter) for parameter in parameters]
+        except ValueError:
+            raise ValueError(f"Invalid latency: {spec}")
+        arity = {"constant": 1, "uniform": 2, "normal": 2, "lognormal": 2, "exp": 1}
+        if kind not in arity or len(parameters) != arity[kind]:
+            raise ValueError(f"Invalid latency: {spec}")
+        self.spec = spec
+        self.kind = kind
+        self.parameters = parameters
+
+    def sample(self, rng: random.Random) -> float:
+        """
+        Returns:
+            float: A latency in seconds.
+        """
+        if self.kind == "constant":
+            ms = self.parameters[0]
+        elif self.kind == "uniform":
+            ms = rng.uniform(*self.parameters)
+        elif self.kind == "normal":
+            ms = rng.gauss(*self.parameters)
+        elif self.kind == "lognormal":
+            median, shape = self.parameters
+            ms = median * math.exp(shape * rng.gauss(0, 1))
+        else:
+            ms = rng.expovariate(1 / self.parameters[0]) if self.parameters[0] > 0 else 0
+        return max(ms, 0) / 1000
+
+
+class EmulatedKeystore:
+    """
+    State of a keystore: its AES keys (slots 0 to 3) and records (0 to 31).
+
+    The initial key of a slot is derived from the servername and the slot number, so that the keys
+    wrapped by a run of the emulator can be unwrapped by the next one. These are test keys: never
+    use the emulator with real data.
+    """
+
+    def __init__(self, servername: str, concurrency: int | None = None):
+        """
+        Args:
+            servername (str): Name of the keystore (SNI).
+            concurrency (int): Commands processed at once over all the sessions, None for no limit.
+        """
+        self.servername = servername
+        self.__keys = [
+            hashlib.sha256(f"{servername}/{slot}".encode("utf-8")).digest()[:16] for slot in range(KEY_SLOTS)
+        ]
+        self.__records = [b""] * RECORDS
+        self.__lock = threading.Lock()
+        self.busy = threading.Semaphore(concurrency) if concurrency else None
+        self.commands = 0  # Commands processed, over all the sessions
+
+    def count_command(self):
+        with self.__lock:
+            self.commands += 1
+
+    def execute(self, name: str, command: bytes) -> bytes:
+        """
+        Args:
+            name (str): Name of the command (see COMMAND_NAMES).
+            command (bytes): The command, without its terminator.
+
+        Returns:
+            bytes: The response, with its terminator ("ERROR\\n" if the command is invalid).
+        """
+        try:
+            return getattr(self, f"_{name}")(command)
+        except (ValueError, IndexError):
+            return ERROR
+
+    @staticmethod
+    def __index(text: bytes, limit: int) -> int:
+        index = int(text, 16)
+        if not 0 <= index < limit:
+            raise ValueError("Index out of range.")
+        return index
+
+    @staticmethod
+    def __check_payload(data: bytes):
+        if not data or len(data) > MAX_PAYLOAD or len(data) % 16:
+            raise ValueError("Invalid payload.")
+
+    def __cipher(self, slot: int):
+        with self.__lock:
+            return AES.new(self.__keys[slot], AES.MODE_ECB)
+
+    def _echo(self, command):
+        return command[3:] + b"\n"
+
+    def _read_record(self, command):
+        record = EmulatedKeystore.__index(command[1:3], RECORDS)
+        with self.__lock:
+            return self.__records[record] + b"\n"
+
+    def _write_record(self, command):
+        record = EmulatedKeystore.__index(command[1:3], RECORDS)
+        with self.__lock:
+            self.__records[record] = command[3:]
+        return b"OK\n"
+
+    def _set_AES_key(self, command):
+        slot = EmulatedKeystore.__index(command[1:3], KEY_SLOTS)
+        key = bytes.fromhex(command[3:].decode("ascii"))
+        if len(key) not in (16, 24, 32):
+            raise ValueError("Invalid key length.")
+        with self.__lock:
+            self.__keys[slot] = key
+        return b"OK\n"
+
+    def __block_operation(self, command, binary, decrypt):
+        slot = EmulatedKeystore.__index(command[2:3], KEY_SLOTS)
+        data = command[3:] if binary else bytes.fromhex(command[3:].decode("ascii"))
+        EmulatedKeystore.__check_payload(data)
+        cipher = self.__cipher(slot)
+        result = cipher.decrypt(data) if decrypt else cipher.encrypt(data)
+        return (result if binary else result.hex().encode("ascii")) + b"\n"
+
+    def _encrypt_AES(self, command):
+        return self.__block_operation(command, False, False)
+
+    def _decrypt_AES(self, command):
+        return self.__block_operation(command, False, True)
+
+    def _encrypt_AES_binary(self, command):
+        return self.__block_operation(command, True, False)
+
+    def _decrypt_AES_binary(self, command):
+        return self.__block_operation(command, True, True)
+
+
+def parse_command(record: bytes):
+    """
+    Read the command of a TLS record. Like the keystores, the emulator reads one command per record
+    (TLSSocketWrapper sends each command in its own record), so the payload of a binary command
+    (Ac, ac) can contain "\\n".
+
+    Returns:
+        tuple: (name, command without its terminator), name being None for an unknown command
+        or a record not ending with "\\n".
+    """
+    if not record.endswith(b"\n"):
+        return None, record
+    command = record[:-1]
+    for prefix, name in COMMAND_NAMES.items():
+        if command.startswith(prefix):
+            return name, command
+    return None, command
+
+
+class KeystoreEmulator:
+    """
+    Local TLS 1.3 server speaking the keystore protocol of TLSSocketWrapper, with one EmulatedKeystore
+    per servername (SNI), to test the clients offline.
+
+    Behaviour of the keystores:
+    - one command per TLS record (see parse_command), answered in order (pipelining),
+      with real AES (ECB on the blocks),
+    - a command received more than idle_timeout seconds after the previous one closes the session
+      without an answer, except echo, which is always answered. Whether echo restarts the idle timer
+      is not documented for the keystores: it only does with echo_keeps_alive,
+    - "?02" closes the session.
+
+    Fault injection:
+    - latencies: service time of each command, by command name ("*" for the others),
+    - error_rate: probability that a command (except echo) is answered "ERROR",
+    - drop_rate: probability that a command closes the session without an answer,
+    - max_commands: commands answered by a session before it is closed (the commands already received
+      are left unanswered), like a server limiting the requests per connection.
+
+    Authentication: TLS 1.3 PSK (identity "Client_identity", needs Python 3.13), or a certificate
+    (not checked by TLSSocketWrapper) for the clients without PSK.
+    """
+
+    def __init__(self, host = "127.0.0.1", port = DEFAULT_PORT, psk = None, certfile = None, keyfile = None,
+                 keystores = None, latencies = None, error_rate = 0.0, drop_rate = 0.0,
+                 idle_timeout = IDLE_TIMEOUT, concurrency = None, seed = None, max_commands = None,
+                 echo_keeps_alive = False):
+        """
+        Args:
+            host (str): Address to listen on.
+            port (int): Port to listen on.
+            psk (bytes): Pre-shared key of the clients.
+            certfile (str): Certificate of the server (PEM), instead of or on top of the PSK.
+            keyfile (str): Private key of the certificate (PEM).
+            keystores (list[str]): Servernames accepted, None to accept any.
+            latencies (dict): Command name: LatencyDistribution.
+            error_rate (float): Probability of an ERROR response.
+            drop_rate (float): Probability of a dropped session.
+            idle_timeout (float): Seconds, 0 to keep idle sessions usable.
+            concurrency (int): Commands processed at once by a keystore, None for no limit.
+            seed (int): Seed of the latencies and faults.
+            max_commands (int): Commands answered by a session before it is closed, None for no limit.
+            echo_keeps_alive (bool): An echo restarts the idle timer of the session.
+        """
+        if psk is None and certfile is None:
+            raise ValueError("A PSK or a certificate is needed.")
+        self.host = host
+        self.port = port
+        self.allowed_keystores = set(keystores) if keystores else None
+        self.latencies = latencies or {}
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.idle_timeout = idle_timeout
+        self.concurrency = concurrency
+        self.max_commands = max_commands
+        self.echo_keeps_alive = echo_keeps_alive
+        self.__rng = random.Random(seed)
+        self.__keystores = {}
+        self.__lock = threading.Lock()
+        self.__listener = None
+        self.context = KeystoreEmulator.__create_context(psk, certfile, keyfile)
+        self.context.sni_callback = KeystoreEmulator.__sni
+
+    @staticmethod
+    def __create_context(psk, certfile, keyfile):
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.minimum_version = ssl.TLSVersion.TLSv1_3
+        context.maximum_version = ssl.TLSVersion.TLSv1_3
+        if certfile is not None:
+            context.load_cert_chain(certfile, keyfile)
+        if psk is not None:
+            if not hasattr(context, "set_psk_server_callback"):
+                raise RuntimeError("PSK needs Python 3.13 or later, use a certificate instead.")
+            context.set_psk_server_callback(lambda identity: psk if identity == "Client_identity" else b"")
+        return context
+
+    @staticmethod
+    def __sni(ssl_socket, servername, context):
+        ssl_socket.keystore_servername = servername
+
+    def get_keystore(self, servername) -> EmulatedKeystore | None:
+        """
+        Returns:
+            EmulatedKeystore: The keystore of a servername, created on first use. None if not accepted.
+        """
+        if self.allowed_keystores is not None and servername not in self.allowed_keystores:
+            return None
+        with self.__lock:
+            keystore = self.__keystores.get(servername)
+            if keystore is None:
+                keystore = self.__keystores[servername] = EmulatedKeystore(servername, self.concurrency)
+            return keystore
+
+    def start(self):
+        """
+        Listen, then accept the sessions in a daemon thread.
+
+        Returns:
+            int: The port listened on (useful with port 0).
+        """
+        self.__listener = socket.create_server((self.host, self.port), reuse_port=False, backlog=128)
+        self.port = self.__listener.getsockname()[1]
+        threading.Thread(target=self.__accept, daemon=True).start()
+        return self.port
+
+    def serve_forever(self):
+        self.start()
+        print(f"[*] Keystore emulator listening on {self.host}:{self.port}...")
+        try:
+            threading.Event().wait()
+        finally:
+            self.stop()
+
+    def stop(self):
+        if self.__listener is not None:
+            self.__listener.close()
+
+    def __accept(self):
+        while True:
+            try:
+                conn, addr = self.__listener.accept()
+            except OSError:
+                return  # Listener closed
+            threading.Thread(target=self.__handle_session, args=(conn, addr), daemon=True).start()
+
+    def __handle_session(self, conn, addr):
+        # One write per response: without it, Nagle's algorithm holds the next responses of a pipeline
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            ssock = self.context.wrap_socket(conn, server_side=True)
+        except (OSError, ssl.SSLError) as e:
+            print(f"[-] Handshake with {addr} failed: {e}")
+            conn.close()
+            return
+
+        with ssock:
+            servername = getattr(ssock, "keystore_servername", None)
+            keystore = self.get_keystore(servername)
+            if keystore is None:
+                print(f"[-] Unknown keystore {servername} requested by {addr}")
+                return
+            try:
+                self.__serve(ssock, keystore)
+            except OSError:
+                pass
+
+    def __serve(self, ssock, keystore):
+        """Answer the commands of a session until it is closed or dropped."""
+        last_command = None
+        answered = 0
+        while True:
+            record = ssock.recv(RECORD_SIZE)
+            if not record:
+                return
+            name, data = parse_command(record)
+            if name == "close":
+                return
+            now = time.monotonic()
+            if (self.idle_timeout and name != "echo" and last_command is not None
+                    and now - last_command > self.idle_timeout):
+                return  # Idle session: dropped by the keystore
+            if self.drop_rate and self.__rng.random() < self.drop_rate:
+                return
+
+            ssock.sendall(self.__respond(keystore, name, data))
+            if name != "echo" or self.echo_keeps_alive:
+                last_command = time.monotonic()
+            answered += 1
+            if self.max_commands is not None and answered >= self.max_commands:
+                KeystoreEmulator.__close_gracefully(ssock)
+                return
+
+    @staticmethod
+    def __close_gracefully(ssock):
+        """
+        Close a session once the client has read the responses: closing it with unread commands
+        would reset the connection, and the client could lose responses already sent.
+        """
+        ssock.shutdown(socket.SHUT_WR)
+        ssock.settimeout(1)
+        try:
+            while ssock.recv(65536):
+                pass
+        except OSError:
+            pass
+
+    def __respond(self, keystore, name, data):
+        latency = self.latencies.get(name) or self.latencies.get("*")
+        if keystore.busy is not None:
+            keystore.busy.acquire()
+        try:
+            if latency is not None:
+                time.sleep(latency.sample(self.__rng))
+            if name is None:
+                return ERROR
+            if name != "echo" and self.error_rate and self.__rng.random() < self.error_rate:
+                return ERROR
+            return keystore.execute(name, data)
+        finally:
+            keystore.count_command()
+            if keystore.busy is not None:
+                keystore.busy.release()
+
+
+def parse_latencies(specs):
+    """
+    Args:
+        specs (list[str]): "<command name or *>=<distribution>", e.g. "encrypt_AES_binary=lognormal:2:0.5"
+            (see COMMAND_NAMES and LatencyDistribution).
+
+    Returns:
+        dict: Command name: LatencyDistribution.
+    """
+    latencies = {}
+    for spec in specs or []:
+        name, _, distribution = spec.partition("=")
+        if name != "*" and name not in COMMAND_NAMES.values():
+            raise ValueError(f"Unknown command: {name}")
+        latencies[name] = LatencyDistribution(distribution)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local keystore emulator with latencies and faults (test keys only).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--psk", help="pre-shared key of the clients, hex (Python 3.13)")
+    parser.add_argument("--certfile", help="certificate of the server (PEM), for clients without PSK")
+    parser.add_argument("--keyfile")
+    parser.add_argument("--keystore", action="append", help="servername accepted (repeat), any by default")
+    parser.add_argument("--latency", action="append", metavar="COMMAND=DISTRIBUTION",
+                        help='service time in ms, e.g. "*=2" or "encrypt_AES_binary=lognormal:2:0.5" (repeat)')
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of an ERROR response")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="probability of a dropped session per command")
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT, help="0 to disable")
+    parser.add_argument("--concurrency", type=int, default=None, help="commands processed at once per keystore")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--max-commands", type=int, default=None, help="commands answered by a session before closing it")
+    parser.add_argument("--echo-keeps-alive", action="store_true", help="an echo restarts the idle timer of the session")
+    args = parser.parse_args()
+
+    emulator = KeystoreEmulator(
+        args.host,
+        args.port,
+        bytes.fromhex(args.psk) if args.psk else None,
+        args.certfile,
+        args.keyfile,
+        args.keystore,
+        parse_latencies(args.latency),
+        args.error_rate,
+        args.drop_rate,
+        args.idle_timeout,
+        args.concurrency,
+        args.seed,
+        args.max_commands,
+        args.echo_keeps_alive,
+    )
+    try:
+        emulator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
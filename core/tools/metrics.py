@@ -0,0 +1,227 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds (s) of the latency histograms buckets, from a local keystore to a remote HSM under load
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    Cumulative histogram of observed values (Prometheus semantics: a value is counted in every
+    bucket whose upper bound is greater or equal).
+    """
+
+    def __init__(self, buckets = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self) -> dict:
+        """
+        Returns:
+            dict: "buckets" (list of (upper bound, cumulative count), ending with +inf), "count" and "sum".
+        """
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            cumulative.append((bound, total))
+        cumulative.append((float("inf"), self.count))
+        return {"buckets": cumulative, "count": self.count, "sum": self.sum}
+
+    def percentile(self, percentile: float) -> float | None:
+        """
+        Returns:
+            float: Upper bound of the bucket holding the percentile (0 to 1), None without values.
+        """
+        if not self.count:
+            return None
+        rank = percentile * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float("inf")
+
+
+class MetricsRegistry:
+    """
+    Thread-safe store of counters, histograms and gauges, identified by a name and labels
+    (e.g. "keystore_requests_total", {"keystore": "key17.com", "command": "wrap_cek"}).
+
+    Gauges are read when a snapshot is taken, from a callback registered by the owner of the value.
+    """
+
+    HELP = {
+        "keystore_requests_total": "Requests completed by the workers, by outcome.",
+        "keystore_request_duration_seconds": "Time from the dispatch of a request to its response.",
+        "keystore_queue_wait_seconds": "Time a request waited in the queue of a worker before being sent, by priority class.",
+        "keystore_errors_total": "Failed requests, by exception class.",
+        "keystore_requests_dropped_total": "Requests not sent: cancelled, or expired in the queue.",
+        "keystore_requests_rejected_total": "Requests rejected because the queue of their priority class was full.",
+        "keystore_queue_depth": "Requests waiting in the queue of a worker, by priority class.",
+        "keystore_pipelines_total": "Pipelines of commands sent on the TLS sessions.",
+        "keystore_commands_total": "Commands answered on the TLS sessions.",
+        "keystore_pipeline_duration_seconds": "Time from sending a pipeline to its last response.",
+        "keystore_handshakes_total": "TLS handshakes, by resumption of the previous session.",
+        "keystore_handshake_duration_seconds": "Duration of the TLS handshakes.",
+        "keystore_reconnects_total": "Reconnections of the TLS sessions, by reason.",
+        "keystore_connection_errors_total": "Failed handshakes and reconnections, by exception class.",
+        "keystore_bytes_sent_total": "Bytes of the commands sent.",
+        "keystore_bytes_received_total": "Bytes of the responses received.",
+    }
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__counters = {}  # (name, labels): value
+        self.__histograms = {}  # (name, labels): Histogram
+        self.__gauges = {}  # (name, labels): callback
+
+    @staticmethod
+    def __key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, labels: dict, value: float = 1):
+        """Add value to a counter."""
+        key = MetricsRegistry.__key(name, labels)
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + value
+
+    def observe(self, name: str, labels: dict, value: float):
+        """Add a value to a histogram."""
+        key = MetricsRegistry.__key(name, labels)
+        with self.__lock:
+            histogram = self.__histograms.get(key)
+            if histogram is None:
+                histogram = self.__histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def gauge(self, name: str, labels: dict, callback):
+        """
+        Register a gauge, replacing the previous one with the same name and labels.
+
+        Args:
+            callback (callable): Called without arguments to read the value of the gauge.
+        """
+        with self.__lock:
+            self.__gauges[MetricsRegistry.__key(name, labels)] = callback
+
+    def reset(self):
+        """Forget every value (gauges stay registered)."""
+        with self.__lock:
+            self.__counters.clear()
+            self.__histograms.clear()
+
+    def snapshot(self) -> dict:
+        """
+        Returns:
+            dict: {"counters": ..., "histograms": ..., "gauges": ...}, each a dict
+            {name: [(labels dict, value)]}, the value of a histogram being its snapshot (see Histogram).
+        """
+        with self.__lock:
+            counters = list(self.__counters.items())
+            histograms = [(key, histogram.snapshot()) for key, histogram in self.__histograms.items()]
+            gauges = list(self.__gauges.items())
+
+        snapshot = {"counters": {}, "histograms": {}, "gauges": {}}
+        for kind, items in (("counters", counters), ("histograms", histograms)):
+            for (name, labels), value in sorted(items):
+                snapshot[kind].setdefault(name, []).append((dict(labels), value))
+        for (name, labels), callback in sorted(gauges, key=lambda item: item[0]):
+            try:
+                value = callback()
+            except Exception:
+                continue
+            snapshot["gauges"].setdefault(name, []).append((dict(labels), value))
+        return snapshot
+
+    def prometheus_text(self) -> str:
+        """
+        Returns:
+            str: The snapshot in the Prometheus text exposition format (version 0.0.4).
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for kind, prometheus_type in (("counters", "counter"), ("gauges", "gauge"), ("histograms", "histogram")):
+            for name, samples in snapshot[kind].items():
+                if name in MetricsRegistry.HELP:
+                    lines.append(f"# HELP {name} {MetricsRegistry.HELP[name]}")
+                lines.append(f"# TYPE {name} {prometheus_type}")
+                for labels, value in samples:
+                    if kind != "histograms":
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                        continue
+                    for bound, count in value["buckets"]:
+                        bucket_labels = dict(labels, le=_format_value(bound))
+                        lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value['sum'])}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+# Registry of the workers and TLS sessions of the process
+REGISTRY = MetricsRegistry()
+
+
+def snapshot() -> dict:
+    """Snapshot of the metrics of the process (see MetricsRegistry.snapshot)."""
+    return REGISTRY.snapshot()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scraped every few seconds: not worth a line each time
+
+
+def start_http_server(port: int, host: str = "", registry: MetricsRegistry = REGISTRY) -> ThreadingHTTPServer:
+    """
+    Serve the metrics in the Prometheus text format on http://host:port/metrics, in a daemon thread.
+
+    Returns:
+        ThreadingHTTPServer: The server (shutdown() to stop it).
+    """
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"[*] Metrics on http://{host or '0.0.0.0'}:{server.server_address[1]}/metrics")
+    return server
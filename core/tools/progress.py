@@ -0,0 +1,50 @@
+class TransferCancelled(Exception):
+    """
+    Raised by a progress callback to abort the transfer it reports on.
+    """
+
+
+class ProgressReader:
+    """
+    File-like wrapper reporting the bytes read from a stream, for the transfers that only read it
+    (the other attributes are the ones of the stream).
+
+    The callback is called with (bytes read, total) after each read, in the reading thread.
+    It can raise (e.g. TransferCancelled) to abort the transfer.
+    """
+
+    def __init__(self, stream, progress, total: int | None = None):
+        """
+        Args:
+            stream: Readable file-like object.
+            progress (callable): progress(done: int, total: int | None).
+            total (int): Expected number of bytes, None if unknown.
+        """
+        self.__stream = stream
+        self.__progress = progress
+        self.total = total
+        self.done = 0
+
+    def __report(self, n):
+        if n:
+            self.done += n
+            self.__progress(self.done, self.total)
+
+    def read(self, size=-1):
+        data = self.__stream.read(size)
+        self.__report(len(data) if data else 0)
+        return data
+
+    def readinto(self, buffer):
+        n = self.__stream.readinto(buffer)
+        self.__report(n)
+        return n
+
+    def __getattr__(self, name):
+        return getattr(self.__stream, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,6 +1,11 @@
 import sys
 import yaml
 
+# Optional settings of a keystore, passed to its ConnectionWorker
+KEYSTORE_OPTIONS = ("pool_size", "pipeline_depth", "keepalive", "keepalive_interval", "session_resumption",
+                    "keystream_slots", "keystream_low_watermark", "keystream_high_watermark",
+                    "keystream_check_interval", "queue_limits", "starvation_limit")
+
 def readconfig(path):
     """
     Read a YAML configuration file.
@@ -9,7 +14,8 @@ def readconfig(path):
         path (str): The path of the configuration file.
 
     Returns:
-        List of tuples : [(host, port, servername, psk), ...].
+        List of tuples : [(host, port, servername, psk, options), ...].
+        options (dict) holds the optional settings of the keystore (see KEYSTORE_OPTIONS).
     """
     try:
         tls_sockets = []
@@ -25,8 +31,39 @@ def readconfig(path):
                 servername = keystore["servername"]
                 print("TLS-SE server:", servername)
                 psk = bytes.fromhex(keystore["psk"])
-                tls_sockets.append((ip, port, servername, psk))
+                options = {option: keystore[option] for option in KEYSTORE_OPTIONS if option in keystore}
+                tls_sockets.append((ip, port, servername, psk, options))
         return tls_sockets
     except FileNotFoundError:
         print(f"Config file at {path} is missing, check if it is present.")
         sys.exit(1)
+
+
+# Settings of the cache of unwrapped keys (see UnwrappedKeyCache)
+UNWRAP_CACHE_OPTIONS = ("max_entries", "ttl")
+
+def read_unwrap_cache_config(path):
+    """
+    Read the optional "unwrap_cache" section of a YAML configuration file: true for the default
+    settings, or a mapping of UNWRAP_CACHE_OPTIONS.
+
+    Args:
+        path (str): The path of the configuration file.
+
+    Returns:
+        dict: The keyword arguments of enable_unwrap_cache() (key providers), None if the cache is disabled.
+
+    Raises:
+        ValueError: Invalid section.
+    """
+    with open(path, "r") as cfgfile:
+        config = yaml.safe_load(cfgfile)
+
+    section = config.get("unwrap_cache")
+    if section is None or section is False:
+        return None
+    if section is True:
+        return {}
+    if not isinstance(section, dict) or set(section) - set(UNWRAP_CACHE_OPTIONS):
+        raise ValueError(f"Invalid unwrap_cache section, expected true or a mapping of {', '.join(UNWRAP_CACHE_OPTIONS)}.")
+    return dict(section)
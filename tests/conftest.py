@@ -0,0 +1,90 @@
+import datetime
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from core.tools.keystore_emulator import KeystoreEmulator
+from core.tls.hsm_connection import ConnectionWorker
+from core.tls.socket_wrapper import TLSSocketWrapper
+
+
+@pytest.fixture(scope="session")
+def certificate(tmp_path_factory):
+    """Self-signed certificate of the emulator (the clients do not check it, PSK needs Python 3.13)."""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "keystore-emulator")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    directory = tmp_path_factory.mktemp("emulator")
+    certfile, keyfile = directory / "cert.pem", directory / "key.pem"
+    certfile.write_bytes(certificate.public_bytes(serialization.Encoding.PEM))
+    keyfile.write_bytes(key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ))
+    return str(certfile), str(keyfile)
+
+
+@pytest.fixture
+def start_emulator(certificate):
+    """Start keystore emulators (KeystoreEmulator arguments), stopped after the test."""
+    emulators = []
+
+    def start(**options):
+        emulator = KeystoreEmulator("127.0.0.1", 0, certfile=certificate[0], keyfile=certificate[1], **options)
+        emulator.start()
+        emulators.append(emulator)
+        return emulator
+
+    yield start
+    for emulator in emulators:
+        emulator.stop()
+
+
+@pytest.fixture
+def emulator(start_emulator):
+    return start_emulator(seed=0)
+
+
+@pytest.fixture
+def connect():
+    """Open TLSSocketWrappers to an emulator, closed after the test."""
+    wrappers = []
+
+    def open_wrapper(emulator, servername = "key17.com", **options):
+        wrapper = TLSSocketWrapper(emulator.host, emulator.port, servername, **options)
+        wrapper.connect()
+        wrappers.append(wrapper)
+        return wrapper
+
+    yield open_wrapper
+    for wrapper in wrappers:
+        wrapper._close_socket()
+
+
+@pytest.fixture
+def start_worker():
+    """Start ConnectionWorkers to an emulator, stopped and forgotten after the test."""
+    workers = []
+
+    def start(emulator, servername = "key17.com", **options):
+        worker = ConnectionWorker(emulator.host, emulator.port, servername, **options)
+        workers.append(worker)
+        worker.start_worker()
+        return worker
+
+    yield start
+    ConnectionWorker.stop_all()
+    for worker in workers:
+        ConnectionWorker.allWorkers.remove(worker)
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+from cryptography.exceptions import InvalidTag
+
+pytest.importorskip("aws_encryption_sdk")
+moto = pytest.importorskip("moto")
+
+from app.amazon_s3.cloud_handler import AmazonS3CloudHandler, FRAME_LENGTH
+from app.amazon_s3.key_provider import S3KEKProvider
+
+BUCKET = "keystore-tests"
+
+
+@pytest.fixture
+def handler(emulator, start_worker, monkeypatch):
+    """AmazonS3CloudHandler on a moto S3, its data keys wrapped by the emulated key17.com."""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    start_worker(emulator, "key17.com")
+    with moto.mock_aws():
+        handler = AmazonS3CloudHandler(S3KEKProvider())
+        handler.connect_cloud()
+        handler.create_container(BUCKET)
+        yield handler
+
+
+@pytest.mark.parametrize("size", [0, 1, FRAME_LENGTH, 2 * FRAME_LENGTH + 5])
+def test_upload_download_round_trip(handler, tmp_path, size):
+    data = os.urandom(size)
+    path = tmp_path / "plain"
+    path.write_bytes(data)
+
+    handler.upload(str(path), BUCKET, "object")
+    handler.download(str(tmp_path / "downloaded"), BUCKET, "object")
+
+    assert (tmp_path / "downloaded").read_bytes() == data
+    stored = handler.s3_client.get_object(Bucket=BUCKET, Key="object")
+    assert stored["Metadata"] == {"encryption": "aws-encryption-sdk-hsm"}
+    assert size < 16 or data[:16] not in stored["Body"].read()
+
+
+def test_listing(handler, tmp_path):
+    path = tmp_path / "plain"
+    path.write_bytes(b"listed")
+    names = [f"file {i}" for i in range(5)]
+    for name in names:
+        handler.upload(str(path), BUCKET, name)
+
+    assert handler.get_list_containers() == [BUCKET]
+    assert handler.get_list_files(BUCKET) == names
+    pages = list(handler.iter_pages_files(BUCKET, page_size=2))
+    assert pages == [names[0:2], names[2:4], names[4:5]]
+
+
+def test_cached_data_key_is_reused(handler, emulator, tmp_path):
+    keystore = emulator.get_keystore("key17.com")
+    path = tmp_path / "plain"
+    path.write_bytes(b"cached")
+    # One wrap and one unwrap for the data key, served from the caches afterwards
+    handler.upload(str(path), BUCKET, "first")
+    handler.download(str(tmp_path / "downloaded"), BUCKET, "first")
+    commands = keystore.commands
+
+    for i in range(4):
+        handler.upload(str(path), BUCKET, f"next {i}")
+        handler.download(str(tmp_path / "downloaded"), BUCKET, f"next {i}")
+
+    assert keystore.commands == commands
+    assert (tmp_path / "downloaded").read_bytes() == b"cached"
+
+
+def test_tampered_object_is_not_written(handler, tmp_path):
+    path = tmp_path / "plain"
+    path.write_bytes(os.urandom(1000))
+    handler.upload(str(path), BUCKET, "object")
+    stored = handler.s3_client.get_object(Bucket=BUCKET, Key="object")["Body"].read()
+    handler.s3_client.put_object(Bucket=BUCKET, Key="object", Body=stored[:-3] + b"abc")
+
+    downloaded = tmp_path / "downloaded"
+    with pytest.raises(InvalidTag):
+        handler.download(str(downloaded), BUCKET, "object")
+
+    assert not downloaded.exists()
+    assert not (tmp_path / "downloaded.part").exists()
@@ -0,0 +1,67 @@
+import asyncio
+import os
+
+from core.tls.async_hsm_connection import AsyncConnectionWorker
+from core.tls.async_socket_wrapper import AsyncTLSSocketWrapper
+from core.tls.socket_wrapper import TLSConnectionClosed
+
+
+def run_with_wrapper(emulator, test, **options):
+    async def run():
+        wrapper = AsyncTLSSocketWrapper(emulator.host, emulator.port, "key17.com", **options)
+        await wrapper.connect()
+        try:
+            return await test(wrapper)
+        finally:
+            await wrapper.close()
+
+    return asyncio.run(run())
+
+
+def test_concurrent_calls_are_pipelined(emulator):
+    keys = [os.urandom(32) for _ in range(40)]
+
+    async def test(wrapper):
+        cks = await asyncio.gather(*(wrapper.wrap_cek(1, key) for key in keys))
+        return await asyncio.gather(*(wrapper.unwrap_cek(1, ck) for ck in cks))
+
+    assert run_with_wrapper(emulator, test, pipeline_depth=8) == keys
+
+
+def test_idempotent_commands_are_sent_again_after_a_disconnection(start_emulator):
+    emulator = start_emulator(max_commands=7)
+
+    async def test(wrapper):
+        await wrapper.write_record(1, b"kept")
+        return await asyncio.gather(*(wrapper.read_record(1) for _ in range(30)))
+
+    assert run_with_wrapper(emulator, test) == [b"kept"] * 30
+
+
+def test_commands_possibly_executed_are_not_sent_again(start_emulator):
+    emulator = start_emulator(max_commands=2)
+    keystore = emulator.get_keystore("key17.com")
+
+    async def test(wrapper):
+        return await asyncio.gather(
+            *(wrapper.encrypt_AES_binary(1, bytes(16)) for _ in range(3)), return_exceptions=True
+        )
+
+    results = run_with_wrapper(emulator, test)
+
+    assert [type(result) for result in results] == [bytes, bytes, TLSConnectionClosed]
+    assert keystore.commands == 2
+
+
+def test_worker_spreads_the_calls_over_its_sessions(emulator):
+    async def run():
+        worker = AsyncConnectionWorker(emulator.host, emulator.port, "key17.com", pool_size=2)
+        try:
+            await worker.start_worker()
+            await AsyncConnectionWorker.dispatch("key17.com", ("write_record", 3, b"three"))
+            return await asyncio.gather(*(worker.submit(("read_record", 3)) for _ in range(10)))
+        finally:
+            await AsyncConnectionWorker.stop_all()
+            AsyncConnectionWorker.allWorkers.remove(worker)
+
+    assert asyncio.run(run()) == [b"three"] * 10
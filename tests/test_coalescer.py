@@ -0,0 +1,113 @@
+import threading
+import time
+
+from core.request.coalescer import BlockRequestCoalescer, CoalescedRequest
+from core.request.remote import RemoteRequest
+
+
+class Origin:
+    def __init__(self):
+        self.responses = []
+
+    def send(self, data):
+        self.responses.append(bytes(data))
+
+
+class FakeSocketWrapper:
+    """Encrypts by reversing each block."""
+
+    def __init__(self):
+        self.calls = []
+
+    def encrypt_AES_binary(self, index_key, data):
+        self.calls.append((index_key, bytes(data)))
+        return b"".join(data[i : i + 16][::-1] for i in range(0, len(data), 16))
+
+
+class Dispatched(list):
+    def __init__(self):
+        super().__init__()
+        self.event = threading.Event()
+
+    def __call__(self, request):
+        self.append(request)
+        self.event.set()
+
+
+def block_request(blocks, fill, index_key=1, cmd_id=1):
+    origin = Origin()
+    data = bytes(range(fill, fill + 16)) * blocks
+    return RemoteRequest(origin, bytes([cmd_id, 17, index_key]) + data), origin, data
+
+
+def test_requests_of_a_window_are_merged_then_split():
+    dispatched = Dispatched()
+    coalescer = BlockRequestCoalescer(dispatched, window=0.05)
+    requests = [block_request(1, 0), block_request(2, 16), block_request(1, 32)]
+
+    for request, _, _ in requests:
+        coalescer.dispatch(request)
+    assert not dispatched
+    assert dispatched.event.wait(1)
+
+    [merged] = dispatched
+    assert isinstance(merged, CoalescedRequest)
+    wrapper = FakeSocketWrapper()
+    merged.process_request(wrapper)
+    assert wrapper.calls == [(1, b"".join(data for _, _, data in requests))]
+    for _, origin, data in requests:
+        assert origin.responses == [b"\x00" + wrapper.encrypt_AES_binary(1, data)]
+
+
+def test_full_command_is_sent_without_waiting():
+    dispatched = Dispatched()
+    coalescer = BlockRequestCoalescer(dispatched, window=10, max_blocks=4)
+
+    for blocks in (1, 1, 2):
+        coalescer.dispatch(block_request(blocks, 0)[0])
+
+    assert len(dispatched) == 1
+
+
+def test_request_not_fitting_starts_a_new_command():
+    dispatched = Dispatched()
+    coalescer = BlockRequestCoalescer(dispatched, window=0.05, max_blocks=4)
+    first, second = block_request(3, 0)[0], block_request(2, 0)[0]
+
+    coalescer.dispatch(first)
+    coalescer.dispatch(second)
+
+    assert dispatched == [first]  # Alone: not merged
+    time.sleep(0.2)
+    assert dispatched == [first, second]
+
+
+def test_only_block_requests_of_the_same_slot_are_merged():
+    dispatched = Dispatched()
+    coalescer = BlockRequestCoalescer(dispatched, window=0.05)
+    read = RemoteRequest(Origin(), bytes([0, 17, 1]))
+    full = block_request(16, 0)[0]
+
+    coalescer.dispatch(read)
+    coalescer.dispatch(full)
+    assert dispatched == [read, full]
+
+    coalescer.dispatch(block_request(1, 0, index_key=1)[0])
+    coalescer.dispatch(block_request(1, 0, index_key=2)[0])
+    coalescer.dispatch(block_request(1, 0, cmd_id=2)[0])
+    time.sleep(0.2)
+    assert len(dispatched) == 5
+    assert not any(isinstance(request, CoalescedRequest) for request in dispatched)
+
+
+def test_error_is_sent_to_each_request():
+    dispatched = Dispatched()
+    coalescer = BlockRequestCoalescer(dispatched, window=0.01)
+    requests = [block_request(1, i) for i in range(3)]
+    for request, _, _ in requests:
+        coalescer.dispatch(request)
+    assert dispatched.event.wait(1)
+
+    dispatched[0].complete_request(error=ConnectionError("keystore unreachable"))
+
+    assert [origin.responses for _, origin, _ in requests] == [[b"01"]] * 3
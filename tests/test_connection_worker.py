@@ -0,0 +1,104 @@
+import time
+
+import pytest
+
+from core.tls.hsm_connection import ConnectionWorker
+from core.tls.socket_wrapper import CommandErrorResponse
+from core.tools.keystore_emulator import LatencyDistribution
+from core.tools.metrics import REGISTRY
+
+
+def counter(name, **labels):
+    return sum(
+        value for counter_labels, value in REGISTRY.snapshot()["counters"].get(name, [])
+        if labels.items() <= counter_labels.items()
+    )
+
+
+def reconnects(servername):
+    return {
+        reason: counter("keystore_reconnects_total", keystore=servername, reason=reason)
+        for reason in ("requested", "connection_lost")
+    }
+
+
+@pytest.mark.parametrize("keepalive, echo_keeps_alive, expected", [
+    # Reconnected ahead of the next request
+    ("reconnect", False, {"requested": 1, "connection_lost": 0}),
+    # The idle session is dropped, noticed by the next request
+    ("off", False, {"requested": 0, "connection_lost": 1}),
+    ("echo", False, {"requested": 0, "connection_lost": 1}),
+    # Kept alive by the echo probes
+    ("echo", True, {"requested": 0, "connection_lost": 0}),
+])
+def test_keepalive_modes(start_emulator, start_worker, keepalive, echo_keeps_alive, expected):
+    servername = f"{keepalive}-{echo_keeps_alive}.keepalive.test"
+    emulator = start_emulator(idle_timeout=0.5, echo_keeps_alive=echo_keeps_alive)
+    worker = start_worker(emulator, servername, keepalive=keepalive, keepalive_interval=0.2)
+    worker.submit(("write_record", 1, b"alive")).get_response()
+    before = reconnects(servername)
+
+    time.sleep(1)
+    assert worker.submit(("read_record", 1)).get_response() == b"alive"
+
+    after = reconnects(servername)
+    assert {reason: after[reason] - before[reason] for reason in after} == expected
+
+
+@pytest.fixture
+def replicas(start_emulator, start_worker):
+    """Start the replicas "a.hedge.test" and "b.hedge.test", each on its emulator (emulator options)."""
+    def start(*options):
+        keystores = []
+        for servername, emulator_options in zip(["a.hedge.test", "b.hedge.test"], options):
+            emulator = start_emulator(seed=0, **emulator_options)
+            start_worker(emulator, servername)
+            keystores.append(emulator.get_keystore(servername))
+        return keystores
+    return start
+
+
+def test_slow_replica_is_hedged(replicas):
+    a, b = replicas({"latencies": {"read_record": LatencyDistribution("500")}}, {})
+    start = time.monotonic()
+
+    assert ConnectionWorker.dispatch_hedged(["a.hedge.test", "b.hedge.test"], ("read_record", 1), hedge_delay=0.05) == b""
+
+    assert time.monotonic() - start < 0.4
+    assert b.commands == 1
+
+
+def test_fastest_replica_first(replicas):
+    a, b = replicas({"latencies": {"*": LatencyDistribution("50")}}, {})
+    for servername in ["a.hedge.test", "b.hedge.test"]:
+        for _ in range(3):
+            ConnectionWorker.get_worker(servername).submit(("read_record", 1)).get_response()
+
+    ConnectionWorker.dispatch_hedged(["a.hedge.test", "b.hedge.test"], ("read_record", 1), hedge_delay=1)
+
+    assert (a.commands, b.commands) == (3, 4)
+
+
+def test_failed_replica_is_replaced_right_away(replicas):
+    a, b = replicas({"error_rate": 1.0}, {})
+    start = time.monotonic()
+
+    assert ConnectionWorker.dispatch_hedged(["a.hedge.test", "b.hedge.test"], ("read_record", 1), hedge_delay=1) == b""
+
+    assert time.monotonic() - start < 0.5
+    assert (a.commands, b.commands) == (1, 1)
+
+
+def test_every_replica_failed(replicas):
+    replicas({"error_rate": 1.0}, {"error_rate": 1.0})
+
+    with pytest.raises(CommandErrorResponse):
+        ConnectionWorker.dispatch_hedged(["a.hedge.test", "b.hedge.test"], ("read_record", 1), hedge_delay=0.01)
+
+
+def test_no_replica_answers_in_time(replicas):
+    slow = {"latencies": {"*": LatencyDistribution("500")}}
+    replicas(slow, slow)
+
+    with pytest.raises(TimeoutError):
+        ConnectionWorker.dispatch_hedged(["a.hedge.test", "b.hedge.test"], ("read_record", 1), hedge_delay=0.05, timeout=0.2)
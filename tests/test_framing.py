@@ -0,0 +1,75 @@
+import threading
+
+import pytest
+
+from core.request.framing import (
+    FRAME_HEADER, MAX_FRAME_PAYLOAD, FrameDecoder, FramedConnection, FramingError, encode_frame, is_framed
+)
+from core.request.remote import RemoteRequest
+
+
+class CollectingSocket:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data):
+        raise AssertionError("A frame must be sent whole (sendall).")
+
+    def sendall(self, data):
+        self.sent.append(bytes(data))
+
+
+def test_frames_split_across_chunks():
+    frames = [(i * 1000, bytes([i]) * i) for i in range(10)]
+    stream = b"".join(encode_frame(request_id, payload) for request_id, payload in frames)
+    decoder = FrameDecoder()
+
+    decoded = [frame for i in range(len(stream)) for frame in decoder.feed(stream[i : i + 1])]
+
+    assert decoded == frames
+
+
+def test_several_frames_in_one_chunk():
+    decoder = FrameDecoder()
+
+    assert decoder.feed(encode_frame(7, b"seven") + encode_frame(3, b"three") + encode_frame(5, b"five")[:-1]) == [
+        (7, b"seven"), (3, b"three")
+    ]
+    assert decoder.feed(b"e") == [(5, b"five")]
+    assert decoder.feed(b"") == []
+
+
+def test_invalid_frames():
+    with pytest.raises(FramingError):
+        FrameDecoder().feed(b"\x00" + bytes(8))
+    with pytest.raises(FramingError):
+        FrameDecoder().feed(FRAME_HEADER.pack(0xF1, 1, MAX_FRAME_PAYLOAD + 1))
+    with pytest.raises(ValueError):
+        encode_frame(1, bytes(MAX_FRAME_PAYLOAD + 1))
+
+
+def test_legacy_requests_are_not_framed():
+    assert is_framed(encode_frame(1, b"\x00\x11\x01"))
+    assert not is_framed(b"\x00\x11\x01")
+    assert not is_framed(b"")
+
+
+def test_responses_sent_out_of_order_keep_their_request_id():
+    sock = CollectingSocket()
+    connection = FramedConnection(sock)
+    requests = connection.feed(b"".join(encode_frame(100 + i, bytes([0, 17, i])) for i in range(8)))
+    remote_requests = [RemoteRequest(origin, payload) for origin, payload in requests]
+
+    # Completed from several threads, in the reverse order
+    threads = [
+        threading.Thread(target=request.complete_request, args=(f"record {i}".encode(),))
+        for i, request in reversed(list(enumerate(remote_requests)))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    responses = FrameDecoder().feed(b"".join(sock.sent))
+    assert sorted(responses) == [(100 + i, b"\x00" + f"record {i}".encode()) for i in range(8)]
+    assert [request.get_method() for request in remote_requests] == [("read_record", i) for i in range(8)]
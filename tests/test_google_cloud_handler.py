@@ -0,0 +1,49 @@
+import os
+
+import pytest
+import tink
+
+from app.google.cloud_handler import GoogleCloudHandler
+from core.tools.progress import TransferCancelled
+
+
+def cancel_after(limit):
+    def progress(done, total):
+        if done >= limit:
+            raise TransferCancelled()
+    return progress
+
+
+def test_encrypt_file_round_trip(tmp_path):
+    handler = GoogleCloudHandler(key_provider=None)
+    key = os.urandom(32)
+    path, ciphertext_path = tmp_path / "plain", tmp_path / "ciphertext"
+    data = os.urandom(3 * 1024 * 1024 + 7)
+    path.write_bytes(data)
+
+    handler.encrypt_file(str(path), key, str(ciphertext_path))
+
+    cipher = handler._GoogleCloudHandler__get_tink_streaming_primitive(key)
+    with open(ciphertext_path, "rb") as f, cipher.new_decrypting_stream(f, b"") as decrypting_stream:
+        assert decrypting_stream.read() == data
+
+
+def open_paths():
+    return {os.path.realpath(os.path.join("/proc/self/fd", fd)) for fd in os.listdir("/proc/self/fd")}
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="lists the open files with /proc")
+def test_cancelled_encrypt_file_closes_an_invalid_ciphertext(tmp_path):
+    handler = GoogleCloudHandler(key_provider=None)
+    key = os.urandom(32)
+    path, ciphertext_path = tmp_path / "plain", tmp_path / "ciphertext"
+    path.write_bytes(os.urandom(3 * 1024 * 1024))
+
+    with pytest.raises(TransferCancelled):
+        handler.encrypt_file(str(path), key, str(ciphertext_path), cancel_after(1024 * 1024))
+
+    assert str(ciphertext_path) not in open_paths()
+    cipher = handler._GoogleCloudHandler__get_tink_streaming_primitive(key)
+    with pytest.raises(tink.TinkError):
+        with open(ciphertext_path, "rb") as f, cipher.new_decrypting_stream(f, b"") as decrypting_stream:
+            decrypting_stream.read()
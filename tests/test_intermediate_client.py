@@ -0,0 +1,106 @@
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+from core.client.async_intermediate_client import AsyncIntermediateClient
+from core.client.intermediate_client import IntermediateClient, ServerErrorResponse
+from core.request.framing import FramedConnection
+
+SILENT_RECORD = 99  # Never answered
+SLOW_RECORD = 98  # Answered after 0.3 s
+
+
+class FakeIntermediateServer:
+    """
+    Framed intermediate server answering read_record requests with b"record <n>",
+    the requests received together being answered in the reverse order.
+    """
+
+    def __init__(self):
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self.__accept, daemon=True).start()
+
+    def __accept(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.__serve, args=(conn,), daemon=True).start()
+
+    def __serve(self, conn):
+        framed = FramedConnection(conn)
+        with conn:
+            while data := conn.recv(65536):
+                for origin, payload in reversed(framed.feed(data)):
+                    cmd_id, _, record = payload[:3]
+                    if cmd_id != 0:
+                        origin.send(b"01")
+                    elif record == SLOW_RECORD:
+                        threading.Timer(0.3, origin.send, [b"\x00late"]).start()
+                    elif record != SILENT_RECORD:
+                        origin.send(b"\x00" + f"record {record}".encode())
+
+    def close(self):
+        self.listener.close()
+
+
+@pytest.fixture
+def server():
+    server = FakeIntermediateServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def client(server):
+    with IntermediateClient("127.0.0.1", server.port, pool_size=1, timeout=0.1) as client:
+        yield client
+
+
+def outstanding(client):
+    return sum(connection.outstanding for connection in client._IntermediateClient__connections)
+
+
+def test_pipelined_responses_out_of_order(client):
+    futures = [client.submit(*client.read_record_request("key17.com", i)) for i in range(20)]
+
+    assert [future.result(1) for future in futures] == [f"record {i}".encode() for i in range(20)]
+    assert outstanding(client) == 0
+
+
+def test_error_response(client):
+    with pytest.raises(ServerErrorResponse):
+        client.encrypt_AES_binary("key17.com", 1, bytes(16))
+
+
+def test_timed_out_request_is_forgotten(client):
+    with pytest.raises(TimeoutError):
+        client.read_record("key17.com", SILENT_RECORD)
+
+    assert outstanding(client) == 0
+
+
+def test_late_response_is_ignored(client):
+    with pytest.raises(TimeoutError):
+        client.read_record("key17.com", SLOW_RECORD)
+    time.sleep(0.4)
+
+    assert client.read_record("key17.com", 1) == b"record 1"
+    assert outstanding(client) == 0
+
+
+def test_async_timed_out_request_is_forgotten(server):
+    async def run():
+        async with AsyncIntermediateClient("127.0.0.1", server.port, pool_size=1, timeout=0.1) as client:
+            with pytest.raises(TimeoutError):
+                await client.read_record("key17.com", SILENT_RECORD)
+            await asyncio.sleep(0)
+            assert client._AsyncIntermediateClient__connections[0].outstanding == 0
+            assert await client.read_record("key17.com", 2) == b"record 2"
+
+    asyncio.run(run())
@@ -0,0 +1,187 @@
+import os
+import threading
+import time
+
+import pytest
+
+from app.azure.key_provider import AzureKEKProvider
+from app.google.key_provider import KEKProvider
+from core.tools import key_cache
+from core.tools.key_cache import UnwrappedKeyCache
+from core.tools.read_config import read_unwrap_cache_config
+
+
+class CountingUnwrap:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, wrapped):
+        self.calls.append(bytes(wrapped))
+        return b"key of " + bytes(wrapped)
+
+
+def test_miss_then_hit():
+    cache, unwrap = UnwrappedKeyCache(), CountingUnwrap()
+
+    assert cache.get_or_unwrap(b"ck1", unwrap, "key17.com/1") == b"key of ck1"
+    assert cache.get_or_unwrap(b"ck1", unwrap, "key17.com/1") == b"key of ck1"
+    assert unwrap.calls == [b"ck1"]
+
+
+def test_keys_are_cached_per_wrapped_key_and_context():
+    cache, unwrap = UnwrappedKeyCache(), CountingUnwrap()
+
+    cache.get_or_unwrap(b"ck1", unwrap, "key17.com/1")
+    cache.get_or_unwrap(b"ck2", unwrap, "key17.com/1")
+    cache.get_or_unwrap(b"ck1", unwrap, "key17.com/2")
+
+    assert unwrap.calls == [b"ck1", b"ck2", b"ck1"]
+    assert len(cache) == 3
+
+
+def test_expired_keys_are_unwrapped_again(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(key_cache.time, "monotonic", lambda: now[0])
+    cache, unwrap = UnwrappedKeyCache(ttl=10), CountingUnwrap()
+
+    cache.get_or_unwrap(b"ck1", unwrap)
+    now[0] += 9
+    cache.get_or_unwrap(b"ck1", unwrap)
+    now[0] += 2
+    cache.get_or_unwrap(b"ck1", unwrap)
+
+    assert unwrap.calls == [b"ck1", b"ck1"]
+
+
+def test_least_recently_used_key_is_evicted():
+    cache, unwrap = UnwrappedKeyCache(max_entries=2), CountingUnwrap()
+
+    cache.get_or_unwrap(b"ck1", unwrap)
+    cache.get_or_unwrap(b"ck2", unwrap)
+    cache.get_or_unwrap(b"ck1", unwrap)  # ck2 is now the least recently used
+    cache.get_or_unwrap(b"ck3", unwrap)
+    cache.get_or_unwrap(b"ck1", unwrap)
+    cache.get_or_unwrap(b"ck2", unwrap)
+
+    assert unwrap.calls == [b"ck1", b"ck2", b"ck3", b"ck2"]
+    assert len(cache) == 2
+
+
+def test_failures_are_not_cached():
+    cache, unwrap = UnwrappedKeyCache(), CountingUnwrap()
+
+    def failing(wrapped):
+        raise ConnectionError("HSM unreachable")
+
+    with pytest.raises(ConnectionError):
+        cache.get_or_unwrap(b"ck1", failing)
+    assert cache.get_or_unwrap(b"ck1", unwrap) == b"key of ck1"
+    assert unwrap.calls == [b"ck1"]
+
+
+def test_concurrent_misses_are_merged():
+    cache, unwrap = UnwrappedKeyCache(), CountingUnwrap()
+    release = threading.Event()
+
+    def slow_unwrap(wrapped):
+        release.wait(5)
+        return unwrap(wrapped)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_unwrap(b"ck1", slow_unwrap)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == [b"key of ck1"] * 4
+    assert unwrap.calls == [b"ck1"]
+
+
+@pytest.mark.parametrize("section, expected", [
+    ("", None),
+    ("unwrap_cache: false\n", None),
+    ("unwrap_cache: true\n", {}),
+    ("unwrap_cache:\n  max_entries: 16\n  ttl: 60\n", {"max_entries": 16, "ttl": 60}),
+])
+def test_read_unwrap_cache_config(tmp_path, section, expected):
+    path = tmp_path / "config.yaml"
+    path.write_text("servers: {}\n" + section)
+
+    assert read_unwrap_cache_config(str(path)) == expected
+
+
+def test_read_unwrap_cache_config_rejects_unknown_settings(tmp_path):
+    path = tmp_path / "config.yaml"
+    path.write_text("servers: {}\nunwrap_cache:\n  size: 16\n")
+
+    with pytest.raises(ValueError):
+        read_unwrap_cache_config(str(path))
+
+
+@pytest.mark.parametrize("provider", [KEKProvider, AzureKEKProvider])
+def test_connect_enables_the_configured_cache(tmp_path, monkeypatch, provider):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(provider, "unwrap_cache", None)
+    (tmp_path / "config.yaml").write_text("servers: {}\nunwrap_cache:\n  max_entries: 16\n  ttl: 60\n")
+
+    provider.connect()
+
+    assert provider.unwrap_cache.max_entries == 16
+    assert provider.unwrap_cache.ttl == 60
+
+
+def test_provider_queries_the_hsm_on_misses_only(emulator, start_worker, monkeypatch):
+    start_worker(emulator, "key17.com")
+    keystore = emulator.get_keystore("key17.com")
+    monkeypatch.setattr(KEKProvider, "unwrap_cache", None)
+    KEKProvider.enable_unwrap_cache()
+    key1, key2 = os.urandom(32), os.urandom(32)
+    wrapped1, wrapped2 = KEKProvider.wrap_key(key1), KEKProvider.wrap_key(key2)
+
+    commands = keystore.commands
+    assert KEKProvider.unwrap_key(wrapped1) == key1
+    assert keystore.commands == commands + 1
+    assert KEKProvider.unwrap_key(wrapped1) == key1
+    assert keystore.commands == commands + 1
+    assert KEKProvider.unwrap_key(wrapped2) == key2
+    assert keystore.commands == commands + 2
+
+
+def test_interrupted_unwrap_releases_the_waiting_callers():
+    cache, unwrap = UnwrappedKeyCache(), CountingUnwrap()
+    started, release = threading.Event(), threading.Event()
+
+    def interrupted(wrapped):
+        started.set()
+        release.wait(5)
+        raise KeyboardInterrupt
+
+    def leader():
+        with pytest.raises(KeyboardInterrupt):
+            cache.get_or_unwrap(b"ck1", interrupted)
+
+    errors = []
+
+    def waiter():
+        try:
+            cache.get_or_unwrap(b"ck1", unwrap)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=leader, daemon=True)]
+    threads[0].start()
+    started.wait(5)
+    threads.append(threading.Thread(target=waiter, daemon=True))
+    threads[1].start()
+    time.sleep(0.05)  # The waiter waits for the leader's unwrap
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert len(errors) == 1
+    assert cache.get_or_unwrap(b"ck1", unwrap) == b"key of ck1"
+    assert unwrap.calls == [b"ck1"]
@@ -0,0 +1,121 @@
+import hashlib
+import io
+import random
+import time
+
+import pytest
+from Crypto.Cipher import AES
+
+from core.tools.keystore_emulator import parse_command
+from core.tls.socket_wrapper import TLSConnectionClosed
+
+
+def emulator_key(servername, slot):
+    """Test key of a slot of the emulator."""
+    return hashlib.sha256(f"{servername}/{slot}".encode("utf-8")).digest()[:16]
+
+
+def random_payload(rng, blocks):
+    # At least a "\n" at a block boundary followed by the start of a command: what broke the framing
+    data = bytearray(rng.randbytes(16 * blocks))
+    if blocks > 1:
+        boundary = 16 * rng.randrange(1, blocks)
+        data[boundary - 1 : boundary + 1] = b"\nA"
+    return bytes(data)
+
+
+def test_parse_command_takes_the_whole_record():
+    payload = b"\n" * 15 + b"\nAc1" + b"\n" * 13  # 2 blocks
+
+    assert parse_command(b"Ac1" + payload + b"\n") == ("encrypt_AES_binary", b"Ac1" + payload)
+    assert parse_command(b"?01echo\n") == ("echo", b"?01echo")
+    assert parse_command(b"X01\n") == (None, b"X01")
+    assert parse_command(b"ac2" + bytes(16)) == (None, b"ac2" + bytes(16))  # Without terminator
+
+
+def test_pipelined_random_binary_commands(emulator, connect):
+    wrapper = connect(emulator)
+    rng = random.Random(0)
+    for _ in range(50):
+        payloads = [(rng.randrange(4), rng.choice((True, False)), random_payload(rng, rng.randint(1, 16)))
+                    for _ in range(32)]
+        commands = [
+            wrapper.decrypt_AES_binary_command(slot, data) if decrypt else wrapper.encrypt_AES_binary_command(slot, data)
+            for slot, decrypt, data in payloads
+        ]
+
+        responses = wrapper.execute_many(commands)
+
+        for (slot, decrypt, data), response in zip(payloads, responses):
+            cipher = AES.new(emulator_key("key17.com", slot), AES.MODE_ECB)
+            assert response == (cipher.decrypt(data) if decrypt else cipher.encrypt(data))
+
+
+def test_command_without_terminator_is_answered_error(emulator, connect):
+    wrapper = connect(emulator)
+
+    assert wrapper.send_command(b"Ac1" + bytes(16)) == b"ERROR"
+    assert wrapper.encrypt_AES_binary(1, bytes(16)) == AES.new(emulator_key("key17.com", 1), AES.MODE_ECB).encrypt(bytes(16))
+
+
+def test_idle_session_is_dropped_on_the_next_command(start_emulator, connect):
+    emulator = start_emulator(idle_timeout=0.2)
+    wrapper = connect(emulator, ensure_connected_before_send=False)
+    wrapper.read_record(1)
+    time.sleep(0.3)
+
+    wrapper.echo("still answered")
+    with pytest.raises(TLSConnectionClosed):
+        wrapper.read_record(1)
+
+
+def test_echo_keeps_alive_only_if_enabled(start_emulator, connect):
+    for echo_keeps_alive in (False, True):
+        emulator = start_emulator(idle_timeout=0.3, echo_keeps_alive=echo_keeps_alive)
+        wrapper = connect(emulator, ensure_connected_before_send=False)
+        wrapper.read_record(1)
+        for _ in range(3):
+            time.sleep(0.15)
+            wrapper.echo("keepalive")
+
+        if echo_keeps_alive:
+            wrapper.read_record(1)
+        else:
+            with pytest.raises(TLSConnectionClosed):
+                wrapper.read_record(1)
+
+
+def test_stream_round_trip(emulator, start_worker):
+    worker = start_worker(emulator, pool_size=2)
+    data = random.Random(1).randbytes(64 * 1024 + 5)
+
+    encrypted = b"".join(worker.encrypt_stream(1, io.BytesIO(data)))
+    decrypted = b"".join(worker.decrypt_stream(1, io.BytesIO(encrypted)))
+
+    assert decrypted == data
+    assert encrypted[:16] == AES.new(emulator_key("key17.com", 1), AES.MODE_ECB).encrypt(data[:16])
+
+
+@pytest.mark.parametrize("size", [0, 15, 16, 256, 1000])
+@pytest.mark.parametrize("mode", ["ECB", "CTR"])
+def test_wrapper_stream_round_trip(emulator, connect, mode, size):
+    wrapper = connect(emulator)
+    data = random.Random(size).randbytes(size)
+    iv = bytes(15) + b"\xff" if mode == "CTR" else None
+
+    encrypted = b"".join(wrapper.encrypt_stream(1, io.BytesIO(data), mode, iv, window=2))
+    decrypted = b"".join(wrapper.decrypt_stream(1, [encrypted[i : i + 100] for i in range(0, len(encrypted), 100)], mode, iv))
+
+    assert decrypted == data
+    key = emulator_key("key17.com", 1)
+    if mode == "CTR":
+        assert encrypted == AES.new(key, AES.MODE_CTR, nonce=b"", initial_value=iv).encrypt(data)
+    else:
+        assert len(encrypted) == (size // 16 + 1) * 16
+
+
+def test_stream_with_invalid_padding(emulator, connect):
+    wrapper = connect(emulator)
+
+    with pytest.raises(ValueError):
+        b"".join(wrapper.decrypt_stream(1, io.BytesIO(wrapper.encrypt_AES_binary(1, bytes(16)))))
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from core.tls.keystream_pool import KeystreamPool
+from core.tls.socket_wrapper import CommandErrorResponse
+
+
+@pytest.fixture
+def pooled(emulator, connect):
+    """A session to the emulator with a keystream pool of slot 1 holding 16 entries."""
+    wrapper = connect(emulator)
+    wrapper.keystream_pool = KeystreamPool([1], low_watermark=8, high_watermark=16)
+    assert wrapper.keystream_pool.refill(wrapper) == 16
+    return wrapper
+
+
+def test_wrapped_keys_are_unwrapped_by_the_keystore(pooled):
+    key = os.urandom(32)
+
+    ck = pooled.wrap_cek(1, key)
+
+    assert len(pooled.keystream_pool) == 15
+    assert pooled.unwrap_cek(1, ck) == key
+
+
+def test_invalid_key_does_not_consume_entries(pooled):
+    with pytest.raises(ValueError):
+        pooled.wrap_cek_command(1, bytes(31))
+
+    assert len(pooled.keystream_pool) == 16
+
+
+def test_set_key_command_not_sent_keeps_the_entries(pooled):
+    pooled.set_AES_key_command(1, os.urandom(16))
+
+    assert len(pooled.keystream_pool) == 16
+
+
+def test_refused_set_key_keeps_the_entries(pooled):
+    with pytest.raises(CommandErrorResponse):
+        pooled.set_AES_key(1, os.urandom(5))  # Invalid AES key length
+
+    assert len(pooled.keystream_pool) == 16
+    key = os.urandom(32)
+    assert pooled.unwrap_cek(1, pooled.wrap_cek(1, key)) == key
+
+
+def test_acknowledged_set_key_clears_the_entries(pooled):
+    pooled.set_AES_key(1, os.urandom(16))
+
+    assert len(pooled.keystream_pool) == 0
+    key = os.urandom(32)
+    assert pooled.unwrap_cek(1, pooled.wrap_cek(1, key)) == key
+
+
+def test_key_changed_by_another_client_drops_the_entries(pooled, emulator, connect, monkeypatch):
+    connect(emulator).set_AES_key(1, os.urandom(16))
+    monkeypatch.setattr(pooled.keystream_pool, "check_interval", 0)
+
+    assert pooled.keystream_pool.take(1) is None
+    assert pooled.keystream_pool.needs_refill()
+    assert pooled.keystream_pool.refill(pooled) == 0
+    assert len(pooled.keystream_pool) == 0
+    assert pooled.keystream_pool.refill(pooled) == 16
+    key = os.urandom(32)
+    assert pooled.unwrap_cek(1, pooled.wrap_cek(1, key)) == key
+
+
+def test_entries_are_used_again_after_a_check(pooled, monkeypatch):
+    monkeypatch.setattr(pooled.keystream_pool, "check_interval", 0)
+    assert pooled.keystream_pool.take(1) is None
+    monkeypatch.setattr(pooled.keystream_pool, "check_interval", 5)
+
+    assert pooled.keystream_pool.needs_refill()
+    assert pooled.keystream_pool.refill(pooled) == 0
+    assert not pooled.keystream_pool.needs_refill()
+    assert len(pooled.keystream_pool.take(1)) == 1
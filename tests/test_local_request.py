@@ -0,0 +1,98 @@
+import concurrent.futures
+import queue
+import time
+
+import pytest
+
+from core.request.local import LocalRequest
+from core.tools.keystore_emulator import LatencyDistribution
+
+
+class FakeSocketWrapper:
+    def __init__(self):
+        self.records = []
+
+    def read_record(self, record_number):
+        self.records.append(record_number)
+        if record_number < 0:
+            raise ValueError("Invalid record.")
+        return f"record {record_number}".encode()
+
+
+def test_response_and_response_queue():
+    responses = queue.Queue()
+    request = LocalRequest("key17.com", ("read_record", 1), response_queue=responses)
+
+    request.process_request(FakeSocketWrapper())
+
+    assert request.get_response() == b"record 1"
+    assert responses.get_nowait() is request
+
+
+def test_error_is_raised_to_the_caller():
+    request = LocalRequest("key17.com", ("read_record", -1))
+
+    request.process_request(FakeSocketWrapper())
+
+    with pytest.raises(ValueError):
+        request.get_response()
+
+
+def test_cancelled_request_is_not_sent():
+    wrapper = FakeSocketWrapper()
+    request = LocalRequest("key17.com", ("read_record", 1))
+
+    assert request.cancel()
+    request.process_request(wrapper)
+
+    assert wrapper.records == []
+    with pytest.raises(concurrent.futures.CancelledError):
+        request.get_response()
+
+
+def test_expired_request_is_not_sent():
+    wrapper = FakeSocketWrapper()
+    request = LocalRequest("key17.com", ("read_record", 1), timeout=0.01)
+    time.sleep(0.02)
+
+    request.process_request(wrapper)
+
+    assert wrapper.records == []
+    with pytest.raises(TimeoutError):
+        request.get_response()
+
+
+def test_default_timeout_cancels_the_request(monkeypatch):
+    monkeypatch.setattr(LocalRequest, "DEFAULT_TIMEOUT", 0.05)
+    wrapper = FakeSocketWrapper()
+    request = LocalRequest("key17.com", ("read_record", 1))
+
+    with pytest.raises(TimeoutError):
+        request.get_response()
+    request.process_request(wrapper)
+
+    assert request.cancelled()
+    assert wrapper.records == []
+
+
+def test_deadline_bounds_the_wait():
+    request = LocalRequest("key17.com", ("read_record", 1), timeout=0.05)
+    start = time.monotonic()
+
+    with pytest.raises(TimeoutError):
+        request.get_response()
+
+    assert time.monotonic() - start < LocalRequest.DEFAULT_TIMEOUT
+
+
+def test_requests_are_futures(start_emulator, start_worker):
+    emulator = start_emulator(latencies={"read_record": LatencyDistribution("20")})
+    worker = start_worker(emulator)
+    requests = [worker.submit(("read_record", i)) for i in range(4)]
+    worker.submit(("write_record", 5, b"five")).get_response()
+
+    done, not_done = concurrent.futures.wait(requests, timeout=LocalRequest.DEFAULT_TIMEOUT)
+
+    assert not not_done
+    assert [request.result() for request in requests] == [b""] * 4
+    assert worker.submit(("read_record", 5)).get_response() == b"five"
@@ -0,0 +1,48 @@
+import inspect
+
+import yaml
+
+from core.tools.read_config import KEYSTORE_OPTIONS, readconfig
+from core.tls.hsm_connection import ConnectionWorker
+from core.tls.async_hsm_connection import AsyncConnectionWorker
+
+# A value of each option, as documented in the README
+OPTION_VALUES = {
+    "pool_size": 4,
+    "pipeline_depth": 16,
+    "keepalive": "reconnect",
+    "keepalive_interval": 25,
+    "session_resumption": True,
+    "keystream_slots": [1],
+    "keystream_low_watermark": 64,
+    "keystream_high_watermark": 256,
+    "keystream_check_interval": 5,
+    "queue_limits": {"interactive": 1024, "bulk": 8192},
+    "starvation_limit": 32,
+}
+
+
+def test_option_values_cover_every_option():
+    assert set(OPTION_VALUES) == set(KEYSTORE_OPTIONS)
+
+
+def test_readconfig_reads_every_option(tmp_path):
+    keystore = dict(OPTION_VALUES, servername="key17.com", psk="00" * 16)
+    path = tmp_path / "config.yaml"
+    path.write_text(yaml.safe_dump({"servers": {"server1": {"host": "127.0.0.1", "port": 4433, "keystores": [keystore]}}}))
+
+    [(host, port, servername, psk, options)] = readconfig(str(path))
+
+    assert (host, port, servername, psk) == ("127.0.0.1", 4433, "key17.com", bytes(16))
+    assert options == OPTION_VALUES
+
+
+def test_connection_worker_accepts_every_option():
+    parameters = inspect.signature(ConnectionWorker.__init__).parameters
+    assert set(KEYSTORE_OPTIONS) <= set(parameters)
+
+
+def test_async_worker_options_are_supported():
+    parameters = inspect.signature(AsyncConnectionWorker.__init__).parameters
+    assert set(AsyncConnectionWorker.OPTIONS) <= set(parameters)
+    assert set(AsyncConnectionWorker.OPTIONS) <= set(KEYSTORE_OPTIONS)
@@ -0,0 +1,107 @@
+import queue
+import threading
+import time
+
+import pytest
+
+from core.request.local import LocalRequest
+from core.tls.request_scheduler import RequestScheduler
+
+
+def request(name, priority="interactive", timeout=None):
+    r = LocalRequest("key17.com", ("echo", name), timeout=timeout, priority=priority)
+    r.name = name
+    return r
+
+
+def names(entries):
+    return [r.name for r, enqueued_at in entries]
+
+
+def put_all(scheduler, requests):
+    for r in requests:
+        scheduler.put(r)
+    return requests
+
+
+def test_interactive_requests_first():
+    scheduler = RequestScheduler()
+    put_all(scheduler, [request("b1", "bulk"), request("i1"), request("b2", "bulk"), request("i2")])
+
+    assert names(scheduler.take(4)) == ["i1", "i2", "b1", "b2"]
+
+
+def test_earliest_deadline_first():
+    scheduler = RequestScheduler()
+    put_all(scheduler, [request("none1"), request("late", timeout=30), request("soon", timeout=10), request("none2")])
+
+    assert names(scheduler.take(4)) == ["soon", "late", "none1", "none2"]
+
+
+def test_bulk_requests_are_not_starved():
+    scheduler = RequestScheduler(starvation_limit=2)
+    put_all(scheduler, [request(f"b{i}", "bulk") for i in range(2)] + [request(f"i{i}") for i in range(5)])
+
+    assert names(scheduler.take(7)) == ["i0", "i1", "b0", "i2", "i3", "b1", "i4"]
+
+
+def test_full_class_rejects_new_requests():
+    scheduler = RequestScheduler({"interactive": 2})
+    put_all(scheduler, [request("i1"), request("i2")])
+
+    with pytest.raises(queue.Full):
+        scheduler.put(request("i3"))
+    scheduler.put(request("b1", "bulk"))  # The other class is not full
+    assert scheduler.depth("interactive") == 2
+    assert scheduler.depth() == 3
+
+
+def test_dead_requests_are_purged_when_full():
+    dropped = []
+    scheduler = RequestScheduler({"interactive": 2}, on_drop=lambda r, enqueued_at: dropped.append(r))
+    cancelled, expired = put_all(scheduler, [request("cancelled"), request("expired", timeout=0.01)])
+    cancelled.cancel()
+    time.sleep(0.02)
+
+    scheduler.put(request("new"))
+
+    assert sorted(r.name for r in dropped) == ["cancelled", "expired"]
+    assert names(scheduler.take(2)) == ["new"]
+
+
+def test_take_waits_for_a_request():
+    scheduler = RequestScheduler()
+    assert scheduler.take(1, timeout=0.01) == []
+
+    threading.Timer(0.05, scheduler.put, [request("late")]).start()
+
+    assert names(scheduler.take(1, timeout=1)) == ["late"]
+
+
+def test_close_wakes_the_sessions_and_returns_the_waiting_requests():
+    scheduler = RequestScheduler()
+    taken = []
+    session = threading.Thread(target=lambda: taken.append(scheduler.take(1)))
+    session.start()
+    time.sleep(0.05)
+    scheduler.close()
+    session.join(1)
+    assert taken == [[]]
+
+    waiting = put_all(scheduler, [request("i1")])
+    assert [entry[0] for entry in scheduler.close()] == waiting
+    assert scheduler.take(1, timeout=0) == []
+
+    scheduler.reopen()
+    scheduler.put(request("i2"))
+    assert names(scheduler.take(1)) == ["i2"]
+
+
+@pytest.mark.parametrize("options", [
+    {"limits": {"urgent": 10}},
+    {"limits": {"bulk": 0}},
+    {"starvation_limit": 0},
+])
+def test_invalid_settings(options):
+    with pytest.raises(ValueError):
+        RequestScheduler(**options)
@@ -0,0 +1,59 @@
+import pytest
+
+from core.tls.socket_wrapper import CommandUnexpectedResponse, ResponseReader, TLSConnectionClosed
+
+
+class ChunkedSocket:
+    """Socket returning the given bytes a few at a time, like TLS records."""
+
+    def __init__(self, data: bytes, chunk: int):
+        self.data = data
+        self.chunk = chunk
+
+    def recv_into(self, buffer):
+        size = min(len(buffer), self.chunk, len(self.data))
+        buffer[:size] = self.data[:size]
+        self.data = self.data[size:]
+        return size
+
+
+@pytest.mark.parametrize("chunk", [1, 5, 7, 16])
+def test_responses_across_compactions(chunk):
+    # Responses longer than half of the buffer: each compaction moves overlapping bytes
+    responses = [bytes([65 + i % 26]) * (9 + i % 4) for i in range(50)]
+    reader = ResponseReader(ChunkedSocket(b"".join(response + b"\n" for response in responses), chunk), buffer_size=16)
+
+    for response in responses:
+        assert bytes(reader.read_response()) == response
+
+
+def test_binary_responses_across_compactions():
+    responses = [bytes(range(i, i + 12)).replace(b"\n", b"\x00") for i in range(40)]
+    data = b"".join(response + b"\n" for response in responses)
+    reader = ResponseReader(ChunkedSocket(data, 5), buffer_size=16)
+
+    for response in responses:
+        assert bytes(reader.read_response(12)) == response
+
+
+def test_response_longer_than_the_buffer():
+    responses = [b"a" * 40, b"ERROR", b"b" * 16]
+    reader = ResponseReader(ChunkedSocket(b"a" * 40 + b"\nERROR\n" + b"b" * 16 + b"\n", 7), buffer_size=16)
+
+    assert bytes(reader.read_response()) == responses[0]
+    assert bytes(reader.read_response(16)) == responses[1]
+    assert bytes(reader.read_response(16)) == responses[2]
+
+
+def test_binary_response_without_terminator():
+    reader = ResponseReader(ChunkedSocket(b"x" * 16 + b"y", 32), buffer_size=64)
+
+    with pytest.raises(CommandUnexpectedResponse):
+        reader.read_response(16)
+
+
+def test_closed_connection():
+    reader = ResponseReader(ChunkedSocket(b"partial", 32))
+
+    with pytest.raises(TLSConnectionClosed):
+        reader.read_response()
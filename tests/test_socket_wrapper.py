@@ -0,0 +1,179 @@
+import time
+
+import pytest
+
+from core.tls.socket_wrapper import CommandErrorResponse, TLSConnectionClosed, TLSReconnectFailed
+from core.tools.keystore_emulator import LatencyDistribution
+from core.tools.metrics import REGISTRY
+
+
+def bytes_sent(servername="key17.com"):
+    counters = REGISTRY.snapshot()["counters"].get("keystore_bytes_sent_total", [])
+    return sum(value for labels, value in counters if labels == {"keystore": servername})
+
+
+def test_pipelined_responses_are_in_order(emulator, connect):
+    wrapper = connect(emulator)
+    commands = []
+    for i in range(8):
+        commands.append(wrapper.write_record_command(1, f"value {i}".encode("utf-8")))
+        commands.append(wrapper.read_record_command(1))
+        commands.append(wrapper.encrypt_AES_binary_command(1, bytes([i]) * 16))
+    commands.append(wrapper.echo_command("last"))
+
+    results = wrapper.execute_many(commands)
+
+    for i in range(8):
+        ok, record, encrypted = results[3 * i : 3 * i + 3]
+        assert ok is None
+        assert record == f"value {i}".encode("utf-8")
+        assert wrapper.decrypt_AES_binary(1, encrypted) == bytes([i]) * 16
+
+
+def test_error_responses_in_the_middle_of_a_pipeline(emulator, connect):
+    wrapper = connect(emulator)
+    wrapper.write_record(2, b"kept")
+    unknown_record = wrapper.read_record_command(2)
+    unknown_record.data = b"I99\n"  # The keystore has no such record
+    unknown_slot = wrapper.encrypt_AES_binary_command(1, bytes(32))
+    unknown_slot.data = unknown_slot.data.replace(b"Ac1", b"Ac9")  # Nor such key slot: "ERROR" instead of 32 bytes
+
+    results = wrapper.execute_many(
+        [
+            wrapper.read_record_command(2),
+            unknown_record,
+            wrapper.encrypt_AES_binary_command(1, bytes(32)),
+            unknown_slot,
+            wrapper.read_record_command(2),
+        ],
+        return_exceptions=True,
+    )
+
+    assert results[0] == results[4] == b"kept"
+    assert isinstance(results[1], CommandErrorResponse)
+    assert isinstance(results[3], CommandErrorResponse)
+    assert results[2] == wrapper.encrypt_AES_binary(1, bytes(32))
+
+    # The first error is raised once every response was read: the session stays usable
+    with pytest.raises(CommandErrorResponse):
+        wrapper.execute_many([unknown_record, wrapper.read_record_command(2)])
+    assert wrapper.read_record(2) == b"kept"
+
+
+def test_reconnection_resends_only_the_unanswered_commands(start_emulator, connect):
+    emulator = start_emulator(max_commands=6)
+    wrapper = connect(emulator)
+    commands = [wrapper.echo_command(f"message {i}") for i in range(10)]
+    commands.append(wrapper.read_record_command(1))
+
+    wrapper.execute_many(commands)
+
+    # 6 commands answered before the session was closed, the other 5 (idempotent) after the reconnection
+    assert emulator.get_keystore("key17.com").commands == 11
+    assert wrapper.commands_since_connect == 5
+
+
+def test_commands_possibly_executed_are_not_sent_again(start_emulator, connect):
+    emulator = start_emulator(max_commands=2)
+    wrapper = connect(emulator)
+    commands = [wrapper.echo_command("first"), wrapper.read_record_command(1), wrapper.write_record_command(1, b"once")]
+
+    with pytest.raises(TLSConnectionClosed):
+        wrapper.execute_many(commands)
+
+    assert emulator.get_keystore("key17.com").commands == 2
+    # The next command opens a new session
+    assert wrapper.read_record(1) == b""
+
+
+def test_commands_of_a_dropped_idle_session_are_sent_again(start_emulator, connect):
+    emulator = start_emulator(idle_timeout=0.2)
+    wrapper = connect(emulator)
+    wrapper.write_record(1, b"first")
+    time.sleep(0.3)
+
+    # Dropped before any answer: nothing was executed
+    wrapper.execute_many([wrapper.write_record_command(1, b"second"), wrapper.read_record_command(1)])
+
+    assert emulator.get_keystore("key17.com").commands == 3
+    assert wrapper.read_record(1) == b"second"
+
+
+def test_timeout_is_raised_without_sending_again(start_emulator, connect):
+    emulator = start_emulator(latencies={"write_record": LatencyDistribution("300")})
+    wrapper = connect(emulator)
+    wrapper._TLSSocketWrapper__ssock.settimeout(0.1)
+
+    with pytest.raises(TimeoutError):
+        wrapper.write_record(1, b"slow")
+
+    time.sleep(0.3)
+    assert emulator.get_keystore("key17.com").commands == 1
+    assert wrapper.read_record(1) == b"slow"
+
+
+def test_bytes_sent_count_each_command_once_per_send(start_emulator, connect):
+    emulator = start_emulator(max_commands=6)
+    wrapper = connect(emulator)
+    commands = [wrapper.echo_command(f"message {i}") for i in range(10)]
+    before = bytes_sent()
+
+    wrapper.execute_many(commands)
+
+    # The whole pipeline, then the 4 commands resent after the reconnection
+    sent = sum(len(command.data) for command in commands) + sum(len(command.data) for command in commands[6:])
+    assert bytes_sent() - before == sent
+
+
+def test_reconnection_fails_when_the_new_session_is_closed_too(start_emulator, connect):
+    emulator = start_emulator(max_commands=2)
+    wrapper = connect(emulator)
+
+    with pytest.raises(TLSReconnectFailed):
+        wrapper.execute_many([wrapper.echo_command(f"message {i}") for i in range(5)])
+
+
+def test_failed_sends_are_not_counted(emulator, connect):
+    wrapper = connect(emulator, ensure_connected_before_send=False)
+    wrapper._close_socket()
+    before = bytes_sent()
+
+    with pytest.raises(TLSConnectionClosed):
+        wrapper.execute_many([wrapper.echo_command("lost")])
+
+    assert bytes_sent() == before
+
+
+def test_reconnection_resumes_the_session(emulator, connect):
+    wrapper = connect(emulator)
+    wrapper.echo("ticket")  # The server sends its session tickets after the handshake
+
+    wrapper.reconnect()
+
+    assert wrapper.session_reused
+    assert wrapper.read_record(1) == b""
+
+
+def test_session_resumption_can_be_disabled(emulator, connect):
+    wrapper = connect(emulator, session_resumption=False)
+    wrapper.echo("ticket")
+
+    wrapper.reconnect()
+
+    assert not wrapper.session_reused
+
+
+def test_failed_resumption_falls_back_to_a_full_handshake(emulator, connect):
+    other = connect(emulator)
+    other.echo("ticket")
+    wrapper = connect(emulator)
+    wrapper._close_socket()
+    # A session of another SSLContext cannot be resumed by this one
+    wrapper._TLSSocketWrapper__session = other._TLSSocketWrapper__ssock.session
+
+    wrapper.connect()
+
+    assert not wrapper.session_reused
+    assert wrapper.read_record(1) == b""
+    wrapper.reconnect()
+    assert not wrapper.session_reused  # Resumption disabled for this keystore